@@ -1,10 +1,17 @@
 import os
-import google.generativeai as genai
 import base64
-from dotenv import load_dotenv
-from datetime import datetime
+from functools import lru_cache
 import json
-import re
+import time
+import nutrition
+import request_log
+from jsonstream import parse_object
+from metrics import counter, histogram, stage
+from model_registry import config_fingerprint, get_model, slot
+from resilience import ModelUnavailable, create_resilient_caller
+from response_cache import cache_key, create_cache
+from schemas import INGREDIENT_LIST_SCHEMA, JUSTIFICATION_SCHEMA, POINTS_SCHEMA, RECIPE_SCHEMA, IngredientList
+from single_flight import SingleFlight, coalesced
 
 """
 Definition of a recipe metadata, full recipe instructions elsewhere.
@@ -19,22 +26,250 @@ Definition of a recipe metadata, full recipe instructions elsewhere.
 """
 
 
-def get_ingredients_from_image(base64_encode):
+# Generation configs are built once at import and shared by every call, so the model
+# registry can bind each one to a single long-lived GenerativeModel
+RECIPE_GENERATION_CONFIG = {
+    "temperature": 2,
+    "top_p": 0.95,  # Use snake_case for consistency in Python
+    "top_k": 40,  # Adjusted key to match snake_case
+    "max_output_tokens": 8192,  # Consistent snake_case
+    "response_mime_type": "application/json",  # Consistent snake_case
+    "response_schema": RECIPE_SCHEMA
+}
+
+POINTS_GENERATION_CONFIG = {
+    "temperature": 2,
+    "max_output_tokens": 8192,  # Use snake_case for consistency in Python
+    "response_mime_type": "application/json",  # Use snake_case and correct key format
+    "response_schema": POINTS_SCHEMA
+}
+
+
+# Points are computed locally from data/nutrition.csv unless POINTS_SCORING=model. Recipes with fewer
+# than POINTS_MIN_COVERAGE of their ingredients in the table are still scored by the model.
+POINTS_SCORING = os.getenv("POINTS_SCORING", "local")
+POINTS_MIN_COVERAGE = float(os.getenv("POINTS_MIN_COVERAGE", "0.75"))
+
+
+@lru_cache(maxsize=None)
+def recipe_batch_generation_config(count):
+    return {
+        "temperature": 2,
+        "top_p": 0.95,
+        "top_k": 40,
+        "max_output_tokens": 8192,
+        "response_mime_type": "application/json",
+        "response_schema": {
+            "type": "object",
+            "properties": {
+                "recipes": {
+                    "type": "array",
+                    "items": RECIPE_SCHEMA,
+                    "min_items": count,
+                    "max_items": count,
+                    "description": "The generated recipes."
+                }
+            },
+            "required": ["recipes"]
+        }
+    }
+
+
+@lru_cache(maxsize=None)
+def justification_generation_config(count):
+    return {
+        "temperature": 1,
+        "max_output_tokens": 1024 * count,
+        "response_mime_type": "application/json",
+        "response_schema": {
+            "type": "object",
+            "properties": {
+                "justifications": {
+                    "type": "array",
+                    "items": JUSTIFICATION_SCHEMA,
+                    "min_items": count,
+                    "max_items": count,
+                    "description": "One justification per recipe, in the order the recipes are given."
+                }
+            },
+            "required": ["justifications"]
+        }
+    }
+
+
+@lru_cache(maxsize=None)
+def points_batch_generation_config(count):
+    return {
+        "temperature": 2,
+        "max_output_tokens": 8192,
+        "response_mime_type": "application/json",
+        "response_schema": {
+            "type": "object",
+            "properties": {
+                "assessments": {
+                    "type": "array",
+                    "items": POINTS_SCHEMA,
+                    "min_items": count,
+                    "max_items": count,
+                    "description": "One assessment per recipe, in the order the recipes are given."
+                }
+            },
+            "required": ["assessments"]
+        }
+    }
+
+
+@lru_cache(maxsize=None)
+def scan_batch_generation_config(count):
+    return {
+        "temperature": 1,
+        "max_output_tokens": 8192,
+        "response_mime_type": "application/json",
+        "response_schema": {
+            "type": "object",
+            "properties": {
+                "images": {
+                    "type": "array",
+                    "items": INGREDIENT_LIST_SCHEMA,
+                    "min_items": count,
+                    "max_items": count,
+                    "description": "The ingredients found in each image, in the order the images are given."
+                }
+            },
+            "required": ["images"]
+        }
+    }
+
+
+response_cache = create_cache()
+
+# Rate limit, deadlines, retries, hedging and circuit breaker around every model call, see resilience.py
+gemini = create_resilient_caller(gate=slot)
+
+# Concurrent identical model calls (same response_cache key) and scans of the same image share one call.
+# Streamed calls have their own group, a streamed and a plain call for the same prompt can't be shared.
+model_calls = SingleFlight("model")
+model_streams = SingleFlight("model_stream")
+image_scans = SingleFlight("ingredient_scan")
+
+gemini_calls = counter("gemini_calls_total", "Model calls, including ones answered from the response cache", ("call", "cached"))
+gemini_call_seconds = histogram("gemini_call_seconds", "Wall time of each model call", ("call", "cached"))
+gemini_tokens = counter("gemini_tokens_total", "Tokens reported by the model", ("call", "direction"))
+gemini_cost = counter("gemini_cost_usd_total", "Estimated model spend from token counts", ("call",))
+
+# USD per million tokens, defaults are gemini-1.5-pro list prices for prompts up to 128k tokens
+PRICE_INPUT = float(os.getenv("GEMINI_PRICE_INPUT", "1.25"))
+PRICE_OUTPUT = float(os.getenv("GEMINI_PRICE_OUTPUT", "5.00"))
+
+
+def usage_tokens(response):
+    """
+    (prompt tokens, output tokens) reported by the model, or (None, None) if it reported none.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return None, None
+    return usage.prompt_token_count, usage.candidates_token_count
+
+
+def log_model_call(kind, prompt, response_text, start, response=None, cached=False):
+    """
+    Writes the call to the request log and records it in the gemini_* metrics.
+    """
+    elapsed = time.perf_counter() - start
+    prompt_tokens, output_tokens = usage_tokens(response)
+    request_log.log(kind, prompt=prompt, response=response_text, cached=cached,
+                    latency_ms=elapsed * 1000,
+                    prompt_tokens=prompt_tokens, output_tokens=output_tokens)
+    gemini_calls.inc(call=kind, cached=str(cached).lower())
+    gemini_call_seconds.observe(elapsed, call=kind, cached=str(cached).lower())
+    if prompt_tokens is not None:
+        gemini_tokens.inc(prompt_tokens, call=kind, direction="prompt")
+        gemini_tokens.inc(output_tokens or 0, call=kind, direction="output")
+        gemini_cost.inc((prompt_tokens * PRICE_INPUT + (output_tokens or 0) * PRICE_OUTPUT) / 1e6, call=kind)
+
+
+def generate_text(model_name, prompt, generation_config, log_name, fresh=False):
+    """
+    Runs a text prompt through the model and returns the first candidate's text.
+    Identical calls (same model, prompt and generation_config) are answered from response_cache,
+    or share the call in flight when they overlap. fresh always makes a call of its own, for a
+    new answer to the same prompt; its answer still replaces the cached one. The call is logged under log_name.
+    """
+    start = time.perf_counter()
+    key = cache_key(model_name, prompt, config_fingerprint(generation_config))
+    if fresh:
+        return call_model(key, model_name, prompt, generation_config, log_name, start)
+    text = response_cache.get(key)
+    if text is not None:
+        print("Using cached model response")
+        log_model_call(log_name, prompt, text, start, cached=True)
+        return text
+    return model_calls.do(key, call_model, key, model_name, prompt, generation_config, log_name, start)
+
+
+def call_model(key, model_name, prompt, generation_config, log_name, start):
+    """
+    The model call behind generate_text, made once for all the concurrent callers of a key.
+    """
+    model = get_model(model_name, generation_config)
+    with stage('model'):
+        response = gemini.call(log_name, model.generate_content, prompt)
+    text = response.candidates[0].content.parts[0].text
+    response_cache.put(key, text)
+    log_model_call(log_name, prompt, text, start, response)
+    return text
+
+
+def stream_text(model_name, prompt, generation_config, log_name, fresh=False):
+    """
+    Streaming version of generate_text: yields the first candidate's text chunk by chunk.
+    A cached response is yielded as a single chunk.
+    """
+    start = time.perf_counter()
+    key = cache_key(model_name, prompt, config_fingerprint(generation_config))
+    if fresh:
+        yield from stream_model(key, model_name, prompt, generation_config, log_name, start)
+        return
+    text = response_cache.get(key)
+    if text is not None:
+        print("Using cached model response")
+        log_model_call(log_name, prompt, text, start, cached=True)
+        yield text
+        return
+    yield from model_streams.stream(key, stream_model, key, model_name, prompt, generation_config, log_name, start)
+
+
+def stream_model(key, model_name, prompt, generation_config, log_name, start):
+    """
+    The streamed model call behind stream_text, made once for all the concurrent callers of a key.
+    """
+    model = get_model(model_name, generation_config)
+    chunks = []
+    last_chunk = None
+    with stage('model'):
+        for chunk in gemini.stream(log_name, lambda: model.generate_content(prompt, stream=True)):
+            last_chunk = chunk
+            if not chunk.candidates or not chunk.candidates[0].content.parts:
+                continue
+            text = chunk.candidates[0].content.parts[0].text
+            chunks.append(text)
+            yield text
+    text = "".join(chunks)
+    response_cache.put(key, text)
+    # Token usage arrives with the final chunk
+    log_model_call(log_name, prompt, text, start, last_chunk)
+
+
+@coalesced(image_scans)
+def get_ingredients_from_image(base64_encode, mime_type="image/png"):
     """
     Uses Google's Gemini API to recognize ingredients in an image.
     """
     print("Detecting ingredients within image...")
 
-    load_dotenv()
-
-    # Fetch  API key from environment variables
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY is not set. Please set it as an environment variable.")
-    
-    genai.configure(api_key=api_key)
-        
-    model = genai.GenerativeModel(model_name="gemini-1.5-pro")
+    start = time.perf_counter()
+    model = get_model("gemini-1.5-pro")
     prompt = """
     Analyze the image to detect food ingredients and return a JSON object with the following structure:
 
@@ -57,101 +292,93 @@ def get_ingredients_from_image(base64_encode):
 
     Do not include any text outside of the JSON format.
     """
-    response = model.generate_content(
-        [{'mime_type': 'image/png', 'data': base64_encode}, prompt]
-    )
+    with stage('model'):
+        response = gemini.call("ingredient_classification", model.generate_content,
+                               [{'mime_type': mime_type, 'data': base64_encode}, prompt])
 
 
     result = response.text
-    log_to_file(response.text, "ingredient_classification/responses")
-
+    log_model_call("ingredient_classification", "%s\n[%s image, %d base64 chars]" % (prompt, mime_type, len(base64_encode)),
+                   result, start, response)
 
     ingredients = parse_json_response(result)
+    with stage("parse"):
+        ingredients = IngredientList.validate(ingredients).to_dict()
     print(ingredients)
     return ingredients
 
-def generate_full_recipe_instructions(ingredients, restrictions, allergies):
+@coalesced(image_scans)
+def get_ingredients_from_images(images):
     """
-    Uses Google's Gemini API to generate detailed recipe instructions based on the provided recipe header.
+    Batched get_ingredients_from_image: detects the ingredients of every image with one multimodal call.
+    images is a list of (base64, mime type). Returns one {"ingredients": [...]} per image, in the same order.
     """
-    print(f"Generating full recipe instructions for: ...")
-    load_dotenv()
-    ingredient_names = []
-    for ingred in ingredients:
-        ingredient_names.append(ingred['name'])
-
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY is not set. Please set it as an environment variable.")
-    
-    genai.configure(api_key=api_key)
+    if len(images) == 1:
+        return [get_ingredients_from_image(*images[0])]
+    print(f"Detecting ingredients within {len(images)} images...")
 
-    model = genai.GenerativeModel(model_name="gemini-1.5-pro")
+    start = time.perf_counter()
+    model = get_model("gemini-1.5-pro", scan_batch_generation_config(len(images)))
+    prompt = f"""
+    Analyze each of the {len(images)} images above to detect food ingredients. They are photos of the same pantry or fridge.
+    Return one entry per image, in the order the images are given, listing the ingredients visible in that image.
 
-    generation_config = {
-    "temperature": 2,
-    "top_p": 0.95,  # Use snake_case for consistency in Python
-    "top_k": 40,  # Adjusted key to match snake_case
-    "max_output_tokens": 8192,  # Consistent snake_case
-    "response_mime_type": "application/json",  # Consistent snake_case
-    "response_schema": {
-        "type": "object",
-        "properties": {
-            "recipe_name": {
-                "type": "string",
-                "description": "The name of the recipe."
-            },
-            "short_description": {
-                "type": "string",
-                "description": "A short description of the recipe."
-            },
-            "cooking_time": {
-                "type": "number",
-                "description": "The time required to cook the recipe in minutes."
-            },
-            "difficulty": {
-                "type": "string",
-                "enum": ["Easy", "Medium", "Hard"],
-                "description": "The difficulty level of the recipe."
-            },
-            "ingredients": {
-                "type": "array",
-                "items": {
-                    "type": "object",
-                    "properties": {
-                        "name": {"type": "string", "description": "The name of the ingredient, exactly same as given"},
-                        "count": {"type": "number", "description": "The quantity of the ingredient."},
-                        "units": {"type": "string", "description": "The measurement units for the ingredient."},
-                    },
-                    "required": ["name", "count", "units"]
-                },
-                "description": "A list of ingredients required for the recipe."
-            },
-            "instructions": {
-                "type": "array",
-                "items": {
-                    "type": "string"
-                },
-                "description": "Step-by-step instructions for preparing the recipe."
-            },
-            "url": {
-                "type": "string",
-                "description": "A URL to the full recipe or source."
-            }
-        },
-        "required": [
-            "recipe_name",
-            "short_description",
-            "cooking_time",
-            "difficulty",
-            "ingredients",
-            "instructions"
-        ]
-    }
-    }
+    For each ingredient:
+    - Provide the count of items or measurements (e.g., "1 piece", "200 grams").
+    - Estimate the expiration time in days assuming the ingredient was recently bought (e.g., fresh produce, packaged goods).
+    - Assess the carbon footprint on a scale of 1 to 3, where 3 is the least environmentally friendly.
+    """
+    contents = []
+    for i, (base64_encode, mime_type) in enumerate(images):
+        contents += [f"Image {i + 1}:", {'mime_type': mime_type, 'data': base64_encode}]
+    contents.append(prompt)
+    with stage('model'):
+        response = gemini.call("ingredient_classification_batch", model.generate_content, contents)
+
+    result = response.text
+    log_model_call("ingredient_classification_batch",
+                   "%s\n[%s]" % (prompt, ", ".join("%s image, %d base64 chars" % (mime_type, len(base64_encode))
+                                                   for base64_encode, mime_type in images)),
+                   result, start, response)
+
+    scans = parse_json_response(result).get("images") or []
+    with stage("parse"):
+        scans = [IngredientList.validate(scan).to_dict() for scan in scans]
+    if len(scans) != len(images):
+        print("expected %d image results, got %d, scanning the images one by one" % (len(images), len(scans)))
+        return [get_ingredients_from_image(*image) for image in images]
+    return scans
+
+def prioritized_names(ingredients, expiring=()):
+    """
+    Ingredient names with the soonest-expiring ones first, in expiry order, and the rest sorted,
+    so the same pantry always produces the same prompt, and so the same cache key.
+    """
+    names = {ingred['name'] for ingred in ingredients}
+    first = [name for name in dict.fromkeys(ingred['name'] for ingred in expiring) if name in names]
+    return first + sorted(names - set(first))
+
+
+def expiring_line(ingredients, expiring=()):
+    """
+    The prompt sentence asking to use up the soonest-expiring ingredients, or "" when there are none.
+    """
+    names = prioritized_names(ingredients, expiring)[:len(expiring)]
+    if not names:
+        return ""
+    return f"Prioritize the ingredients that expire soonest and use as many of them as possible: {', '.join(names)}."
+
+
+def recipe_prompt(ingredients, restrictions, allergies, expiring=()):
+    """
+    Builds the prompt and generation_config for a full recipe from the given ingredients,
+    favouring expiring, the soonest-expiring inventory items.
+    """
+    ingredient_names = prioritized_names(ingredients, expiring)
 
     prompt = f"""
     I want to generate a structured recipe header using the following ingredients: {", ".join(ingredient_names)}.
+    {expiring_line(ingredients, expiring)}
     You may assume we have common household commodities.
 
     I have the following dietary restrictions: {", ".join(allergies)}, {", ".join(restrictions)}. Do not generate any recipes that include these.
@@ -159,67 +386,54 @@ def generate_full_recipe_instructions(ingredients, restrictions, allergies):
     Structure the response in JSON format as given. The response is directly shown to end users so do not include any information about prompting.
     """
 
-    response = model.generate_content(prompt, generation_config=generation_config)
-    candidates = response.candidates  # or whatever method is provided
-    # Accessing the first candidate's text field
-    gg = candidates[0]
-    text = gg.content.parts[0].text
-          
-    log_to_file(prompt, "recipe_instructions_generation/prompts")
-    log_to_file(text, "recipe_instructions_generation/responses")
-    return text
+    return prompt, RECIPE_GENERATION_CONFIG
+
+
+def generate_full_recipe_instructions(ingredients, restrictions, allergies, expiring=(), fresh=False):
+    """
+    Uses Google's Gemini API to generate detailed recipe instructions based on the provided recipe header.
+    fresh asks the model again rather than reusing an earlier answer for the same pantry.
+    """
+    print(f"Generating full recipe instructions for: ...")
+    prompt, generation_config = recipe_prompt(ingredients, restrictions, allergies, expiring)
+    return generate_text("gemini-1.5-pro", prompt, generation_config, "recipe_instructions_generation", fresh)
+
+
+def stream_full_recipe_instructions(ingredients, restrictions, allergies, expiring=(), fresh=False):
+    """
+    Same as generate_full_recipe_instructions, but yields the response text in chunks as Gemini produces it.
+    """
+    print(f"Streaming full recipe instructions for: ...")
+    prompt, generation_config = recipe_prompt(ingredients, restrictions, allergies, expiring)
+    yield from stream_text("gemini-1.5-pro", prompt, generation_config, "recipe_instructions_generation", fresh)
 
 
 def assess_points_from_recipe_header(recipe, diseases):
     """
-    Uses Google's Gemini API to generate recipes using the given ingredients, limiting recipe generation using allergies,
-    restrictions, diseases.
+    Scores a recipe on nutrition and carbon footprint, deducting points for the given diseases.
+    Returns the JSON text of the POINTS_SCHEMA fields.
     """
     print("Assessing points based upon carbon footprint and health...")
 
-    load_dotenv()
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY is not set. Please set it as an environment variable.")
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel(model_name="gemini-1.5-pro")
     if isinstance(recipe["ingredients"], str):
         recipe["ingredients"] = json.loads(recipe["ingredients"])  # Parse string as JSON to get a list
 
+    if POINTS_SCORING == "local":
+        with stage("score"):
+            score = nutrition.score_recipes([recipe], diseases)[0]
+        if score["coverage"] >= POINTS_MIN_COVERAGE:
+            return json.dumps(local_assessments([recipe], [score], diseases)[0])
+        print("Only %d%% of the ingredients are in the nutrition table, asking the model" % (score["coverage"] * 100))
+    return assess_points_with_model(recipe, diseases)
+
+
+def assess_points_with_model(recipe, diseases):
+    """
+    Uses Google's Gemini API to estimate the nutritional values, carbon footprint and points of a recipe.
+    """
+
     # Now safely iterate over the ingredients
     ingredient_names = [ingredient["name"] for ingredient in recipe["ingredients"]]
-    generation_config = {
-    "temperature": 2,
-    "max_output_tokens": 8192,  # Use snake_case for consistency in Python
-    "response_mime_type": "application/json",  # Use snake_case and correct key format
-    "response_schema": {  # Correct key to match snake_case convention
-        "type": "object",
-        "properties": {
-            "nutritional_values": {
-                "type": "string",
-                "description": "The nutritional information as a string: calories, fats, proteins, carbs. Do not include anything else and do not format your text in anyway such as bolding."
-            },
-            "carbon_footprint": {
-                "type": "number",
-                "description": "The carbon footprint of the recipe, in ppm"
-            },
-            "points_response": {
-                "type": "number",
-                "description": "The response in numerical format, representing points, from 0-10"
-            },
-            "justification_response": {
-                "type": "string",
-                "description": "A textual breakdown or reasoning, using the given categories. Keep to around 150 words."
-            },
-            "warnings": {
-                "type": "string",
-                "description": "Warnings or alerts as a string, keep it emtpty if there are none"
-            }
-        },
-        "required": ["nutritional_values", "points_response", "justification_response"]
-    }
-    }
-
     # Define the prompt template directly
     prompt = f"""
     Based upon the recipe, I want to assess the recipe with a points system based upon its nutritional value and carbon footprint.
@@ -241,94 +455,179 @@ def assess_points_from_recipe_header(recipe, diseases):
     Nutritional values should be limited to and formatted as: Calories: (value), Fat: (value), Proteins: (value), Carbohydrates: (value),
     Structure your response in JSON format as given. The response is directly shown to end users so do not include any information about prompting.
     """
-    response = model.generate_content(prompt, generation_config=generation_config)
-    candidates = response.candidates  # or whatever method is provided
-    # Accessing the first candidate's text field
-    gg = candidates[0]
-    text = gg.content.parts[0].text
-    
-    log_to_file(prompt, "points_analysis/prompts")
-    log_to_file(text, "points_analysis/responses")
+    return generate_text("gemini-1.5-pro", prompt, POINTS_GENERATION_CONFIG, "points_analysis")
+
+
+def generate_recipe_batch(ingredients, restrictions, allergies, count, expiring=()):
+    """
+    Uses Google's Gemini API to generate count distinct recipes from the given ingredients in a single call.
+    Returns the JSON text of {"recipes": [...]}.
+    """
+    print(f"Generating a batch of {count} recipes...")
+    ingredient_names = prioritized_names(ingredients, expiring)
+    prompt = f"""
+    I want to generate {count} different structured recipes using the following ingredients: {", ".join(ingredient_names)}.
+    {expiring_line(ingredients, expiring)}
+    You may assume we have common household commodities.
+    Make the recipes clearly different from each other, e.g. in cuisine, main ingredient or cooking method.
+
+    I have the following dietary restrictions: {", ".join(allergies)}, {", ".join(restrictions)}. Do not generate any recipes that include these.
+
+    Structure the response in JSON format as given. The response is directly shown to end users so do not include any information about prompting.
+    """
+    return generate_text("gemini-1.5-pro", prompt, recipe_batch_generation_config(count), "recipe_batch_generation")
 
-    return text
+
+def assess_points_for_recipes(recipes, diseases):
+    """
+    Batched assess_points_from_recipe_header: scores every recipe with at most one model call.
+    Returns the JSON text of {"assessments": [...]}, one assessment per recipe in the same order.
+    """
+    print(f"Assessing points for {len(recipes)} recipes...")
+    if POINTS_SCORING == "local":
+        with stage("score"):
+            scores = nutrition.score_recipes(recipes, diseases)
+        if all(score["coverage"] >= POINTS_MIN_COVERAGE for score in scores):
+            return json.dumps({"assessments": local_assessments(recipes, scores, diseases)})
+    return assess_points_for_recipes_with_model(recipes, diseases)
+
+
+def assess_points_for_recipes_with_model(recipes, diseases):
+    """
+    Uses Google's Gemini API to estimate nutritional values, carbon footprint and points for every recipe in one call.
+    """
+    recipe_lines = "\n".join(
+        f"    {i + 1}. {recipe['recipe_name']}, {recipe['short_description']}. "
+        f"The ingredients: {', '.join(ingredient['name'] for ingredient in recipe['ingredients'])}."
+        for i, recipe in enumerate(recipes))
+    prompt = f"""
+    Based upon each recipe, I want to assess the recipe with a points system based upon its nutritional value and carbon footprint.
+    Use real and accurate nutritional values and carbon footprint values to the best of your abilities based on the recipe name and description.
+
+    These are the recipes I have:
+{recipe_lines}
+
+    These are diseases I have: {", ".join(diseases)}.
+
+    If they apply to a recipe, mention it and deduct points accordingly.
+
+    Provide an explanation for the points you give, clearly based upon:
+    - Real nutritional values, and healthiness of the recipe/food
+    - Carbon footprint values
+    - Deductions for diseases and restrictions violated 
+    Keep each justification to around 50 words. 
+    Keep your warnings short, and do not include warnings if not applicable.
+    Nutritional values should be limited to and formatted as: Calories: (value), Fat: (value), Proteins: (value), Carbohydrates: (value),
+    Return exactly one assessment per recipe, in the same order as the recipes above.
+    Structure your response in JSON format as given. The response is directly shown to end users so do not include any information about prompting.
+    """
+    return generate_text("gemini-1.5-pro", prompt, points_batch_generation_config(len(recipes)), "points_analysis_batch")
+
+
+def local_assessments(recipes, scores, diseases):
+    """
+    Points assessments from nutrition.py scores, with only the justification and warnings
+    written by the model (one call for all recipes). While the model is unavailable the
+    justification just states the scores.
+    """
+    recipe_lines = "\n".join(
+        f"    {i + 1}. {recipe['recipe_name']}, {recipe.get('short_description', '')}. "
+        f"The ingredients: {', '.join(ingredient['name'] for ingredient in recipe['ingredients'])}. "
+        f"{score['nutritional_values']}. Carbon footprint: {score['carbon_footprint']} kg CO2e. "
+        f"Points: {score['points_response']}/10"
+        + (f", deductions: {', '.join(score['deductions'])}." if score['deductions'] else ".")
+        for i, (recipe, score) in enumerate(zip(recipes, scores)))
+    prompt = f"""
+    These recipes have been given points out of 10 based on their nutritional value and carbon footprint:
+{recipe_lines}
+
+    These are diseases I have: {", ".join(diseases)}.
+
+    For each recipe, explain the points it was given in around 50 words, using the values above as they are.
+    Mention the deductions if there are any.
+    Keep your warnings short, and do not include warnings if not applicable.
+    Return exactly one justification per recipe, in the same order as the recipes above.
+    Structure your response in JSON format as given. The response is directly shown to end users so do not include any information about prompting.
+    """
+    try:
+        justifications = parse_json_response(generate_text("gemini-1.5-pro", prompt, justification_generation_config(len(recipes)),
+                                                           "points_justification")).get("justifications", [])
+    except (ModelUnavailable, ValueError) as e:
+        print("Justifying points without the model: %s" % e)
+        justifications = []
+    if not isinstance(justifications, list):
+        print("Ignoring justifications that are not a list: %r" % (justifications,))
+        justifications = []
+    assessments = []
+    for i, score in enumerate(scores):
+        justification = justifications[i] if i < len(justifications) else None
+        # A malformed element is replaced where it is rather than dropped, so the rest stay with their recipes
+        if not isinstance(justification, dict) or not isinstance(justification.get("justification_response"), str):
+            justification = {"justification_response": "%s. Carbon footprint: %s kg CO2e.%s" % (
+                score["nutritional_values"], score["carbon_footprint"],
+                " Deductions: %s." % ", ".join(score["deductions"]) if score["deductions"] else "")}
+        assessments.append({
+            "nutritional_values": score["nutritional_values"],
+            "carbon_footprint": score["carbon_footprint"],
+            "points_response": score["points_response"],
+            "justification_response": justification.get("justification_response", ""),
+            "warnings": justification.get("warnings", ""),
+        })
+    return assessments
 
 
 def main():
-    # test_get_ingredients_from_image()
-    # test_recipe_header_gen()
-    # test_points_analysis()
+    # Set GEMINI_BACKEND=fake to run these without an API key
+    test_get_ingredients_from_image()
+    test_recipe_generation()
+    test_points_analysis()
     test_full_recipe_generation()
     return
 
 
 def test_get_ingredients_from_image():
     image_path = "test_images/several_ingredients.png"
-    ingredients = get_ingredients_from_image(image_path)
+    with open(image_path, "rb") as image_file:
+        image = base64.b64encode(image_file.read()).decode("ascii")
+    ingredients = get_ingredients_from_image(image)
 
-    assert len(ingredients) > 0
+    assert len(ingredients["ingredients"]) > 0
     return
 
-def test_recipe_header_gen():
-    test_ingredients_1 = ["tomato", "onion", "garlic", "beef", "pasta"]
+def test_recipe_generation():
+    test_ingredients_1 = [{"name": name} for name in ["tomato", "onion", "garlic", "beef", "pasta"]]
     test_allergies_1 = ["dairy"]
-    test_previous_recipes_1 = []
 
-    ingredients = generate_recipe_header_from_ingredients(test_ingredients_1, test_allergies_1, [])
-    # ingredients = generate_recipe_header_from_ingredients(test_ingredients_1, "tomato", [])
+    recipe = parse_json_response(generate_full_recipe_instructions(test_ingredients_1, [], test_allergies_1))
 
-    assert len(ingredients) > 0
+    assert len(recipe["ingredients"]) > 0
     return
 
 def test_points_analysis():
-    response = assess_points_from_recipe_header({
+    response = parse_json_response(assess_points_from_recipe_header({
         "recipe_name": "Spaghetti Carbonara",
         "short_description": "A classic Italian pasta dish made with eggs, cheese, pancetta, and pepper.",
-        "cooking_time": "20 minutes"
-    }, ["dairy"], ["lactose intolerance"])
+        "ingredients": [{"name": "spaghetti"}, {"name": "egg"}, {"name": "pancetta"}]
+    }, ["lactose intolerance"]))
+
+    assert "points_response" in response
+    return
 
 def test_full_recipe_generation():
-    ingredients = ["chicken breast", "broccoli", "soy sauce", "garlic"]
+    ingredients = [{"name": name} for name in ["chicken breast", "broccoli", "soy sauce", "garlic"]]
     allergies = ["gluten", "dairy"]
-    previous_recipes = ["Broccoli Chicken Stir-Fry"]
-    recipe_header = generate_recipe_header_from_ingredients(ingredients, allergies, previous_recipes)
-    if recipe_header:
-        full_recipe = generate_full_recipe_instructions(recipe_header)
-        print(full_recipe)
+    recipe = parse_json_response(generate_full_recipe_instructions(ingredients, [], allergies))
+    if recipe:
+        points = parse_json_response(assess_points_from_recipe_header(recipe, []))
+        print({**recipe, **points})
 
 
 def parse_json_response(response_text):
     """
-    Parses the JSON response into a dictionary.
-    """
-    json_match = re.search(r"\{.*\}", response_text, re.DOTALL)
-    if json_match:
-        json_text = json_match.group(0)  # Extract the JSON string
-        try:
-            return json.loads(json_text)
-        except json.JSONDecodeError as e:
-            raise ValueError(f"Invalid JSON format: {e}")
-    else:
-        raise ValueError("No JSON content found in the response.")
-    
-    
-def log_to_file(log_text, folder_name):
-    """
-    Logs the provided text into a timestamped file within the specified folder.
-    Automatically creates non-existent directories in the path.
-    
-    Args:
-        log_text (str): The text to be logged.
-        folder_name (str): The folder path where the log file should be stored.
+    Parses the first JSON object in the response into a dictionary, repairing it if it was cut off.
     """
-    logs_dir = os.path.join("logs", folder_name)
-    
-    os.makedirs(logs_dir, exist_ok=True)
-
-    current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_filename = os.path.join(logs_dir, f"log_{current_time}.txt")
-    
-    with open(log_filename, "w") as log_file:
-        log_file.write(log_text + "\n")
+    with stage("parse"):
+        return parse_object(response_text)
 
 
 if __name__ == "__main__":
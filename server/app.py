@@ -1,17 +1,135 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-from database import add_to_inventory, remove_from_inventory, get_inventory, modify_profile, get_profile, add_to_recipes, get_recipes
-from algo import get_ingredients_from_image, assess_points_from_recipe_header, generate_full_recipe_instructions
+from database import DEFAULT_USER, get_backend, add_many_to_inventory, remove_from_inventory, remove_many_from_inventory, get_inventory, get_inventory_page, get_expiring, modify_profile, add_exp, get_profile, add_to_recipes, get_recipes, get_recipe_history, get_read_cache
+from algo import POINTS_MIN_COVERAGE, gemini, response_cache
+from nutrition import score_recipes
+from recipe_pipeline import MAX_BATCH, generate_recipe, generate_recipes, recipe_indexes, stream_recipe
+from scan_pipeline import MAX_IMAGES, image_pipeline, scan_cache, scan_ingredient_batch, scan_ingredients
+from jobs import QueueFull, UserLimitReached, create_job_queue
+from lazy import Lazy
+from leaderboard import create_leaderboards
+from resilience import ModelUnavailable
+from storage import project
+import metrics
+import single_flight
+import model_registry
+import request_log
 import json
-app = Flask(__name__)
-CORS(app)
+import os
+import time
+api = Blueprint('api', __name__)
+
+# Built by the first request that uses them, in the worker process that serves it
+job_queue = Lazy(create_job_queue)
+leaderboards = Lazy(create_leaderboards)
+
+# Largest page the list endpoints return, and the fields of the recipes tab list view
+MAX_PAGE_SIZE = 500
+RECIPE_LIST_FIELDS = ['recipe_name', 'points_response', 'cooking_time']
+
+# Most points one confirmed recipe can earn
+MAX_POINTS = 10
+
+# Largest request body, batch scans upload several photos at once
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', str(64 * 1024 * 1024)))
+
+# Requests are traced when they send X-Trace: 1, or all of them with TRACE_REQUESTS=1
+TRACE_REQUESTS = os.getenv('TRACE_REQUESTS', '0') == '1'
+
+http_requests = metrics.counter('http_requests_total', 'Requests handled', ('endpoint', 'method', 'status'))
+http_request_seconds = metrics.histogram('http_request_seconds', 'Time to produce each response', ('endpoint', 'method'))
+
+@api.before_app_request
+def startTiming():
+    g.start = time.perf_counter()
+    metrics.reset(trace=TRACE_REQUESTS or request.headers.get('X-Trace') == '1')
+    request_log.new_request_id(request.headers.get('X-Request-Id'))
+
+"""
+    User the request acts for: the X-User-Id header, else the user query parameter,
+    else the default single-household user
+"""
+def current_user():
+    return request.headers.get('X-User-Id') or request.args.get('user') or DEFAULT_USER
+
+"""
+    Paging and projection query parameters shared by the list endpoints:
+    limit, cursor (next_cursor of the previous page) and fields (comma separated).
+    limit is None when the client didn't ask for pages.
+"""
+def list_args():
+    limit = request.args.get('limit', type=int)
+    if limit is None and request.args.get('cursor'):
+        limit = MAX_PAGE_SIZE
+    if limit is not None and (limit < 1 or limit > MAX_PAGE_SIZE):
+        raise ValueError('limit must be between 1 and %d' % MAX_PAGE_SIZE)
+    fields = request.args.get('fields')
+    if fields == 'list':
+        fields = RECIPE_LIST_FIELDS
+    elif fields:
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+    else:
+        fields = None
+    return limit, request.args.get('cursor'), fields
+
+"""
+    JSON response with an ETag, answered with an empty 304 when it matches If-None-Match
+"""
+def conditional(body):
+    response = jsonify(body)
+    response.add_etag()
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+def bad_request(message):
+    return jsonify({'error': 'Bad Request', 'message': message}), 400
+
+"""
+    Queues fn(*args) as a background job for the current user when the request asks for it
+    with ?async=1, optionally pushing the finished job to the webhook query parameter
+    @return: 202 response with the job id, or None to run the request synchronously
+"""
+def run_async(kind, fn, *args):
+    if request.args.get('async') != '1':
+        return None
+    webhook = request.args.get('webhook')
+    error = job_queue.webhook_error(webhook) if webhook else None
+    if error:
+        return bad_request(error)
+    try:
+        job_id = job_queue.submit(kind, current_user(), fn, *args, webhook=webhook)
+    except UserLimitReached as e:
+        return jsonify({'error': 'Too Many Requests', 'message': str(e)}), 429
+    except QueueFull as e:
+        return jsonify({'error': 'Service Unavailable', 'message': str(e)}), 503
+    return jsonify({'job_id': job_id, 'status_url': '/jobs/%s' % job_id}), 202
+
+"""
+    Reports how long each request spent in the database and in model calls
+"""
+@api.after_app_request
+def reportTiming(response):
+    timing = metrics.server_timing_header()
+    if timing:
+        response.headers['Server-Timing'] = timing
+    response.headers['X-Request-Id'] = request_log.current_request_id()
+    # The route pattern, not the path, so ids in paths don't each get their own series
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    elapsed = time.perf_counter() - g.get('start', time.perf_counter())
+    http_requests.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    http_request_seconds.observe(elapsed, endpoint=endpoint, method=request.method)
+    spans = metrics.spans()
+    if spans is not None:
+        request_log.log('trace', endpoint=endpoint, method=request.method, status=response.status_code,
+                        duration_ms=elapsed * 1000, spans=spans)
+    return response
 
 """
     Add Profile Endpoint -> POST
     @params: user profile in request.data
     @return: ok
 """
-@app.route('/profile/modify', methods=['POST'])
+@api.route('/profile/modify', methods=['POST'])
 def profileModify():
     if request.method == 'POST':
         data = request.get_json()
@@ -26,7 +144,7 @@ def profileModify():
             diseases = [token.strip() for token in data.get('diseases').split(',')]
 
         modify_profile(data.get('name'), data.get('exp'), allergies, 
-                       restrictions, diseases)
+                       restrictions, diseases, user_id=current_user())
         return "OK", 200
     else:
         return error()
@@ -35,53 +153,99 @@ def profileModify():
     Get Profile Endpoint -> GET
     @return: user profile
 """
-@app.route('/profile/get', methods=['GET'])
+@api.route('/profile/get', methods=['GET'])
 def profileGet():
     if request.method == 'GET':
-        return get_profile(), 200
+        return get_profile(user_id=current_user()), 200
     else:
         return error()
     
 """
     Get Ingredients -> GET
-    @return: all current ingredients
+    @params: limit, cursor, fields (query string, optional)
+    @return: all current ingredients, or one page of them ordered by name with its next_cursor
 """
-@app.route('/inventory/get', methods=['GET'])
+@api.route('/inventory/get', methods=['GET'])
 def inventoryGet():
     if request.method == 'GET':
-        return get_inventory(), 200
+        try:
+            limit, cursor, fields = list_args()
+            if limit is None:
+                inventory = get_inventory(user_id=current_user())
+                inventory['ingredients'] = [project(item, fields, ('name',)) for item in inventory['ingredients']]
+            else:
+                inventory = get_inventory_page(limit, cursor, fields, user_id=current_user())
+        except ValueError as e:
+            return bad_request(str(e))
+        return conditional(inventory)
+    else:
+        return error()
+
+"""
+    Expiring Ingredients -> GET
+    @params: limit (default 10), days (only items expiring within this many days, optional)
+    @return: the ingredients that expire soonest, soonest first
+"""
+@api.route('/inventory/expiring', methods=['GET'])
+def inventoryExpiring():
+    if request.method == 'GET':
+        limit = request.args.get('limit', 10, type=int)
+        days = request.args.get('days', type=float)
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            return bad_request('limit must be between 1 and %d' % MAX_PAGE_SIZE)
+        if days is not None and days < 0:
+            return bad_request('days must not be negative')
+        return conditional(get_expiring(limit, days, user_id=current_user()))
     else:
         return error()
 
 """
     Add Image Endpoint -> POST
-    @params: base64 image in request.data
-    @return: json with list of ingredients + amount
+    @params: base64 image in request.data, async and webhook (query string, optional)
+    @return: json with list of ingredients + amount, or the id of the job scanning them
 """
-@app.route('/ingredients/scan', methods=['POST'])
+@api.route('/ingredients/scan', methods=['POST'])
 def ingredientsScan():
     if request.method == 'POST':  
         print("received request")
-        ingredients = get_ingredients_from_image(request.get_json().get('image'))
-        print(ingredients) 
-        # example {'ingredients': [{'name': 'tomato', 'count': 4, 'units': 'piece', 'expiry': 7, 'carbon_footprint': 1}]}
-        return ingredients, 200
+        image = request.get_json().get('image')
+        return run_async('scan', scan_ingredients, image, current_user()) or (scan_ingredients(image, current_user()), 200)
 
     else:
         return error()
-    
+
+"""
+    Batch Scan Endpoint -> POST
+    @params: photos of one pantry as multipart/form-data files named images (up to SCAN_MAX_IMAGES),
+             async and webhook (query string, optional)
+    @return: json with the ingredients of all the photos merged (names and units normalized, counts summed)
+             and how many each photo showed, or the id of the job scanning them
+"""
+@api.route('/ingredients/scan/batch', methods=['POST'])
+def ingredientsScanBatch():
+    if request.method == 'POST':
+        files = [file for file in request.files.getlist('images') if file.filename]
+        if not files:
+            return bad_request('send the photos as multipart/form-data files named images')
+        if len(files) > MAX_IMAGES:
+            return bad_request('at most %d images can be scanned at once' % MAX_IMAGES)
+        uploads = [(file.read(), file.mimetype) for file in files]
+        return run_async('scan', scan_ingredient_batch, uploads, current_user()) or (scan_ingredient_batch(uploads, current_user()), 200)
+
+    else:
+        return error()
+
 """
     Validate Ingredients Endpoint -> POST
     @params: ingredients json
     @return: success
 """
-@app.route('/ingredients/validate', methods=['POST'])
+@api.route('/ingredients/validate', methods=['POST'])
 def ingredientsValidate():
     if request.method == 'POST':  
         print("received request to add all ingredients")
         ingredients = request.get_json()
-        for ingred in ingredients:
-            add_to_inventory(ingred['name'], ingred['count'], ingred['units'], ingred['expiry'], ingred['carbon_footprint'])
+        add_many_to_inventory(ingredients, user_id=current_user())
         return "OK", 200
 
     else:
@@ -91,27 +255,33 @@ def ingredientsValidate():
     Delete Ingredient Endpoint -> POST
     @param: ingredient name
 """
-@app.route('/ingredients/delete', methods=['POST'])
+@api.route('/ingredients/delete', methods=['POST'])
 def ingredientsDelete():
     if request.method == 'POST':
         data = request.get_json()
         name = data['name']
-        remove_from_inventory(name, 999999)
+        remove_from_inventory(name, 999999, user_id=current_user())
         return "OK", 200
     else:
         return error()
     
 """
     Generate Recipe Endpoint -> GET
-    @return: json with list of recipes and details
+    @params: async and webhook (query string, optional),
+             fresh (query string, optional, 1 to skip serving a matching stored recipe or cached model response)
+    @return: json with list of recipes and details, or the id of the job generating it
 """
-@app.route('/recipes/generate', methods=['GET'])
+@api.route('/recipes/generate', methods=['GET'])
 def recipesGenerate():
     if request.method == 'GET':
-        profile = get_profile()
-        inventory = get_inventory()
-        recipe = generate_full_recipe_instructions(inventory['ingredients'], profile['allergies'], profile['restrictions'])
-        recipe_parsed = json.loads(recipe)        # format:
+        fresh = request.args.get('fresh') == '1'
+        queued = run_async('recipe', generate_recipe, current_user(), fresh)
+        if queued is not None:
+            return queued
+        # a stored recipe the pantry covers is served as is, otherwise profile/inventory reads run
+        # concurrently and points scoring overlaps the recipe stream, see recipe_pipeline.py
+        recipe_info = generate_recipe(current_user(), fresh)
+        # format:
         # {{
         #     "recipe_name": "your answer",
         #     "short_description": "your answer",
@@ -119,60 +289,331 @@ def recipesGenerate():
         #     "difficulty": "Choose from: Easy/Medium/Hard",
         #     "ingredients": ["List all required ingredients here"],
         #     "instructions": ["Step-by-step cooking instructions"],
-        #      "url" : "dhdhj"
-        # }}
-        points_analysis = assess_points_from_recipe_header(recipe_parsed, profile['diseases'])
-        # format:     {{
-        # "nutritional_values": "your_response_here",
-        # "points_response": "your_response_here",
-        # "justification_response": "your_response_here",
-        # "warnings": "your_response_here" # Include warnings if applicable, or leave as an empty string.
+        #     "url" : "dhdhj",
+        #     "nutritional_values": "your_response_here",
+        #     "points_response": "your_response_here",
+        #     "justification_response": "your_response_here",
+        #     "warnings": "your_response_here"
         # }}
-        points_parsed = json.loads(points_analysis)        # format:
-        print("recipe info", points_parsed)
-        
-        recipe_info = {**recipe_parsed, **points_parsed}
-
         return recipe_info, 200
     else:
         return error()
 
+"""
+    Stream Recipe Endpoint -> GET
+    @params: fresh (query string, optional, 1 to skip serving a matching stored recipe or cached model response)
+    @return: text/event-stream of field, step, points and done events as the recipe is generated,
+             or an error event if generation fails
+"""
+@api.route('/recipes/stream', methods=['GET'])
+def recipesStream():
+    if request.method == 'GET':
+        user_id = current_user()
+        fresh = request.args.get('fresh') == '1'
+
+        def events():
+            try:
+                for event, data in stream_recipe(user_id, fresh):
+                    yield "event: %s\ndata: %s\n\n" % (event, json.dumps(data))
+            except Exception as e:
+                print("recipe stream failed: %s" % e)
+                yield "event: error\ndata: %s\n\n" % json.dumps({'message': str(e)})
+
+        return Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    else:
+        return error()
+
+"""
+    Generate Recipe Batch Endpoint -> GET
+    @params: count (query string, 1-5, default 3)
+    @return: json with count distinct recipes and their details
+"""
+@api.route('/recipes/generate/batch', methods=['GET'])
+def recipesGenerateBatch():
+    if request.method == 'GET':
+        count = request.args.get('count', default=3, type=int)
+        if count < 1 or count > MAX_BATCH:
+            return bad_request('count must be between 1 and %d' % MAX_BATCH)
+        return {"recipes": generate_recipes(count, current_user())}, 200
+    else:
+        return error()
+
+"""
+    Points a confirmed recipe earns. points_response comes from the client, so it has to be a whole
+    number from 0 to MAX_POINTS, and when the nutrition table covers the recipe's ingredients the
+    points are recomputed here instead of taken from it
+    @return: points, or None when points_response is not a valid score
+"""
+def confirmed_points(recipe_info, diseases):
+    claimed = recipe_info.get('points_response')
+    if isinstance(claimed, str) and claimed.strip().isdigit():
+        claimed = int(claimed)
+    elif isinstance(claimed, float) and claimed.is_integer():
+        claimed = int(claimed)
+    if isinstance(claimed, bool) or not isinstance(claimed, int) or not 0 <= claimed <= MAX_POINTS:
+        return None
+    score = score_recipes([recipe_info], diseases)[0]
+    return score['points_response'] if score['coverage'] >= POINTS_MIN_COVERAGE else claimed
+
 """
     Confirm Recipes Endpoint -> POST
     @param: ingredients list
+    A stored recipe served again (matched_recipe_id) is already in the history, so cooking it
+    again uses up the ingredients and earns points without adding a second copy
 """
-@app.route('/recipes/confirm', methods=['POST'])
+@api.route('/recipes/confirm', methods=['POST'])
 def recipesConfirm():
     if request.method == 'POST':
-        profile = get_profile()
+        user_id = current_user()
+        profile = get_profile(user_id=user_id)
         data = request.get_json()
         recipe_info = data['recipe']
-        new_points = int(recipe_info['points_response'])
         ingredients = recipe_info['ingredients']
-        for ingred in ingredients:
-            remove_from_inventory(ingred['name'], ingred['count'])
-        modify_profile(profile['name'], profile['exp'] + new_points, profile['allergies'], 
-                       profile['restrictions'], profile['restrictions'])
-        add_to_recipes(recipe_info['recipe_name'], recipe_info['short_description'], recipe_info['cooking_time'], recipe_info['difficulty'],  recipe_info['ingredients'], recipe_info['instructions'], "",
-                       recipe_info['nutritional_values'], recipe_info['points_response'], recipe_info['justification_response'], recipe_info['warnings'])
+        if not isinstance(ingredients, list) or not all(isinstance(ingred, dict) and 'name' in ingred
+                                                         for ingred in ingredients):
+            return bad_request('ingredients must be a list of objects with a name')
+        new_points = confirmed_points(recipe_info, profile['diseases'])
+        if new_points is None:
+            return bad_request('points_response must be a whole number from 0 to %d' % MAX_POINTS)
+        remove_many_from_inventory(ingredients, user_id=user_id)
+        add_exp(new_points, user_id=user_id)
+        if not recipe_info.get('matched_recipe_id'):
+            recipe_id = add_to_recipes(recipe_info['recipe_name'], recipe_info['short_description'], recipe_info['cooking_time'], recipe_info['difficulty'],  recipe_info['ingredients'], recipe_info['instructions'], "",
+                           recipe_info['nutritional_values'], new_points, recipe_info['justification_response'], recipe_info['warnings'], user_id=user_id)
+            recipe_indexes.add(user_id, {**{name: value for name, value in recipe_info.items()
+                                            if name not in ('matched_recipe_id', 'coverage')},
+                                         'points_response': new_points, 'url': "", 'id': recipe_id})
+        leaderboards.record(user_id, profile['name'], new_points)
         return jsonify({"message": "Recipe confirmed successfully"}), 200
     else:
         return error()
 
 
+"""
+    Leaderboard Endpoint -> GET
+    @params: window (all or week, default all), limit (default 20), cursor (query string, optional)
+    @return: one page of users ranked by points with its next_cursor, all-time entries also carry weekly_points
+"""
+@api.route('/leaderboard', methods=['GET'])
+def leaderboardGet():
+    if request.method == 'GET':
+        limit = request.args.get('limit', 20, type=int)
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            return bad_request('limit must be between 1 and %d' % MAX_PAGE_SIZE)
+        try:
+            board = leaderboards.top(request.args.get('window', 'all'), limit, request.args.get('cursor'))
+        except ValueError as e:
+            return bad_request(str(e))
+        return conditional(board)
+    else:
+        return error()
+
+"""
+    My Rank Endpoint -> GET
+    @params: window (all or week, default all)
+    @return: the current user's rank and points, and the number of ranked users
+"""
+@api.route('/leaderboard/me', methods=['GET'])
+def leaderboardMe():
+    if request.method == 'GET':
+        try:
+            return conditional(leaderboards.rank(request.args.get('window', 'all'), current_user()))
+        except ValueError as e:
+            return bad_request(str(e))
+    else:
+        return error()
+
+
 """
     Get Recipes Endpoint -> GET
-    @return: recipes
+    @params: limit, cursor, fields (query string, optional, fields=list for the list view),
+             since (query string, optional, created_at of the newest recipe the client has)
+    @return: recipes newest first, or one page of them with its next_cursor
 """
-@app.route('/recipes/get', methods=['GET'])
+@api.route('/recipes/get', methods=['GET'])
 def recipesGet():
     if request.method == 'GET':
-        return get_recipes(), 200
+        try:
+            limit, cursor, fields = list_args()
+            since = request.args.get('since', type=float)
+            if limit is None:
+                recipes = get_recipes(fields, since, user_id=current_user())
+            else:
+                recipes = get_recipe_history(limit, cursor, fields, since, user_id=current_user())
+        except ValueError as e:
+            return bad_request(str(e))
+        return conditional(recipes)
+    else:
+        return error()
+
+"""
+    Cache Stats Endpoint -> GET
+    @return: hit/miss counters of the model response cache, the scan cache, the profile/inventory read cache,
+             the stored recipe index, the leaderboards and the calls coalesced by single_flight.py
+"""
+@api.route('/cache/stats', methods=['GET'])
+def cacheStats():
+    if request.method == 'GET':
+        return {'responses': response_cache.stats(), 'scans': scan_cache.stats(),
+                'reads': get_read_cache().stats(), 'recipe_index': recipe_indexes.stats(),
+                'leaderboard': leaderboards.stats(), 'single_flight': single_flight.stats()}, 200
+    else:
+        return error()
+
+"""
+    Image Pipeline Stats Endpoint -> GET
+    @return: images normalized, bytes in/out and seconds per stage
+"""
+@api.route('/images/stats', methods=['GET'])
+def imageStats():
+    if request.method == 'GET':
+        return image_pipeline.stats(), 200
+    else:
+        return error()
+
+"""
+    Model Registry Stats Endpoint -> GET
+    @return: one-off Gemini setup cost (configure, model builds), model reuse counts and the
+             resilience layer's retries, timeouts, hedges and circuit breaker state
+"""
+@api.route('/models/stats', methods=['GET'])
+def modelStats():
+    if request.method == 'GET':
+        return {**model_registry.stats(), 'resilience': gemini.stats()}, 200
+    else:
+        return error()
+
+"""
+    Request Log Stats Endpoint -> GET
+    @return: model call log records written, dropped and still queued
+"""
+@api.route('/logs/stats', methods=['GET'])
+def logStats():
+    if request.method == 'GET':
+        return request_log.get_logger().stats(), 200
+    else:
+        return error()
+
+"""
+    Metrics Endpoint -> GET
+    @return: request, stage, model, database and cache metrics in the Prometheus text format
+"""
+@api.route('/metrics', methods=['GET'])
+def metricsGet():
+    if request.method == 'GET':
+        jobs = job_queue.stats()
+        log_stats = request_log.get_logger().stats()
+        gauges = {
+            'response_cache_hit_ratio': response_cache.stats()['hit_ratio'],
+            'scan_cache_hit_ratio': scan_cache.stats()['hit_ratio'],
+            'read_cache_hit_ratio': get_read_cache().stats()['hit_ratio'],
+            'jobs_queued': jobs['queued'],
+            'jobs_running': jobs['running'],
+            'request_log_queued': log_stats['queued'],
+            'request_log_dropped': log_stats['dropped'],
+            'gemini_circuit_open': int(gemini.breaker.stats()['state'] != 'closed'),
+        }
+        return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+    else:
+        return error()
+
+"""
+    Job Status Endpoint -> GET
+    @return: the job's status (queued, running, done or failed) and, once finished, its result or error
+    Only the submitting user is answered, but X-User-Id is not authenticated, so the random job id
+    is what keeps a job private: it must not be shared or logged where others can read it
+"""
+@api.route('/jobs/<job_id>', methods=['GET'])
+def jobGet(job_id):
+    if request.method == 'GET':
+        job = job_queue.get(job_id)
+        if job is None or job['user_id'] != current_user():
+            return error()
+        return job, 200
+    else:
+        return error()
+
+"""
+    Job Queue Stats Endpoint -> GET
+    @return: queue depth, running jobs, rejections and time spent waiting and running
+"""
+@api.route('/jobs/stats', methods=['GET'])
+def jobStats():
+    if request.method == 'GET':
+        return job_queue.stats(), 200
+    else:
+        return error()
+
+"""
+    Liveness Endpoint -> GET
+    @return: ok while the process can answer requests; checks no dependencies
+"""
+@api.route('/healthz', methods=['GET'])
+def healthGet():
+    if request.method == 'GET':
+        return {'status': 'ok'}, 200
+    else:
+        return error()
+
+"""
+    Readiness Endpoint -> GET
+    Builds the storage backend and configures Gemini if no request has yet, so probing it
+    after a worker starts moves that one-off cost off the first user request
+    @return: 200 when storage and Gemini are usable and the circuit breaker is closed,
+             else 503 with the failing checks
+"""
+@api.route('/readyz', methods=['GET'])
+def readyGet():
+    if request.method == 'GET':
+        checks = {}
+        try:
+            get_backend()
+            checks['storage'] = 'ok'
+        except Exception as e:
+            checks['storage'] = str(e)
+        try:
+            model_registry.configure()
+            checks['model'] = 'ok'
+        except Exception as e:
+            checks['model'] = str(e)
+        # Half open with its trial call in flight rejects every other call, like open
+        circuit = gemini.breaker.stats()
+        stuck = circuit['state'] == 'open' or (circuit['state'] == 'half_open' and circuit['trial_in_flight'])
+        checks['circuit'] = circuit['state'] if stuck else 'ok'
+        ready = all(check == 'ok' for check in checks.values())
+        return {'status': 'ready' if ready else 'unavailable', 'checks': checks}, 200 if ready else 503
     else:
         return error()
 
 def error():
     return jsonify({'error': 'Not Found', 'message': 'The requested URL was not found on the server.'}), 404
 
+"""
+    Gemini is rate limited, failing or behind an open circuit breaker: 503 with a Retry-After hint
+"""
+@api.app_errorhandler(ModelUnavailable)
+def modelUnavailable(e):
+    response = jsonify({'error': 'Service Unavailable', 'message': str(e)})
+    response.status_code = 503
+    if e.retry_after is not None:
+        response.headers['Retry-After'] = str(max(1, round(e.retry_after)))
+    return response
+
+"""
+    Builds the Flask app around the endpoints above. Nothing heavy happens here: the storage
+    backend, Gemini and the job workers are created on first use, so a production server
+    (serve.py) can import the app once and fork workers that each build their own
+"""
+def create_app():
+    app = Flask(__name__)
+    app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+    CORS(app)
+    app.register_blueprint(api)
+    return app
+
+app = create_app()
+
 if __name__ == '__main__':
+    model_registry.configure()
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,290 @@
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+Load test for the server.
+
+By default the app is driven in-process through Flask's test client, with the
+in-memory storage backend and the fake Gemini backend (fake_model.py), so a run
+needs no credentials or network and only measures our own request path plus the
+configured model latency. --url drives a running server over HTTP instead; start
+it with the same GEMINI_BACKEND / STORAGE_BACKEND settings to get comparable runs.
+
+Reports p50/p95/p99 latency, requests/sec and the mean Server-Timing stages
+(db, model, image, ...) per endpoint.
+
+    python benchmark.py --concurrency 16 --requests 500 --latency 0.2
+    python benchmark.py --endpoints recipes/get,inventory/get --no-cache --json results.json
+    GEMINI_TIMEOUT=1 GEMINI_HEDGE_AFTER=0.5 python benchmark.py --error-rate 0.2 --stall-rate 0.05
+"""
+
+ENDPOINTS = [
+    "profile/get", "profile/modify", "inventory/get", "inventory/expiring", "ingredients/scan", "ingredients/scan/batch",
+    "ingredients/validate",
+    "ingredients/delete", "recipes/generate", "recipes/stream", "recipes/generate/batch",
+    "recipes/confirm", "recipes/get", "leaderboard",
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="base URL of a running server, default is in-process")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight at once")
+    parser.add_argument("--requests", type=int, default=200, help="total requests to send")
+    parser.add_argument("--users", type=int, default=8, help="distinct users the requests act for")
+    parser.add_argument("--images", type=int, default=16, help="distinct images used by scans")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma separated endpoints to drive")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake model latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05, help="fake model latency jitter in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake model calls that fail")
+    parser.add_argument("--error-code", type=int, default=503, help="HTTP status of the injected failures")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="share of fake model calls that stall")
+    parser.add_argument("--stall", type=float, default=5.0, help="seconds a stalled fake model call adds")
+    parser.add_argument("--no-cache", action="store_true", help="disable the response, scan and read caches")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="keep the server's own output")
+    return parser.parse_args()
+
+
+def configure_environment(args):
+    """
+    Must run before app is imported: the backends and caches read their settings at import.
+    """
+    os.environ.setdefault("STORAGE_BACKEND", "memory")
+    os.environ.setdefault("GEMINI_BACKEND", "fake")
+    os.environ["FAKE_MODEL_LATENCY"] = str(args.latency)
+    os.environ["FAKE_MODEL_JITTER"] = str(args.jitter)
+    os.environ["FAKE_MODEL_ERROR_RATE"] = str(args.error_rate)
+    os.environ["FAKE_MODEL_ERROR_CODE"] = str(args.error_code)
+    os.environ["FAKE_MODEL_STALL_RATE"] = str(args.stall_rate)
+    os.environ["FAKE_MODEL_STALL"] = str(args.stall)
+    os.environ.setdefault("REQUEST_LOG_DIR", tempfile.mkdtemp(prefix="benchmark_logs_"))
+    os.environ.setdefault("RESPONSE_CACHE_DIR", "")
+    if args.no_cache:
+        for variable in ("RESPONSE_CACHE_TTL", "SCAN_CACHE_TTL", "READ_CACHE_TTL"):
+            os.environ[variable] = "0"
+
+
+class Upload:
+    """
+    Body of a multipart/form-data request, the photos as files named images
+    """
+
+    def __init__(self, photos):
+        self.photos = photos
+
+    def encode(self):
+        boundary = "benchmark%016x" % random.getrandbits(64)
+        parts = [b"--%s\r\nContent-Disposition: form-data; name=\"images\"; filename=\"photo%d.png\"\r\n"
+                 b"Content-Type: image/png\r\n\r\n%s\r\n" % (boundary.encode(), i, photo)
+                 for i, photo in enumerate(self.photos)]
+        return b"".join(parts) + b"--%s--\r\n" % boundary.encode(), "multipart/form-data; boundary=%s" % boundary
+
+
+class LocalClient:
+    def __init__(self):
+        import app
+        self.client = app.app.test_client()
+
+    def request(self, method, path, user_id, body=None):
+        if isinstance(body, Upload):
+            data, content_type = body.encode()
+            response = self.client.open(path, method=method, data=data, content_type=content_type,
+                                        headers={"X-User-Id": user_id})
+        else:
+            response = self.client.open(path, method=method, json=body, headers={"X-User-Id": user_id})
+        response.get_data()
+        return response.status_code, response.headers.get("Server-Timing", "")
+
+
+class HttpClient:
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def request(self, method, path, user_id, body=None):
+        if isinstance(body, Upload):
+            data, content_type = body.encode()
+        else:
+            data, content_type = json.dumps(body).encode("utf-8") if body is not None else None, "application/json"
+        request = urllib.request.Request(self.url + path, data=data, method=method,
+                                         headers={"X-User-Id": user_id, "Content-Type": content_type})
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                response.read()
+                return response.status, response.headers.get("Server-Timing", "")
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers.get("Server-Timing", "")
+        except OSError:
+            return 0, ""
+
+
+def make_images(count, seed):
+    """
+    count small random PNGs, base64 encoded. Different enough that they don't share a scan cache entry.
+    """
+    from PIL import Image
+
+    rng = random.Random(seed)
+    images = []
+    for _ in range(count):
+        image = Image.frombytes("RGB", (64, 64), bytes(rng.getrandbits(8) for _ in range(64 * 64 * 3)))
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        images.append(base64.b64encode(buffer.getvalue()).decode("ascii"))
+    return images
+
+
+def pantry(rng):
+    from fake_model import fake_ingredients
+    return fake_ingredients(rng)["ingredients"]
+
+
+def confirmed_recipe(rng):
+    from fake_model import fake_points, fake_recipe
+    names = [item["name"] for item in pantry(rng)]
+    return {**fake_recipe(rng, names), **fake_points(rng)}
+
+
+def build_request(endpoint, rng, images):
+    """
+    (method, path, body) for one request to endpoint
+    """
+    if endpoint == "profile/modify":
+        return "POST", "/profile/modify", {"name": "bench", "exp": rng.randint(0, 100), "allergies": [],
+                                           "restrictions": [], "diseases": []}
+    if endpoint == "ingredients/scan":
+        return "POST", "/ingredients/scan", {"image": rng.choice(images)}
+    if endpoint == "ingredients/scan/batch":
+        return "POST", "/ingredients/scan/batch", Upload([base64.b64decode(image)
+                                                          for image in rng.sample(images, min(4, len(images)))])
+    if endpoint == "ingredients/validate":
+        return "POST", "/ingredients/validate", pantry(rng)
+    if endpoint == "ingredients/delete":
+        return "POST", "/ingredients/delete", {"name": rng.choice(pantry(rng))["name"]}
+    if endpoint == "recipes/generate/batch":
+        return "GET", "/recipes/generate/batch?count=3", None
+    if endpoint == "recipes/confirm":
+        return "POST", "/recipes/confirm", {"recipe": confirmed_recipe(rng)}
+    return "GET", "/" + endpoint, None
+
+
+def parse_server_timing(header):
+    stages = {}
+    for entry in header.split(","):
+        name, _, duration = entry.strip().partition(";dur=")
+        if name and duration:
+            stages[name] = float(duration)
+    return stages
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def seed_users(client, users, rng):
+    for user_id in users:
+        client.request("POST", "/profile/modify", user_id, {"name": user_id, "exp": 0, "allergies": [],
+                                                            "restrictions": [], "diseases": []})
+        client.request("POST", "/ingredients/validate", user_id, pantry(rng))
+
+
+def run(args):
+    configure_environment(args)
+    client = HttpClient(args.url) if args.url else LocalClient()
+    endpoints = [endpoint.strip() for endpoint in args.endpoints.split(",") if endpoint.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        raise SystemExit("unknown endpoints: %s" % ", ".join(sorted(unknown)))
+
+    rng = random.Random(args.seed)
+    users = ["bench%d" % i for i in range(args.users)]
+    images = make_images(args.images, args.seed) if any(endpoint.startswith("ingredients/scan") for endpoint in endpoints) else []
+    seed_users(client, users, rng)
+    plan = [(endpoint, rng.choice(users), build_request(endpoint, rng, images))
+            for endpoint in (endpoints[i % len(endpoints)] for i in range(args.requests))]
+    rng.shuffle(plan)
+
+    results = {endpoint: [] for endpoint in endpoints}
+    lock = threading.Lock()
+
+    def send(entry):
+        endpoint, user_id, (method, path, body) = entry
+        start = time.perf_counter()
+        status, timing = client.request(method, path, user_id, body)
+        elapsed = time.perf_counter() - start
+        with lock:
+            results[endpoint].append((elapsed, status, parse_server_timing(timing)))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(send, plan))
+    wall = time.perf_counter() - start
+    return summarize(results, wall, args)
+
+
+def summarize(results, wall, args):
+    report = {"concurrency": args.concurrency, "requests": args.requests, "wall_seconds": wall,
+              "requests_per_second": args.requests / wall if wall else 0.0, "endpoints": {}}
+    all_latencies = []
+    for endpoint, samples in results.items():
+        latencies = [elapsed * 1000 for elapsed, _, _ in samples]
+        all_latencies.extend(latencies)
+        stages = {}
+        for _, _, timing in samples:
+            for name, duration in timing.items():
+                stages[name] = stages.get(name, 0.0) + duration
+        report["endpoints"][endpoint] = {
+            "count": len(samples),
+            "errors": sum(1 for _, status, _ in samples if status == 0 or status >= 400),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "stages_mean_ms": {name: total / len(samples) for name, total in stages.items()},
+        }
+    report["p50_ms"] = percentile(all_latencies, 50)
+    report["p95_ms"] = percentile(all_latencies, 95)
+    report["p99_ms"] = percentile(all_latencies, 99)
+    return report
+
+
+def print_report(report):
+    print("%-24s %6s %6s %9s %9s %9s  %s" % ("endpoint", "count", "errors", "p50 ms", "p95 ms", "p99 ms", "stages (mean ms)"))
+    for endpoint, row in report["endpoints"].items():
+        stages = " ".join("%s=%.1f" % item for item in sorted(row["stages_mean_ms"].items()))
+        print("%-24s %6d %6d %9.1f %9.1f %9.1f  %s" % (endpoint, row["count"], row["errors"],
+                                                        row["p50_ms"], row["p95_ms"], row["p99_ms"], stages))
+    print("%-24s %6d %6s %9.1f %9.1f %9.1f" % ("all", report["requests"], "", report["p50_ms"],
+                                                report["p95_ms"], report["p99_ms"]))
+    print("%.1f requests/sec over %.2fs at concurrency %d" % (report["requests_per_second"], report["wall_seconds"],
+                                                               report["concurrency"]))
+
+
+def main():
+    args = parse_args()
+    with open(os.devnull, "w") as devnull, contextlib.ExitStack() as stack:
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+        report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump(report, results_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+"""
+Cold start profile of the server.
+
+Starts fresh interpreters that import app.py under `python -X importtime`, then
+answer the first /healthz, /readyz and /inventory/get through the test client, and
+reports the median import time, the time to each first response and the modules
+that took longest to import (cumulative, so a package includes what it imports).
+Like benchmark.py it defaults to the in-memory storage backend and the fake Gemini
+backend; run it with GEMINI_BACKEND=gemini to include configuring the real SDK.
+
+    python coldstart.py
+    python coldstart.py --runs 5 --top 15 --json coldstart.json
+"""
+
+PROBE = """
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+firsts = {}
+for path in ("/healthz", "/readyz", "/inventory/get"):
+    request_start = time.perf_counter()
+    status = client.get(path).status_code
+    firsts[path] = {"status": status, "seconds": time.perf_counter() - request_start}
+print("COLDSTART " + json.dumps({"import_seconds": imported - start, "first_requests": firsts}))
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters to start")
+    parser.add_argument("--top", type=int, default=10, help="slowest modules to list")
+    parser.add_argument("--json", help="also write the results to this file")
+    return parser.parse_args()
+
+
+def parse_importtime(stderr):
+    """
+    {module: cumulative microseconds} from the -X importtime lines of one run
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def profile_once():
+    environment = dict(os.environ)
+    environment.setdefault("STORAGE_BACKEND", "memory")
+    environment.setdefault("GEMINI_BACKEND", "fake")
+    environment.setdefault("REQUEST_LOG_DIR", tempfile.mkdtemp(prefix="coldstart_logs_"))
+    environment.setdefault("RESPONSE_CACHE_DIR", "")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import json\n" + PROBE],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env=environment,
+                            capture_output=True, text=True, check=True)
+    report = next(json.loads(line[len("COLDSTART "):]) for line in result.stdout.splitlines()
+                  if line.startswith("COLDSTART "))
+    report["modules"] = parse_importtime(result.stderr)
+    return report
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+
+def summarize(runs, top):
+    paths = list(runs[0]["first_requests"])
+    modules = {name: median([run["modules"].get(name, 0) for run in runs]) / 1e6 for name in runs[0]["modules"]}
+    return {
+        "runs": len(runs),
+        "import_seconds": median([run["import_seconds"] for run in runs]),
+        "first_requests": {path: {"status": runs[-1]["first_requests"][path]["status"],
+                                  "seconds": median([run["first_requests"][path]["seconds"] for run in runs])}
+                           for path in paths},
+        "slowest_modules": sorted(modules.items(), key=lambda entry: -entry[1])[:top],
+    }
+
+
+def print_report(report):
+    print("import app: %.0f ms (median of %d runs)" % (report["import_seconds"] * 1000, report["runs"]))
+    for path, first in report["first_requests"].items():
+        print("first %-14s %4d  %8.1f ms" % (path, first["status"], first["seconds"] * 1000))
+    print("\nslowest imports (cumulative):")
+    for name, seconds in report["slowest_modules"]:
+        print("  %8.1f ms  %s" % (seconds * 1000, name))
+
+
+def main():
+    args = parse_args()
+    report = summarize([profile_once() for _ in range(args.runs)], args.top)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump(report, results_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
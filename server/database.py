@@ -1,125 +1,336 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
-
-cred = credentials.Certificate('keys/service-account-key.json')
-firebase_admin.initialize_app(cred)
-
-db = firestore.client()
-
-'''
-    Add to 'inventory' collection
-    @params: name, amount, units, expiry, carbonImpact
-'''
-def add_to_inventory(name, count, units, expiry, carbon_footprint):
-    inventory_ref = db.collection('inventory')
-    inventory_ref = inventory_ref.document(name)
-    doc = inventory_ref.get()
-    if doc.exists:
-        inventory_ref.update({'count': firestore.Increment(count)})
-    else:
-        inventory_ref.set({
-            'count': count,
-            'units': units,
-            'expiry': expiry,
-            'carbon_footprint': carbon_footprint
-        })
-    print("%s added to inventory" % (name))
+import threading
+import time
+from contextlib import contextmanager
+from metrics import counter, histogram, stage
+from read_cache import create_read_cache
+from single_flight import SingleFlight
+from storage import DAY_SECONDS, create_backend
+
+'''
+    The storage backend is picked by the STORAGE_BACKEND environment variable
+    (firestore, sqlite or memory) and only created on first use.
+    Profile and inventory reads go through a read-through cache in front of it.
+'''
+_backend = None
+_read_cache = None
+_backend_lock = threading.Lock()
 
 '''
-    Remove from 'inventory' collection
-    @params: name, amount
+    User whose data is read and written when no user id is given,
+    which keeps single-household clients working unchanged
 '''
-def remove_from_inventory(name, amount):
-    inventory_ref = db.collection('inventory')
-    inventory_ref = inventory_ref.document(name)
-    doc = inventory_ref.get()
-    if doc.exists:
-        count = inventory_ref.get().get('count')
-        if count - amount <= 0:
-            inventory_ref.delete()
-            print("%s has been removed" % (name))
-        else: 
-            inventory_ref.update({ 'count':  count - amount})
+DEFAULT_USER = 'user1'
+
+def get_backend():
+    global _backend, _read_cache
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend = create_backend()
+                _read_cache = create_read_cache(backend)
+                _backend = backend
+    return _backend
+
+def set_backend(backend):
+    global _backend, _read_cache
+    with _backend_lock:
+        _read_cache = create_read_cache(backend)
+        _backend = backend
+
+def get_read_cache():
+    get_backend()
+    return _read_cache
 
 '''
-    Get entire 'inventory' collection
-    @return: json formatted inventory
+    Concurrent reads of the same user's inventory or profile that miss the read cache share one backend call.
+    Writes forget the read in flight, so a read that starts after a write never gets data from before it.
 '''
-def get_inventory():
-    inventory_ref = db.collection('inventory')
-    docs = inventory_ref.stream()
-    ret = {"ingredients": []}
+inventory_reads = SingleFlight('get_inventory')
+profile_reads = SingleFlight('get_profile')
 
-    for doc in docs:
-        cur = doc.to_dict()
-        cur['name'] = doc.id
-        ret['ingredients'].append(cur)
+db_calls = counter('db_calls_total', 'Storage backend calls (server round trips)', ('op',))
+db_errors = counter('db_errors_total', 'Storage backend calls that raised', ('op',))
+db_call_seconds = histogram('db_call_seconds', 'Wall time of each storage backend call', ('op',))
+db_documents = counter('db_documents_total', 'Documents read or written by storage backend calls', ('op', 'direction'))
 
-    return ret
+'''
+    Times one backend call as the request's 'db' stage and records it in the db_* metrics
+    The body sets counts['read'] to the number of documents it got back
+'''
+@contextmanager
+def db_call(op, written=0):
+    counts = {'read': 0, 'written': written}
+    start = time.perf_counter()
+    try:
+        with stage('db'):
+            yield counts
+    except Exception:
+        db_errors.inc(op=op)
+        raise
+    finally:
+        db_calls.inc(op=op)
+        db_call_seconds.observe(time.perf_counter() - start, op=op)
+    for direction, documents in counts.items():
+        if documents:
+            db_documents.inc(documents, op=op, direction=direction)
+
+'''
+    Absolute expiry timestamp of an item bought at purchased_at that keeps for expiry days,
+    or None when expiry isn't a number
+'''
+def expires_at(expiry, purchased_at):
+    if isinstance(expiry, bool) or not isinstance(expiry, (int, float)):
+        return None
+    return purchased_at + expiry * DAY_SECONDS
+
+'''
+    Sets each item's 'expiry' to the days it has left, from its absolute 'expires_at',
+    so clients keep reading expiry as "days from now"
+    @return: items
+'''
+def with_days_left(items, now=None):
+    now = time.time() if now is None else now
+    for item in items:
+        if item.get('expires_at') is not None:
+            item['expiry'] = max(0, round((item['expires_at'] - now) / DAY_SECONDS, 1))
+    return items
 
 '''
-    Add to 'recipes' collection
+    Add to the user's 'inventory'
+    @params: name, amount, units, expiry, carbonImpact, user_id
+'''
+def add_to_inventory(name, count, units, expiry, carbon_footprint, user_id=DEFAULT_USER):
+    add_many_to_inventory([{'name': name, 'count': count, 'units': units, 'expiry': expiry,
+                            'carbon_footprint': carbon_footprint}], user_id)
+
+'''
+    Add a list of ingredients to the user's 'inventory' in one write
+    Repeated names are merged by summing their counts
+    Each item is stamped with the time it was bought and the time it expires,
+    expiry being the days it keeps from now
+    @params: ingredients, list of {name, count, units, expiry, carbon_footprint}
+             user_id
+'''
+def add_many_to_inventory(ingredients, user_id=DEFAULT_USER):
+    now = time.time()
+    items = {}
+    for ingred in ingredients:
+        if ingred['name'] in items:
+            items[ingred['name']]['count'] += ingred['count']
+        else:
+            items[ingred['name']] = {'count': ingred['count'], 'units': ingred['units'], 'expiry': ingred.get('expiry'),
+                                     'carbon_footprint': ingred.get('carbon_footprint'),
+                                     'purchased_at': now, 'expires_at': expires_at(ingred.get('expiry'), now)}
+    if not items:
+        return
+    with db_call('add_many_to_inventory', written=len(items)):
+        get_backend().add_many_to_inventory(user_id, items)
+    inventory_reads.forget(user_id)
+    get_read_cache().invalidate('inventory', user_id)
+    print("%s added to inventory" % (", ".join(items)))
+
+'''
+    Remove from the user's 'inventory'
+    @params: name, amount, user_id
+'''
+def remove_from_inventory(name, amount, user_id=DEFAULT_USER):
+    remove_many_from_inventory([{'name': name, 'count': amount}], user_id)
+
+'''
+    Remove a list of ingredients from the user's 'inventory' in one transaction
+    Items whose count drops to 0 or below are deleted
+    @params: ingredients, list of {name, count}
+             user_id
+'''
+def remove_many_from_inventory(ingredients, user_id=DEFAULT_USER):
+    amounts = {}
+    for ingred in ingredients:
+        amounts[ingred['name']] = amounts.get(ingred['name'], 0) + ingred['count']
+    if not amounts:
+        return
+    with db_call('remove_many_from_inventory', written=len(amounts)) as counts:
+        removed = get_backend().remove_many_from_inventory(user_id, amounts)
+        counts['read'] = len(amounts)
+    inventory_reads.forget(user_id)
+    get_read_cache().invalidate('inventory', user_id)
+    for name in removed:
+        print("%s has been removed" % (name))
+
+'''
+    Get the user's entire 'inventory'
+    @return: json formatted inventory, expiry being the days each item has left
+'''
+def get_inventory(user_id=DEFAULT_USER):
+    return {"ingredients": with_days_left(get_read_cache().get(
+        'inventory', user_id, lambda: inventory_reads.do(user_id, load_inventory, user_id)))}
+
+def load_inventory(user_id):
+    with db_call('get_inventory') as counts:
+        inventory = get_backend().get_inventory(user_id)
+        counts['read'] = len(inventory)
+    return inventory
+
+'''
+    Get one page of the user's 'inventory', ordered by name
+    @params: limit, cursor (next_cursor of the previous page, None for the first page),
+             fields (list of fields to return, None for all), user_id
+    @return: json formatted inventory and the cursor of the next page (None on the last page)
+'''
+def get_inventory_page(limit=50, cursor=None, fields=None, user_id=DEFAULT_USER):
+    # Days left are computed from expires_at, which has to be read even when it wasn't asked for
+    extra = fields is not None and 'expiry' in fields and 'expires_at' not in fields
+    with db_call('get_inventory_page') as counts:
+        ingredients, next_cursor = get_backend().get_inventory_page(
+            user_id, limit, cursor, [*fields, 'expires_at'] if extra else fields)
+        counts['read'] = len(ingredients)
+    with_days_left(ingredients)
+    if extra:
+        for item in ingredients:
+            item.pop('expires_at', None)
+    return {"ingredients": ingredients, "next_cursor": next_cursor}
+
+'''
+    Get the items of the user's 'inventory' that expire soonest, from the backend's expiry index
+    @params: limit, within (only items expiring in the next within days, None for all), user_id
+    @return: json formatted inventory, soonest first, expiry being the days each item has left
+'''
+def get_expiring(limit=10, within=None, user_id=DEFAULT_USER):
+    now = time.time()
+    before = now + within * DAY_SECONDS if within is not None else None
+    with db_call('get_expiring') as counts:
+        ingredients = get_backend().get_expiring(user_id, limit, before)
+        counts['read'] = len(ingredients)
+    return {"ingredients": with_days_left(ingredients, now)}
+
+'''
+    Add to the user's 'recipes' history
     @params: name, short_description, cooking_time, difficulty, ingredients, instructions,
-             nutritional_values, points_response, justification_response, warnings
+             nutritional_values, points_response, justification_response, warnings, user_id
+    @return: id of the history entry
 '''
 def add_to_recipes(name, short_description, cooking_time, difficulty, ingredients, instructions, url,
-                   nutritional_values, points_response, justification_response, warnings):
-    recipes_ref = db.collection('recipes')
-    recipes_ref = recipes_ref.document(name)
-    recipes_ref.set({
-        'short_description': short_description,
-        'cooking_time': cooking_time,
-        'difficulty': difficulty,
-        'ingredients': ingredients,
-        'instructions': instructions,
-        'url': url,
-        'nutritional_values': nutritional_values,
-        'points_response': points_response,
-        'justification_response': justification_response,
-        'warnings': warnings
-    })
+                   nutritional_values, points_response, justification_response, warnings, user_id=DEFAULT_USER):
+    with db_call('add_to_recipes', written=1):
+        recipe_id = get_backend().add_to_recipes(user_id, {
+            'recipe_name': name,
+            'short_description': short_description,
+            'cooking_time': cooking_time,
+            'difficulty': difficulty,
+            'ingredients': ingredients,
+            'instructions': instructions,
+            'url': url,
+            'nutritional_values': nutritional_values,
+            'points_response': points_response,
+            'justification_response': justification_response,
+            'warnings': warnings
+        })
     print("%s added to recipes" % (name))
+    return recipe_id
 
 '''
-    Get 'recipes' collection
+    Get the user's whole 'recipes' history, newest first
+    @params: fields (list of fields to return, None for all),
+             since (only recipes created after this timestamp, None for all), user_id
     @return: json list of recipes
 '''
-def get_recipes():
-    recipes_ref = db.collection('recipes')
-    docs = recipes_ref.stream()
+def get_recipes(fields=None, since=None, user_id=DEFAULT_USER):
+    with db_call('get_recipes') as counts:
+        recipes = get_backend().get_recipes(user_id, fields, since)
+        counts['read'] = len(recipes)
+    return {"recipes": recipes}
 
-    ret = {"recipes": []}
+'''
+    Get one page of the user's 'recipes' history, newest first
+    @params: limit, cursor (next_cursor of the previous page, None for the first page),
+             fields (list of fields to return, None for all),
+             since (only recipes created after this timestamp, None for all), user_id
+    @return: json list of recipes and the cursor of the next page (None on the last page)
+'''
+def get_recipe_history(limit=20, cursor=None, fields=None, since=None, user_id=DEFAULT_USER):
+    with db_call('get_recipe_history') as counts:
+        recipes, next_cursor = get_backend().get_recipe_history(user_id, limit, cursor, fields, since)
+        counts['read'] = len(recipes)
+    return {"recipes": recipes, "next_cursor": next_cursor}
 
-    for doc in docs:
-        cur = doc.to_dict()
-        cur['recipe_name'] = doc.id
-        ret['recipes'].append(cur)
+'''
+    Add points to the user's score in each leaderboard window
+    @params: points, name (shown on the leaderboard), windows (list of window keys), user_id
+'''
+def add_points(points, name, windows, user_id=DEFAULT_USER):
+    with db_call('add_points', written=len(windows)):
+        get_backend().add_points(user_id, windows, points, name)
 
-    return ret
+'''
+    Get every score in a leaderboard window, or only those updated after since
+    @return: list of {user_id, name, points}
+'''
+def get_scores(window, since=None):
+    with db_call('get_scores') as counts:
+        scores = get_backend().get_scores(window, since)
+        counts['read'] = len(scores)
+    return scores
 
 '''
     Add/Modify User Profile
-    @params: name, exp, allergies, restrictions, diseases
-'''
-def modify_profile(name, exp, allergies, restrictions, diseases):
-    profile_ref = db.collection('user1')
-    profile_ref = profile_ref.document('profile')
-    profile_ref.set({
-        'name': name,
-        'exp': exp,
-        'allergies': allergies,
-        'restrictions': restrictions,
-        'diseases': diseases
-    })
+    @params: name, exp, allergies, restrictions, diseases, user_id
+'''
+def modify_profile(name, exp, allergies, restrictions, diseases, user_id=DEFAULT_USER):
+    with db_call('set_profile', written=1):
+        get_backend().set_profile(user_id, {
+            'name': name,
+            'exp': exp,
+            'allergies': allergies,
+            'restrictions': restrictions,
+            'diseases': diseases
+        })
+    profile_reads.forget(user_id)
+    get_read_cache().invalidate('profile', user_id)
     print("%s has been added" % (name))
 
+'''
+    Add points to the user's exp with one atomic backend write instead of reading and rewriting the profile,
+    which would lose points confirmed concurrently or read from a stale cache
+'''
+def add_exp(points, user_id=DEFAULT_USER):
+    with db_call('add_exp', written=1):
+        get_backend().add_exp(user_id, points)
+    profile_reads.forget(user_id)
+    get_read_cache().invalidate('profile', user_id)
+
+'''
+    Profile of a user who hasn't saved one yet: no points and no restrictions
+'''
+def default_profile(user_id):
+    return {'name': user_id, 'exp': 0, 'allergies': [], 'restrictions': [], 'diseases': []}
+
 '''
     Get User Profile
-    @return: json user profile
+    @return: json user profile, with the defaults for whatever it hasn't saved (all of it for a new user)
 '''
-def get_profile():
-    profile_ref = db.collection('user1')
-    profile_ref = profile_ref.document('profile')
+def get_profile(user_id=DEFAULT_USER):
+    profile = get_read_cache().get('profile', user_id, lambda: profile_reads.do(user_id, load_profile, user_id))
+    return {**default_profile(user_id), **(profile or {})}
 
-    return profile_ref.get().to_dict()
+def load_profile(user_id):
+    with db_call('get_profile') as counts:
+        profile = get_backend().get_profile(user_id)
+        counts['read'] = 1 if profile is not None else 0
+    return profile
 
+'''
+    Save the state of a background job, so every server process can answer for it
+    @params: job, JSON-serializable dict with an id and expires_at
+'''
+def save_job(job):
+    with db_call('set_job', written=1):
+        get_backend().set_job(job)
+
+'''
+    Get a background job saved by any server process
+    @return: job dict, or None if there is none or it has expired
+'''
+def get_job(job_id):
+    with db_call('get_job') as counts:
+        job = get_backend().get_job(job_id)
+        counts['read'] = 1 if job is not None else 0
+    return job
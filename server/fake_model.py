@@ -0,0 +1,166 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+"""
+Deterministic stand-in for Gemini, used by benchmark.py and offline runs.
+
+FakeGenerativeModel answers generate_content like genai.GenerativeModel does
+(response.text, candidates[0].content.parts[0].text, usage_metadata, stream=True
+chunks), picking an ingredient list, recipe or points assessment from the
+generation_config's response schema. The answer only depends on the prompt, so
+repeated runs produce identical responses. Each call sleeps for a configurable
+latency, spread over the chunks when streaming.
+
+Faults can be injected to exercise resilience.py: a share of calls fail with an
+HTTP status like Gemini's errors (503, 429, ...) and a share stall for extra
+seconds. Faults are drawn from their own seeded generator, not from the prompt,
+so a retried call can succeed.
+"""
+
+INGREDIENTS = [
+    ("tomato", "piece", 7, 1), ("onion", "piece", 30, 1), ("garlic", "clove", 60, 1),
+    ("chicken breast", "grams", 3, 2), ("broccoli", "head", 5, 1), ("rice", "grams", 365, 2),
+    ("egg", "piece", 21, 2), ("milk", "ml", 7, 2), ("cheddar cheese", "grams", 30, 3),
+    ("ground beef", "grams", 2, 3), ("spinach", "grams", 5, 1), ("pasta", "grams", 365, 1),
+    ("bell pepper", "piece", 10, 1), ("carrot", "piece", 21, 1), ("potato", "piece", 30, 1),
+]
+
+DISHES = ["Stir-Fry", "Frittata", "Soup", "Pasta Bake", "Rice Bowl", "Salad", "Curry", "Skillet"]
+
+
+def fake_ingredients(rng):
+    picked = rng.sample(INGREDIENTS, rng.randint(3, 6))
+    return {"ingredients": [{"name": name, "count": rng.randint(1, 4), "units": units,
+                             "expiry": expiry, "carbon_footprint": carbon_footprint}
+                            for name, units, expiry, carbon_footprint in picked]}
+
+
+def fake_recipe(rng, names):
+    names = names or [name for name, _, _, _ in rng.sample(INGREDIENTS, 3)]
+    used = rng.sample(names, min(len(names), rng.randint(2, 4)))
+    title = "%s %s" % (used[0].title(), rng.choice(DISHES))
+    return {
+        "recipe_name": title,
+        "short_description": "A quick %s made with %s." % (title.lower(), ", ".join(used)),
+        "cooking_time": rng.choice([10, 15, 20, 30, 45]),
+        "difficulty": rng.choice(["Easy", "Medium", "Hard"]),
+        "ingredients": [{"name": name, "count": rng.randint(1, 3), "units": "piece"} for name in used],
+        "instructions": ["Prepare the %s." % name for name in used] + ["Cook everything together and serve."],
+        "url": "",
+    }
+
+
+def fake_points(rng):
+    return {
+        "nutritional_values": "Calories: %d, Fat: %dg, Proteins: %dg, Carbohydrates: %dg" % (
+            rng.randint(250, 800), rng.randint(5, 40), rng.randint(10, 50), rng.randint(20, 90)),
+        "carbon_footprint": round(rng.uniform(0.5, 5.0), 2),
+        "points_response": rng.randint(3, 10),
+        "justification_response": "Balanced ingredients with a moderate carbon footprint.",
+        "warnings": "",
+    }
+
+
+def prompt_ingredients(prompt):
+    """
+    Ingredient names listed in a recipe prompt ("...following ingredients: a, b, c."), if any.
+    """
+    marker = "following ingredients: "
+    if marker not in prompt:
+        return []
+    names = prompt.split(marker, 1)[1].split(".\n", 1)[0]
+    return [name.strip() for name in names.split(",") if name.strip()]
+
+
+class FakeGenerativeModel:
+    def __init__(self, model_name, generation_config=None, latency=0.5, jitter=0.1, chunks=8,
+                 error_rate=0.0, error_code=503, stall_rate=0.0, stall=0.0, seed=0):
+        """
+        Args:
+            model_name (str): Reported only, every model answers the same way.
+            generation_config (dict): Its response_schema picks the shape of the answer.
+            latency (float): Seconds each call takes.
+            jitter (float): Up to this many seconds added to latency, drawn from the prompt.
+            chunks (int): Chunks a streamed answer is split into.
+            error_rate (float): Share of calls that raise FakeModelError(error_code) after the latency.
+            error_code (int): HTTP status of the injected errors.
+            stall_rate (float): Share of calls that take stall extra seconds.
+            stall (float): Seconds added to a stalled call.
+            seed (int): Seed of the fault generator.
+        """
+        self.model_name = model_name
+        self.generation_config = generation_config or {}
+        self.latency = latency
+        self.jitter = jitter
+        self.chunks = chunks
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.faults = random.Random(seed)
+        self.faults_lock = threading.Lock()
+
+    def generate_content(self, contents, stream=False):
+        prompt = contents if isinstance(contents, str) else "\n".join(
+            part if isinstance(part, str) else str(part.get("data", ""))[:256] for part in contents)
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+        text = json.dumps(self._answer(rng, prompt))
+        delay = self.latency + rng.uniform(0, self.jitter)
+        with self.faults_lock:
+            fail = self.faults.random() < self.error_rate
+            if self.faults.random() < self.stall_rate:
+                delay += self.stall
+        if fail:
+            time.sleep(self.latency)
+            raise FakeModelError(self.error_code)
+        usage = SimpleNamespace(prompt_token_count=len(prompt) // 4, candidates_token_count=len(text) // 4)
+        if not stream:
+            time.sleep(delay)
+            return fake_response(text, usage)
+        return self._stream(text, delay, usage)
+
+    def _stream(self, text, delay, usage):
+        size = -(-len(text) // self.chunks)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        for i, piece in enumerate(pieces):
+            time.sleep(delay / len(pieces))
+            yield fake_response(piece, usage if i == len(pieces) - 1 else None)
+
+    def _answer(self, rng, prompt):
+        properties = self.generation_config.get("response_schema", {}).get("properties", {})
+        if "recipes" in properties:
+            return {"recipes": [fake_recipe(rng, prompt_ingredients(prompt))
+                                for _ in range(properties["recipes"].get("min_items", 1))]}
+        if "justifications" in properties:
+            return {"justifications": [{key: value for key, value in fake_points(rng).items()
+                                        if key in ("justification_response", "warnings")}
+                                       for _ in range(properties["justifications"].get("min_items", 1))]}
+        if "assessments" in properties:
+            return {"assessments": [fake_points(rng) for _ in range(properties["assessments"].get("min_items", 1))]}
+        if "images" in properties:
+            return {"images": [fake_ingredients(rng) for _ in range(properties["images"].get("min_items", 1))]}
+        if "recipe_name" in properties:
+            return fake_recipe(rng, prompt_ingredients(prompt))
+        if "points_response" in properties:
+            return fake_points(rng)
+        return fake_ingredients(rng)
+
+
+class FakeModelError(Exception):
+    """
+    An injected failure, with the HTTP status as code like google.api_core exceptions.
+    """
+
+    def __init__(self, code):
+        super().__init__("%d injected fake model error" % code)
+        self.code = code
+
+
+def fake_response(text, usage=None):
+    part = SimpleNamespace(text=text)
+    candidate = SimpleNamespace(content=SimpleNamespace(parts=[part]))
+    return SimpleNamespace(text=text, candidates=[candidate], usage_metadata=usage)
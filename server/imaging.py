@@ -0,0 +1,181 @@
+import base64
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from metrics import stage
+
+"""
+Image normalization before vision inference.
+
+Phones send full-resolution photos in whatever format the camera produced. Each
+scan is decoded once, rotated upright from its EXIF orientation, downscaled so
+its longest edge is at most max_edge, and re-encoded as JPEG or WebP. The vision
+model gets a much smaller payload with a correct mime type.
+"""
+
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp",
+              "GIF": "image/gif", "HEIF": "image/heif", "BMP": "image/bmp"}
+
+
+class NormalizedImage:
+    """
+    Result of normalize_image.
+
+    Attributes:
+        image: The upright, downscaled PIL image (reused for the scan cache hash).
+        data (str): Base64 of the re-encoded image.
+        mime_type (str): Mime type of data.
+        source_format (str): Format the client actually sent, e.g. "JPEG".
+        bytes_in (int): Size of the decoded upload.
+        bytes_out (int): Size of the re-encoded image.
+        timings (dict): Seconds spent in each stage.
+    """
+
+    def __init__(self, image, data, mime_type, source_format, bytes_in, bytes_out, timings):
+        self.image = image
+        self.data = data
+        self.mime_type = mime_type
+        self.source_format = source_format
+        self.bytes_in = bytes_in
+        self.bytes_out = bytes_out
+        self.timings = timings
+
+
+def decode_image(base64_encode):
+    """
+    Decodes a base64 image, with or without a data: URL prefix, or the raw bytes of an uploaded file.
+
+    Returns:
+        (PIL image, decoded byte count)
+    """
+    if isinstance(base64_encode, bytes):
+        raw = base64_encode
+    else:
+        if base64_encode.startswith("data:"):
+            base64_encode = base64_encode.split(",", 1)[1]
+        raw = base64.b64decode(base64_encode)
+    image = Image.open(io.BytesIO(raw))
+    image.load()
+    return image, len(raw)
+
+
+def normalize_image(base64_encode, max_edge=1024, output_format="JPEG", quality=80):
+    timings = {}
+
+    start = time.perf_counter()
+    image, bytes_in = decode_image(base64_encode)
+    source_format = image.format or "UNKNOWN"
+    timings["decode"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    image = ImageOps.exif_transpose(image)
+    timings["orient"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    timings["resize"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if image.mode not in ("RGB", "L"):
+        # JPEG has no alpha channel, so flatten transparent pixels onto white
+        rgba = image.convert("RGBA")
+        image = Image.new("RGB", rgba.size, (255, 255, 255))
+        image.paste(rgba, mask=rgba.getchannel("A"))
+    out = io.BytesIO()
+    if output_format == "WEBP":
+        image.save(out, "WEBP", quality=quality, method=4)
+    else:
+        image.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+    encoded = out.getvalue()
+    timings["encode"] = time.perf_counter() - start
+
+    return NormalizedImage(image, base64.b64encode(encoded).decode("ascii"), MIME_TYPES[output_format],
+                           source_format, bytes_in, len(encoded), timings)
+
+
+class ImagePipeline:
+    """
+    Runs normalize_image on a bounded pool of worker threads and keeps running totals.
+    Pillow releases the GIL while resampling and encoding, so threads do run in parallel.
+    """
+
+    def __init__(self, max_edge=1024, output_format="JPEG", quality=80, workers=4):
+        self.max_edge = max_edge
+        self.output_format = output_format
+        self.quality = quality
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image")
+        self.lock = threading.Lock()
+        self.totals = {"images": 0, "failures": 0, "bytes_in": 0, "bytes_out": 0,
+                       "decode": 0.0, "orient": 0.0, "resize": 0.0, "encode": 0.0}
+
+    def normalize(self, base64_encode):
+        """
+        Normalizes one image on the pool, blocking until it is done.
+        Raises whatever Pillow raises if the image can't be decoded.
+        """
+        with stage("image"):
+            future = self.executor.submit(normalize_image, base64_encode, self.max_edge,
+                                          self.output_format, self.quality)
+            try:
+                result = future.result()
+            except Exception as e:
+                self._count(e)
+                raise
+        self._count(result)
+        return result
+
+    def normalize_all(self, images):
+        """
+        Normalizes several images on the pool at once, blocking until all are done.
+        Returns one NormalizedImage per image, or the exception raised for an image that can't be decoded.
+        """
+        with stage("image"):
+            futures = [self.executor.submit(normalize_image, image, self.max_edge, self.output_format, self.quality)
+                       for image in images]
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append(e)
+        for result in results:
+            self._count(result)
+        return results
+
+    def _count(self, result):
+        with self.lock:
+            if isinstance(result, Exception):
+                self.totals["failures"] += 1
+                return
+            self.totals["images"] += 1
+            self.totals["bytes_in"] += result.bytes_in
+            self.totals["bytes_out"] += result.bytes_out
+            for name, seconds in result.timings.items():
+                self.totals[name] += seconds
+
+    def stats(self):
+        with self.lock:
+            totals = dict(self.totals)
+        totals["compression_ratio"] = totals["bytes_out"] / totals["bytes_in"] if totals["bytes_in"] else 0.0
+        return totals
+
+
+def create_image_pipeline():
+    """
+    Builds the process-wide pipeline from IMAGE_* environment variables.
+    """
+    output_format = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+    if output_format not in ("JPEG", "WEBP"):
+        raise ValueError("IMAGE_FORMAT must be JPEG or WEBP, got '%s'" % output_format)
+    return ImagePipeline(
+        max_edge=int(os.getenv("IMAGE_MAX_EDGE", "1024")),
+        output_format=output_format,
+        quality=int(os.getenv("IMAGE_QUALITY", "80")),
+        workers=int(os.getenv("IMAGE_WORKERS", "4")),
+    )
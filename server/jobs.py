@@ -0,0 +1,293 @@
+import http.client
+import ipaddress
+import json
+import os
+import queue
+import socket
+import ssl
+import threading
+import time
+import urllib.parse
+import uuid
+from contextvars import copy_context
+
+from database import get_job, save_job
+
+"""
+Background jobs for slow model work (ingredient scans, recipe generation).
+
+Submitting a job returns its id straight away and a bounded pool of worker
+threads runs it, so a multi-second Gemini call never holds a Flask worker.
+Results are fetched by polling the job, or pushed as a JSON POST to the job's
+webhook when it finishes. Each user may only have a few jobs queued or running
+at once and the queue itself is bounded; submissions past either limit are
+rejected rather than queued. The queue lives in this process and needs no
+external service, but each job's state is also saved through the storage backend,
+so /jobs/<id> can be answered by any server worker, not only the one running it.
+The per-user limit is counted per worker.
+
+A job belongs to the user that submitted it, but user ids come from the unauthenticated
+X-User-Id header, so what actually keeps a job private is its id: 128 random bits that
+only the submitter is told.
+
+Webhooks are URLs chosen by the client, so the server only POSTs to hosts that
+resolve to public addresses (not 127.0.0.1, 10.x, 169.254.169.254, ...), or to the
+hosts in JOB_WEBHOOK_HOSTS when it is set, and never follows redirects. The POST
+connects to the address that was checked rather than resolving the host again, so a
+host can't pass the check and then be rebound to an internal address.
+"""
+
+
+class QueueFull(Exception):
+    pass
+
+
+class UserLimitReached(Exception):
+    pass
+
+
+class PinnedHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection to a given address, sending the URL's host in the Host header.
+    """
+
+    def __init__(self, host, port, address, timeout):
+        super().__init__(host, port, timeout=timeout)
+        self.address = address
+
+    def connect(self):
+        self.sock = socket.create_connection((self.address or self.host, self.port), self.timeout)
+
+
+class PinnedHTTPSConnection(http.client.HTTPSConnection):
+    """
+    HTTPS connection to a given address, with the certificate checked against the URL's host.
+    """
+
+    def __init__(self, host, port, address, timeout):
+        self.tls = ssl.create_default_context()
+        super().__init__(host, port, timeout=timeout, context=self.tls)
+        self.address = address
+
+    def connect(self):
+        sock = socket.create_connection((self.address or self.host, self.port), self.timeout)
+        self.sock = self.tls.wrap_socket(sock, server_hostname=self.host)
+
+
+class JobQueue:
+    def __init__(self, workers=4, max_queued=100, per_user_limit=2, result_ttl=600, webhook_timeout=5,
+                 webhook_hosts=(), shared=True):
+        """
+        Args:
+            workers (int): Worker threads running jobs.
+            max_queued (int): Jobs waiting for a worker before submissions are rejected.
+            per_user_limit (int): Jobs one user may have queued or running at once.
+            result_ttl (float): Seconds a finished job can still be fetched.
+            webhook_timeout (float): Seconds allowed for each webhook POST.
+            webhook_hosts (iterable): Host names webhooks may go to. Empty allows any host
+                that only resolves to public addresses.
+            shared (bool): Save every job's state through the storage backend for other processes.
+        """
+        self.per_user_limit = per_user_limit
+        self.result_ttl = result_ttl
+        self.webhook_timeout = webhook_timeout
+        self.webhook_hosts = {host.lower() for host in webhook_hosts}
+        self.shared = shared
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.active = {}
+        self.counters = {"submitted": 0, "completed": 0, "failed": 0, "rejected_queue_full": 0,
+                         "rejected_user_limit": 0, "webhooks_sent": 0, "webhooks_failed": 0,
+                         "wait_seconds": 0.0, "run_seconds": 0.0}
+        self.running = 0
+        self.workers = [threading.Thread(target=self._run, name="job-worker-%d" % i, daemon=True)
+                        for i in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, kind, user_id, fn, *args, webhook=None):
+        """
+        Queues fn(*args) for user_id and returns the job id.
+        The job runs in a copy of the caller's context, so it keeps the request id.
+        Raises UserLimitReached or QueueFull when the job can't be accepted.
+        """
+        now = time.time()
+        job = {"id": uuid.uuid4().hex, "kind": kind, "user_id": user_id, "status": "queued",
+               "created_at": now, "started_at": None, "finished_at": None,
+               "result": None, "error": None, "webhook": webhook}
+        # The worker waits for the queued state to be saved, so it can't overwrite a later one
+        saved = threading.Event()
+        with self.lock:
+            self._expire(now)
+            if self.active.get(user_id, 0) >= self.per_user_limit:
+                self.counters["rejected_user_limit"] += 1
+                raise UserLimitReached("user %s already has %d jobs in progress" % (user_id, self.per_user_limit))
+            try:
+                self.queue.put_nowait((job, copy_context(), fn, args, saved))
+            except queue.Full:
+                self.counters["rejected_queue_full"] += 1
+                raise QueueFull("job queue is full")
+            self.jobs[job["id"]] = job
+            self.active[user_id] = self.active.get(user_id, 0) + 1
+            self.counters["submitted"] += 1
+            public = self._public(job)
+        try:
+            self._save(public)
+        finally:
+            saved.set()
+        return job["id"]
+
+    def webhook_error(self, url):
+        """
+        Returns why url may not receive webhooks, or None if it may.
+        """
+        return self._webhook_address(url)[1]
+
+    def _webhook_address(self, url):
+        """
+        (address to connect to, None) for a url that may receive webhooks, else (None, why not).
+        The address is None for hosts in webhook_hosts, which are resolved as usual.
+        """
+        try:
+            parsed = urllib.parse.urlsplit(url)
+            port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        except ValueError:
+            return None, "webhook is not a valid URL"
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            return None, "webhook must be an http(s) URL"
+        host = parsed.hostname.lower()
+        if self.webhook_hosts:
+            return None, None if host in self.webhook_hosts else "webhook host %s is not allowed" % host
+        try:
+            addresses = [info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)]
+        except (socket.gaierror, UnicodeError) as e:
+            return None, "webhook host %s does not resolve: %s" % (host, e)
+        for address in addresses:
+            ip = ipaddress.ip_address(address.split("%")[0])
+            if ip.version == 6 and ip.ipv4_mapped:
+                ip = ip.ipv4_mapped
+            if not ip.is_global or ip.is_multicast:
+                return None, "webhook host %s resolves to non-public address %s" % (host, ip)
+        return addresses[0], None
+
+    def get(self, job_id):
+        """
+        Returns a copy of the job, or None if it doesn't exist or has expired.
+        Jobs submitted to other processes are read from the storage backend.
+        """
+        with self.lock:
+            self._expire(time.time())
+            job = self.jobs.get(job_id)
+            if job is not None:
+                return self._public(job)
+        if not self.shared:
+            return None
+        job = get_job(job_id)
+        if job is not None:
+            del job["expires_at"]
+        return job
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, "queued": self.queue.qsize(), "running": self.running,
+                    "workers": len(self.workers), "jobs": len(self.jobs),
+                    "users_active": sum(1 for count in self.active.values() if count)}
+
+    def _run(self):
+        while True:
+            job, context, fn, args, saved = self.queue.get()
+            started = time.time()
+            with self.lock:
+                job["status"] = "running"
+                job["started_at"] = started
+                self.running += 1
+                self.counters["wait_seconds"] += started - job["created_at"]
+                public = self._public(job)
+            # Anything but an Exception from fn still ends the job, so its user's count goes back down
+            result, error = None, "job was interrupted"
+            try:
+                saved.wait()
+                self._save(public)
+                try:
+                    result, error = context.run(fn, *args), None
+                except Exception as e:
+                    print("job %s (%s) failed: %s" % (job["id"], job["kind"], e))
+                    result, error = None, str(e)
+            finally:
+                finished = time.time()
+                with self.lock:
+                    job["status"] = "failed" if error else "done"
+                    job["result"] = result
+                    job["error"] = error
+                    job["finished_at"] = finished
+                    self.running -= 1
+                    self.active[job["user_id"]] -= 1
+                    if not self.active[job["user_id"]]:
+                        del self.active[job["user_id"]]
+                    self.counters["failed" if error else "completed"] += 1
+                    self.counters["run_seconds"] += finished - started
+                    public = self._public(job)
+                self._save(public)
+            if job["webhook"]:
+                self._send_webhook(job["webhook"], public)
+
+    def _save(self, job):
+        if not self.shared:
+            return
+        expires_at = job["finished_at"] + self.result_ttl if job["finished_at"] is not None else None
+        try:
+            save_job(json.loads(json.dumps({**job, "expires_at": expires_at}, default=str)))
+        except Exception as e:
+            print("could not save job %s: %s" % (job["id"], e))
+
+    def _send_webhook(self, url, job):
+        body = json.dumps(job, default=str).encode("utf-8")
+        try:
+            # Checked again, since the host may resolve elsewhere by the time the job is done
+            address, error = self._webhook_address(url)
+            if error:
+                raise ValueError(error)
+            parsed = urllib.parse.urlsplit(url)
+            connection_class = PinnedHTTPSConnection if parsed.scheme == "https" else PinnedHTTPConnection
+            connection = connection_class(parsed.hostname, parsed.port, address, self.webhook_timeout)
+            try:
+                path = parsed.path or "/"
+                connection.request("POST", path + "?" + parsed.query if parsed.query else path, body=body,
+                                   headers={"Content-Type": "application/json"})
+                status = connection.getresponse().status
+            finally:
+                connection.close()
+            # http.client never follows redirects, and one would be a way around the address check anyway
+            if status >= 300:
+                raise ValueError("webhook answered %d" % status)
+        except Exception as e:
+            print("could not deliver job %s to %s: %s" % (job["id"], url, e))
+            with self.lock:
+                self.counters["webhooks_failed"] += 1
+            return
+        with self.lock:
+            self.counters["webhooks_sent"] += 1
+
+    def _expire(self, now):
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job["finished_at"] is not None and job["finished_at"] + self.result_ttl < now]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def _public(self, job):
+        return {key: value for key, value in job.items() if key != "webhook"}
+
+
+def create_job_queue():
+    """
+    Builds the process-wide job queue from JOB_* environment variables.
+    """
+    return JobQueue(
+        workers=int(os.getenv("JOB_WORKERS", "4")),
+        max_queued=int(os.getenv("JOB_QUEUE_SIZE", "100")),
+        per_user_limit=int(os.getenv("JOB_USER_LIMIT", "2")),
+        result_ttl=float(os.getenv("JOB_RESULT_TTL", "600")),
+        webhook_hosts=[host.strip() for host in os.getenv("JOB_WEBHOOK_HOSTS", "").split(",") if host.strip()],
+        shared=os.getenv("JOB_SHARED", "1") != "0",
+    )
@@ -0,0 +1,188 @@
+import json
+
+"""
+Incremental reader for a JSON object that arrives in chunks.
+
+Model responses are streamed, and a caller often only needs a few of the fields
+to start its next step. FieldStream scans each chunk once and hands back every
+top-level field whose value has been completely received so far. For the
+top-level arrays named in item_fields it also reports each element as soon as it
+is complete, e.g. each instruction step while later steps are still arriving.
+
+parse_object reads the first JSON object out of a whole response, ignoring text
+around it, with the C decoder and no copy of the response. A response cut off
+by max_output_tokens or a dropped stream is repaired (repair) by closing the
+open string and containers, dropping the last element if it is incomplete.
+"""
+
+_decoder = json.JSONDecoder()
+
+# Truncation points tried by repair, from the last one back, before giving up
+MAX_REPAIR_ATTEMPTS = 8
+
+
+def parse_object(text, repair_truncated=True):
+    """
+    The first JSON object in text, e.g. inside a ```json fence or followed by prose.
+    Raises ValueError when there is none or it is malformed and can't be repaired.
+    """
+    start = text.find("{")
+    if start < 0:
+        raise ValueError("No JSON content found in the response.")
+    try:
+        return _decoder.raw_decode(text, start)[0]
+    except json.JSONDecodeError as e:
+        error = e
+    if repair_truncated:
+        repaired = repair(text, start)
+        if repaired is not None:
+            try:
+                return json.loads(repaired)
+            except json.JSONDecodeError:
+                pass
+    raise ValueError(f"Invalid JSON format: {error}")
+
+
+def repair(text, start=0):
+    """
+    Text of the JSON value starting at start, completed if it was cut off, or None if it can't be.
+    A value that is complete is returned as it is, so a malformed one stays malformed.
+    """
+    closers = []
+    in_string = False
+    escape = False
+    # (position, closers) where the text can be cut and closed: after an opening bracket or before a comma
+    cuts = []
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            closers.append("}" if char == "{" else "]")
+            cuts.append((i + 1, "".join(reversed(closers))))
+        elif char in "}]":
+            if not closers or closers.pop() != char:
+                return None
+            if not closers:
+                return text[start:i + 1]
+        elif char == "," and closers:
+            cuts.append((i, "".join(reversed(closers))))
+    tail = text[start:].rstrip()
+    if escape:
+        tail = tail[:-1]
+    candidates = [tail + ('"' if in_string else "") + "".join(reversed(closers))]
+    candidates += [text[start:position] + closing for position, closing in reversed(cuts[-MAX_REPAIR_ATTEMPTS:])]
+    for candidate in candidates:
+        try:
+            json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        return candidate
+    return None
+
+
+class FieldStream:
+    def __init__(self, item_fields=()):
+        self.item_fields = item_fields
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.key_start = None
+        self.key = None
+        self.value_start = None
+        self.array_key = None
+        self.item_start = None
+        self.fields = {}
+        self.new_items = []
+        self.done = False
+
+    def feed(self, chunk):
+        """
+        Adds a chunk of text and returns a dict of the top-level fields completed by it.
+        Every completed field is also kept in self.fields, and the (field, element) pairs
+        of item_fields arrays completed by the chunk are left in self.new_items.
+        Once the object is complete (self.done) the rest of the text is ignored.
+        """
+        completed = {}
+        self.new_items = []
+        if self.done:
+            return completed
+        self.buffer += chunk
+        buffer = self.buffer
+        for i in range(self.pos, len(buffer)):
+            char = buffer[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.key_start is not None:
+                        self.key = json.loads(buffer[self.key_start:i + 1])
+                        self.key_start = None
+            elif char == '"':
+                self.in_string = True
+                if self.depth == 1 and self.key is None and self.value_start is None:
+                    self.key_start = i
+            elif char in "{[":
+                self.depth += 1
+                if char == "[" and self.depth == 2 and self.key in self.item_fields:
+                    self.array_key = self.key
+                    self.item_start = i + 1
+            elif char in "}]":
+                if self.depth == 2 and self.array_key is not None:
+                    self._complete_item(buffer, i)
+                    self.array_key = None
+                elif self.depth == 1 and self.value_start is not None:
+                    self._complete(buffer, i, completed)
+                self.depth -= 1
+                if self.depth == 0:
+                    self.done = True
+                    self.buffer = buffer[:i + 1]
+                    break
+            elif char == ",":
+                if self.depth == 2 and self.array_key is not None:
+                    self._complete_item(buffer, i)
+                    self.item_start = i + 1
+                elif self.depth == 1 and self.value_start is not None:
+                    self._complete(buffer, i, completed)
+            elif char == ":":
+                if self.depth == 1 and self.key is not None and self.value_start is None:
+                    self.value_start = i + 1
+        self.pos = len(self.buffer)
+        return completed
+
+    def finish(self):
+        """
+        Called once the stream has ended. For a response that was cut off, repairs the buffer and
+        returns the top-level fields that could be recovered, also kept in self.fields.
+        Raises ValueError if the buffer holds no object at all.
+        """
+        if self.done:
+            return {}
+        recovered = {key: value for key, value in parse_object(self.buffer).items() if key not in self.fields}
+        self.fields.update(recovered)
+        self.done = True
+        return recovered
+
+    def _complete(self, buffer, end, completed):
+        value = json.loads(buffer[self.value_start:end])
+        self.fields[self.key] = value
+        completed[self.key] = value
+        self.key = None
+        self.value_start = None
+
+    def _complete_item(self, buffer, end):
+        text = buffer[self.item_start:end].strip()
+        if text:
+            self.new_items.append((self.array_key, json.loads(text)))
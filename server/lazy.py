@@ -0,0 +1,35 @@
+import threading
+
+"""
+Process-wide objects built on first use.
+
+Importing app.py should be cheap and must not start threads or open connections:
+a production server imports the app once and then forks its workers, and threads
+or gRPC channels created before the fork don't survive in the children. Lazy wraps
+a create_*() factory and only calls it the first time one of the object's
+attributes is used, so every worker builds its own. Its own names start with an
+underscore so they don't hide the wrapped object's (JobQueue.get, ...).
+"""
+
+
+class Lazy:
+    def __init__(self, factory):
+        """
+        Args:
+            factory (callable): Builds the object, e.g. jobs.create_job_queue.
+        """
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value = None
+
+    def _get(self):
+        value = self._value
+        if value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self._factory()
+                value = self._value
+        return value
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
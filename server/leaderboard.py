@@ -0,0 +1,322 @@
+import bisect
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from database import add_points, get_scores
+from storage import decode_cursor, encode_cursor
+
+"""
+Leaderboards of the points earned by confirming recipes.
+
+Every confirmed recipe adds its points to the user's score in the all-time window
+and in the current week's window. Scores are kept by the storage backend as one
+counter per user and window, so confirmations by different users never write the
+same document. Each process ranks a window with a dict of scores plus the
+(-points, user_id) pairs in a SortedList, a list of small sorted buckets with a
+Fenwick tree of their lengths: a score change only moves items within one bucket,
+and a user's rank and the start of a page take a binary search plus O(log n) steps
+through the tree, with no scan over every profile. Rankings are
+built from the backend on first use and updated in place by this process's
+confirmations. Every ttl seconds they read back only the scores updated since the
+last read (by updated_at), to pick up other processes' writes.
+"""
+
+WINDOWS = ("all", "week")
+
+# Seconds subtracted from the last read when asking for updated scores, since
+# updated_at comes from the clocks of the processes that wrote them
+CLOCK_SKEW = 5
+
+
+def window_key(window, now=None):
+    """
+    Storage key of the window containing now: "all", or the ISO week in UTC, e.g. "week-2026-W42".
+    """
+    if window == "all":
+        return "all"
+    if window == "week":
+        year, week, _ = datetime.fromtimestamp(time.time() if now is None else now, timezone.utc).isocalendar()
+        return "week-%d-W%02d" % (year, week)
+    raise ValueError("Unknown window '%s', expected %s" % (window, " or ".join(WINDOWS)))
+
+
+class SortedList:
+    """
+    Sorted list of distinct items kept as sorted buckets of at most 2 * load items, like
+    sortedcontainers.SortedList: inserting or removing shifts one bucket, not the whole list.
+    The positions of the buckets come from a Fenwick tree of their lengths, rebuilt only when
+    a bucket is split or emptied.
+    """
+
+    def __init__(self, items=(), load=512):
+        self.load = load
+        items = sorted(items)
+        self.buckets = [items[i:i + load] for i in range(0, len(items), load)]
+        self.maxes = [bucket[-1] for bucket in self.buckets]
+        self.size = len(items)
+        self._build_index()
+
+    def _build_index(self):
+        # index[i] holds the total length of buckets (i - lowbit(i), i], 1-based
+        index = [0] * (len(self.buckets) + 1)
+        for i, bucket in enumerate(self.buckets, 1):
+            index[i] += len(bucket)
+            parent = i + (i & -i)
+            if parent < len(index):
+                index[parent] += index[i]
+        self.index = index
+
+    def _resize(self, i, amount):
+        i += 1
+        while i < len(self.index):
+            self.index[i] += amount
+            i += i & -i
+
+    def _offset(self, i):
+        """
+        Number of items in the buckets before bucket i
+        """
+        total = 0
+        while i > 0:
+            total += self.index[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, position):
+        """
+        (bucket, position within it) of the item at position, which must be less than len(self)
+        """
+        i = 0
+        step = 1 << (len(self.index) - 1).bit_length()
+        while step:
+            if i + step < len(self.index) and self.index[i + step] <= position:
+                i += step
+                position -= self.index[i]
+            step >>= 1
+        return i, position
+
+    def __len__(self):
+        return self.size
+
+    def add(self, item):
+        if not self.buckets:
+            self.buckets.append([item])
+            self.maxes.append(item)
+            self._build_index()
+        else:
+            i = min(bisect.bisect_left(self.maxes, item), len(self.buckets) - 1)
+            bucket = self.buckets[i]
+            bisect.insort(bucket, item)
+            self.maxes[i] = bucket[-1]
+            if len(bucket) > 2 * self.load:
+                self.buckets[i:i + 1] = [bucket[:self.load], bucket[self.load:]]
+                self.maxes[i:i + 1] = [bucket[self.load - 1], bucket[-1]]
+                self._build_index()
+            else:
+                self._resize(i, 1)
+        self.size += 1
+
+    def remove(self, item):
+        """
+        Removes item, raising ValueError like list.remove when it is not in the list
+        """
+        i = bisect.bisect_left(self.maxes, item)
+        bucket = self.buckets[i] if i < len(self.buckets) else []
+        j = bisect.bisect_left(bucket, item)
+        if j == len(bucket) or bucket[j] != item:
+            raise ValueError("%r is not in the list" % (item,))
+        del bucket[j]
+        if bucket:
+            self.maxes[i] = bucket[-1]
+            self._resize(i, -1)
+        else:
+            del self.buckets[i]
+            del self.maxes[i]
+            self._build_index()
+        self.size -= 1
+
+    def bisect_left(self, item):
+        i = bisect.bisect_left(self.maxes, item)
+        if i == len(self.buckets):
+            return self.size
+        return self._offset(i) + bisect.bisect_left(self.buckets[i], item)
+
+    def bisect_right(self, item):
+        i = bisect.bisect_right(self.maxes, item)
+        if i == len(self.buckets):
+            return self.size
+        return self._offset(i) + bisect.bisect_right(self.buckets[i], item)
+
+    def slice(self, start, stop):
+        """
+        The items at positions start to stop, like list[start:stop]
+        """
+        stop = min(stop, self.size)
+        if start >= stop:
+            return []
+        i, offset = self._locate(start)
+        items = []
+        while len(items) < stop - start:
+            items.extend(self.buckets[i][offset:offset + stop - start - len(items)])
+            i, offset = i + 1, 0
+        return items
+
+
+class Ranking:
+    def __init__(self, scores=()):
+        self.points = {}
+        self.names = {}
+        for score in scores:
+            self.points[score["user_id"]] = score["points"]
+            self.names[score["user_id"]] = score["name"]
+        self.order = SortedList((-points, user_id) for user_id, points in self.points.items())
+
+    def add(self, user_id, points, name):
+        self.set(user_id, self.points.get(user_id, 0) + points, name)
+
+    def set(self, user_id, points, name):
+        old = self.points.get(user_id)
+        if old is not None:
+            self.order.remove((-old, user_id))
+        self.points[user_id] = points
+        self.names[user_id] = name
+        self.order.add((-points, user_id))
+
+    def rank(self, user_id):
+        """
+        1-based rank of the user, tied users sharing the best rank, or None if they have no score
+        """
+        points = self.points.get(user_id)
+        if points is None:
+            return None
+        return self.order.bisect_left((-points, "")) + 1
+
+    def page(self, limit, after=None):
+        """
+        Up to limit entries, best first, starting after the (points, user_id) of the previous page's last entry.
+
+        Returns:
+            tuple: (entries with rank, user_id, name and points, whether more entries follow)
+        """
+        start = 0 if after is None else self.order.bisect_right((-after[0], after[1]))
+        entries = []
+        rank = None
+        for position, (negative, user_id) in enumerate(self.order.slice(start, start + limit), start):
+            if rank is None:
+                rank = self.rank(user_id)
+            elif -negative != entries[-1]["points"]:
+                rank = position + 1
+            entries.append({"rank": rank, "user_id": user_id, "name": self.names[user_id], "points": -negative})
+        return entries, start + limit < len(self.order)
+
+
+class Leaderboards:
+    def __init__(self, ttl=60, max_windows=16):
+        """
+        Args:
+            ttl (float): Seconds a window's ranking is used before the scores updated since are read.
+            max_windows (int): Rankings kept in memory; weekly windows roll over, so old weeks are dropped.
+        """
+        self.ttl = ttl
+        self.max_windows = max_windows
+        self.lock = threading.Lock()
+        self.rankings = {}
+        self.writes = 0
+        self.counters = {"builds": 0, "refreshes": 0, "scores_refreshed": 0, "points_added": 0,
+                         "page_queries": 0, "rank_queries": 0}
+
+    def get(self, key):
+        """
+        The window's ranking: built from every score the first time, then brought up to date
+        with the scores updated since it was last read once it is ttl seconds old.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.rankings.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+            writes = self.writes
+        if entry is None:
+            ranking = Ranking(get_scores(key))
+        else:
+            _, ranking, read_at = entry
+            changed = get_scores(key, since=read_at - CLOCK_SKEW)
+        with self.lock:
+            if entry is None:
+                self.counters["builds"] += 1
+            else:
+                # Scores are totals, so one read twice or after our own add is still right
+                for score in changed:
+                    ranking.set(score["user_id"], score["points"], score["name"])
+                self.counters["refreshes"] += 1
+                self.counters["scores_refreshed"] += len(changed)
+            if len(self.rankings) >= self.max_windows and key not in self.rankings:
+                self.rankings.pop(min(self.rankings, key=lambda window: self.rankings[window][0]))
+            # Points recorded while the scores were read may be missing, so they are read again next time
+            self.rankings[key] = (now + self.ttl if writes == self.writes else now, ranking, now)
+        return ranking
+
+    def record(self, user_id, name, points, now=None):
+        """
+        Adds points to the user's score in every window, in the backend and in the rankings held here.
+        """
+        keys = [window_key(window, now) for window in WINDOWS]
+        add_points(points, name, keys, user_id=user_id)
+        with self.lock:
+            self.writes += 1
+            self.counters["points_added"] += points
+            for key in keys:
+                entry = self.rankings.get(key)
+                if entry is not None:
+                    entry[1].add(user_id, points, name)
+
+    def top(self, window, limit, cursor=None):
+        """
+        One page of the window's leaderboard, best first. Entries of the all-time window also carry
+        the user's points this week as weekly_points.
+
+        Returns:
+            dict: window, entries, users (number of users with a score) and next_cursor (None on the last page).
+        """
+        after = decode_cursor(cursor, 2) if cursor is not None else None
+        if after is not None and (not isinstance(after[0], (int, float)) or not isinstance(after[1], str)):
+            raise ValueError("Invalid cursor '%s'" % cursor)
+        ranking = self.get(window_key(window))
+        week = self.get(window_key("week")) if window == "all" else None
+        with self.lock:
+            entries, more = ranking.page(limit, after)
+            if week is not None:
+                for entry in entries:
+                    entry["weekly_points"] = week.points.get(entry["user_id"], 0)
+            users = len(ranking.order)
+            self.counters["page_queries"] += 1
+        next_cursor = encode_cursor(entries[-1]["points"], entries[-1]["user_id"]) if more else None
+        return {"window": window, "entries": entries, "users": users, "next_cursor": next_cursor}
+
+    def rank(self, window, user_id):
+        """
+        The user's rank and points in the window; rank is None when they have no points in it yet.
+        """
+        ranking = self.get(window_key(window))
+        with self.lock:
+            self.counters["rank_queries"] += 1
+            return {"window": window, "user_id": user_id, "name": ranking.names.get(user_id),
+                    "rank": ranking.rank(user_id), "points": ranking.points.get(user_id, 0),
+                    "users": len(ranking.order)}
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, "windows": len(self.rankings),
+                    "users": {key: len(entry[1].order) for key, entry in self.rankings.items()}}
+
+
+def create_leaderboards():
+    """
+    Builds the process-wide leaderboards from LEADERBOARD_* environment variables.
+    """
+    return Leaderboards(
+        ttl=float(os.getenv("LEADERBOARD_TTL", "60")),
+        max_windows=int(os.getenv("LEADERBOARD_WINDOWS", "16")),
+    )
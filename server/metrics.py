@@ -0,0 +1,187 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+'''
+    Per-request stage timings
+    Code wraps its slow parts in stage('db') / stage('model') and app.py reports
+    the totals for each request in a Server-Timing header.
+
+    Process-wide counters and histograms
+    Every stage is also recorded in the stage_seconds histogram, and other modules
+    declare their own with counter() / histogram(). render() writes them all in
+    the Prometheus text format for the /metrics endpoint.
+
+    Trace spans
+    When tracing is turned on for a request, every stage is also kept as a span
+    (name, start offset and duration) that app.py writes to the request log.
+'''
+
+_stages = ContextVar('stages', default=None)
+_spans = ContextVar('spans', default=None)
+
+
+def reset(trace=False):
+    _stages.set({})
+    _spans.set((time.perf_counter(), []) if trace else None)
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stages = _stages.get()
+        if stages is not None:
+            stages[name] = stages.get(name, 0.0) + elapsed
+        spans = _spans.get()
+        if spans is not None:
+            spans[1].append({'name': name, 'start_ms': (start - spans[0]) * 1000, 'duration_ms': elapsed * 1000})
+        stage_seconds.observe(elapsed, stage=name)
+
+
+def stages():
+    '''
+        @return: {stage name: seconds} for the current request
+    '''
+    return dict(_stages.get() or {})
+
+
+def spans():
+    '''
+        @return: the current request's spans, or None if it isn't traced
+    '''
+    spans = _spans.get()
+    return list(spans[1]) if spans is not None else None
+
+
+def server_timing_header():
+    return ', '.join('%s;dur=%.1f' % (name, seconds * 1000) for name, seconds in stages().items())
+
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _label_key(names, labels):
+    return tuple(str(labels.get(name, '')) for name in names)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [(name, value) for name, value in zip(names, values)] + list(extra)
+    if not pairs:
+        return ''
+    escaped = ('%s="%s"' % (name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in pairs)
+    return '{%s}' % ','.join(escaped)
+
+
+class Counter:
+    '''
+        Monotonic total, one series per combination of label values
+    '''
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labels, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, values, (), total) for values, total in sorted(self.values.items())]
+
+
+class Histogram:
+    '''
+        Distribution of observed values (seconds by default) in cumulative buckets
+    '''
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labels, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [[0] * len(self.buckets), 0, 0.0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def samples(self):
+        with self.lock:
+            values = sorted((key, (list(counts), count, total)) for key, (counts, count, total) in self.values.items())
+        samples = []
+        for key, (counts, count, total) in values:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                samples.append((self.name + '_bucket', key, (('le', '%g' % bound),), cumulative))
+            samples.append((self.name + '_bucket', key, (('le', '+Inf'),), count))
+            samples.append((self.name + '_count', key, (), count))
+            samples.append((self.name + '_sum', key, (), total))
+        return samples
+
+
+def _register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+
+def counter(name, help, labels=()):
+    return _register(Counter(name, help, labels))
+
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, help, labels, buckets))
+
+
+def render(gauges=None):
+    '''
+        All registered metrics, plus the given {name: value} gauges, in the Prometheus text format
+    '''
+    lines = []
+    with _registry_lock:
+        metrics = list(_registry)
+    for metric in metrics:
+        lines.append('# HELP %s %s' % (metric.name, metric.help))
+        lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+        for name, values, extra, value in metric.samples():
+            lines.append('%s%s %s' % (name, _format_labels(metric.labels, values, extra), _format_value(value)))
+    for name, value in (gauges or {}).items():
+        lines.append('# TYPE %s gauge' % name)
+        lines.append('%s %s' % (name, _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+stage_seconds = histogram('stage_seconds', 'Time spent in each request stage (db, model, image, parse, ...)', ('stage',))
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+"""
+Process-wide Gemini model registry.
+
+The API key is loaded and genai is configured once per process, and one
+GenerativeModel is built per (model name, generation_config) and reused by every
+request, so the config and its response schema are converted to protos once and
+all calls share the SDK's client and its connection. A semaphore bounds how many
+calls are in flight at once.
+
+google.generativeai takes most of the server's import time, so it is only
+imported by the first configure(), when the first model is needed or a readiness
+probe warms the process up.
+
+GEMINI_BACKEND=fake swaps every model for fake_model.FakeGenerativeModel, which
+needs no API key and answers after FAKE_MODEL_LATENCY (+ FAKE_MODEL_JITTER) seconds.
+FAKE_MODEL_ERROR_RATE (with FAKE_MODEL_ERROR_CODE) and FAKE_MODEL_STALL_RATE (with
+FAKE_MODEL_STALL seconds) inject failures and stalls.
+"""
+
+_lock = threading.Lock()
+_configured = False
+_models = {}
+_fingerprints = {}
+_fake = os.getenv("GEMINI_BACKEND", "gemini") == "fake"
+_slots = threading.BoundedSemaphore(int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")))
+_stats = {"configure_seconds": 0.0, "model_builds": 0, "model_build_seconds": 0.0,
+          "model_reuses": 0, "slot_wait_seconds": 0.0}
+
+
+def configure():
+    """
+    Loads GEMINI_API_KEY and configures genai. Only the first call does any work.
+    """
+    global _configured
+    if _configured:
+        return
+    with _lock:
+        if _configured:
+            return
+        start = time.perf_counter()
+        if _fake:
+            _configured = True
+            return
+        import google.generativeai as genai
+        from dotenv import load_dotenv
+        load_dotenv()
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY is not set. Please set it as an environment variable.")
+        genai.configure(api_key=api_key)
+        _stats["configure_seconds"] = time.perf_counter() - start
+        _configured = True
+
+
+def config_fingerprint(generation_config):
+    """
+    Canonical hash of a generation_config. Configs are expected to be long-lived
+    (module constants), so the hash is remembered per config object.
+    """
+    if generation_config is None:
+        return ""
+    entry = _fingerprints.get(id(generation_config))
+    if entry is not None and entry[0] is generation_config:
+        return entry[1]
+    canonical = json.dumps(generation_config, sort_keys=True, separators=(",", ":"), default=str)
+    fingerprint = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+    with _lock:
+        if len(_fingerprints) > 256:
+            _fingerprints.clear()
+        # Keeping a reference to the config stops its id from being reused by another object
+        _fingerprints[id(generation_config)] = (generation_config, fingerprint)
+    return fingerprint
+
+
+def get_model(model_name, generation_config=None):
+    """
+    Returns the shared GenerativeModel for model_name with generation_config bound to it.
+    """
+    configure()
+    key = (model_name, config_fingerprint(generation_config))
+    model = _models.get(key)
+    if model is not None:
+        with _lock:
+            _stats["model_reuses"] += 1
+        return model
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            start = time.perf_counter()
+            model = build_model(model_name, generation_config)
+            _stats["model_builds"] += 1
+            _stats["model_build_seconds"] += time.perf_counter() - start
+            _models[key] = model
+        else:
+            _stats["model_reuses"] += 1
+    return model
+
+
+def build_model(model_name, generation_config):
+    if _fake:
+        from fake_model import FakeGenerativeModel
+        return FakeGenerativeModel(model_name, generation_config,
+                                   latency=float(os.getenv("FAKE_MODEL_LATENCY", "0.5")),
+                                   jitter=float(os.getenv("FAKE_MODEL_JITTER", "0.1")),
+                                   error_rate=float(os.getenv("FAKE_MODEL_ERROR_RATE", "0")),
+                                   error_code=int(os.getenv("FAKE_MODEL_ERROR_CODE", "503")),
+                                   stall_rate=float(os.getenv("FAKE_MODEL_STALL_RATE", "0")),
+                                   stall=float(os.getenv("FAKE_MODEL_STALL", "0")),
+                                   seed=int(os.getenv("FAKE_MODEL_SEED", "0")))
+    import google.generativeai as genai
+    return genai.GenerativeModel(model_name=model_name, generation_config=generation_config)
+
+
+@contextmanager
+def slot():
+    """
+    Holds one of the GEMINI_MAX_CONCURRENCY call slots for the duration of a model call.
+    """
+    start = time.perf_counter()
+    _slots.acquire()
+    waited = time.perf_counter() - start
+    with _lock:
+        _stats["slot_wait_seconds"] += waited
+    try:
+        yield
+    finally:
+        _slots.release()
+
+
+def stats():
+    """
+    Setup overhead paid so far: configure time, model builds and how often a model was reused.
+    """
+    with _lock:
+        return {**_stats, "configured": _configured, "models": len(_models), "fake": _fake}
@@ -0,0 +1,319 @@
+import csv
+import difflib
+import os
+import re
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+"""
+Local nutrition and carbon-footprint scoring.
+
+data/nutrition.csv holds per-100g calories and macros, kg CO2e per kg and typical
+piece weight and density for common ingredients. Recipe ingredient names are
+matched against its names and aliases (exactly, then fuzzily; qualifiers like "almond"
+in "almond milk" are kept, so such names only match through an explicit alias), amounts
+are converted to grams, and a whole batch of recipes is scored with a handful of
+NumPy operations: total nutrients, total emissions and a 0-10 points score from
+energy shares, emissions per 1000 kcal and disease-specific deductions.
+
+The same names, units and table also merge the ingredient lists of several scans
+of one pantry (merge_ingredients).
+"""
+
+TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "nutrition.csv")
+
+NUTRIENTS = ("kcal", "fat", "protein", "carbs")
+
+# Units measured by weight, in grams
+UNIT_GRAMS = {
+    "g": 1, "gram": 1, "gr": 1, "kg": 1000, "kilogram": 1000, "mg": 0.001,
+    "oz": 28.35, "ounce": 28.35, "lb": 453.6, "pound": 453.6, "can": 400, "tin": 400,
+}
+
+# Units measured by volume, in ml, converted to grams with the ingredient's density
+UNIT_ML = {
+    "ml": 1, "milliliter": 1, "millilitre": 1, "l": 1000, "liter": 1000, "litre": 1000,
+    "cup": 240, "tbsp": 15, "tablespoon": 15, "tsp": 5, "teaspoon": 5, "fl oz": 29.6,
+    "pinch": 0.3, "dash": 0.6, "splash": 5,
+}
+
+# Words that describe how an ingredient is prepared, not what it is
+DESCRIPTORS = {
+    "fresh", "chopped", "diced", "sliced", "minced", "grated", "shredded", "large", "small", "medium",
+    "organic", "raw", "cooked", "boneless", "skinless", "dried", "frozen", "canned", "ripe", "whole",
+    "crushed", "ground", "peeled", "finely", "freshly", "roughly", "lean", "extra", "virgin", "to", "taste", "of",
+}
+
+# (disease keywords, penalty, condition) where condition is a tag present in the recipe
+# or one of the energy share limits below
+DISEASE_RULES = [
+    (("lactose", "dairy"), 3, "dairy"),
+    (("celiac", "coeliac", "gluten"), 4, "gluten"),
+    (("diabetes", "diabetic", "prediabetes"), 2, "high_carbs"),
+    (("hypertension", "heart", "cholesterol", "cardiovascular"), 2, "high_fat"),
+    (("kidney", "renal"), 1, "high_protein"),
+    (("egg",), 3, "egg"),
+    (("nut", "peanut"), 4, "nut"),
+    (("shellfish", "fish"), 4, "fish"),
+]
+
+
+def singular(word):
+    if len(word) <= 3 or word.endswith("ss"):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("oes", "ches", "shes")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def normalize_name(name):
+    """
+    Lowercase, singular, without quantities, parentheses, punctuation or preparation words.
+    """
+    name = re.sub(r"\(.*?\)", " ", name.lower())
+    words = re.findall(r"[a-zñé]+", name)
+    return " ".join(singular(word) for word in words if word not in DESCRIPTORS)
+
+
+def normalize_unit(units):
+    units = (units or "").strip().lower().rstrip(".")
+    if units in UNIT_GRAMS or units in UNIT_ML:
+        return units
+    return singular(units)
+
+
+class NutritionTable:
+    def __init__(self, path=TABLE_PATH):
+        names, rows, co2e, piece_grams, density, tags = [], [], [], [], [], []
+        self.index = {}
+        with open(path, newline="", encoding="utf-8") as table_file:
+            for i, row in enumerate(csv.DictReader(table_file)):
+                names.append(row["name"])
+                rows.append([float(row[nutrient]) for nutrient in NUTRIENTS])
+                co2e.append(float(row["co2e_per_kg"]))
+                piece_grams.append(float(row["grams_per_piece"]))
+                density.append(float(row["grams_per_ml"]))
+                tags.append(set(filter(None, row["tags"].split("|"))))
+                for alias in [row["name"], *filter(None, row["aliases"].split("|"))]:
+                    self.index.setdefault(normalize_name(alias), i)
+        self.names = names
+        self.values = np.array(rows, dtype=np.float64)
+        self.co2e = np.array(co2e, dtype=np.float64)
+        self.piece_grams = np.array(piece_grams, dtype=np.float64)
+        self.density = np.array(density, dtype=np.float64)
+        self.tags = {tag: np.array([tag in row_tags for row_tags in tags], dtype=np.float64)
+                     for tag in set().union(*tags)}
+        self.keys = list(self.index)
+        self.lookup = lru_cache(maxsize=4096)(self._lookup)
+
+    def _lookup(self, name):
+        """
+        Row of the table matching an ingredient name, or None
+        """
+        key = normalize_name(name)
+        if not key:
+            return None
+        if key in self.index:
+            return self.index[key]
+        # Multi-word names only match through an alias: dropping words would turn "almond milk"
+        # into "milk" and "peanut oil" into "olive oil"
+        close = difflib.get_close_matches(key, self.keys, n=1, cutoff=0.85)
+        return self.index[close[0]] if close else None
+
+    def convert(self, row, count, units, target):
+        """
+        count of units expressed in the target unit ("grams", "ml" or a piece-like unit), or None
+        """
+        grams = self.grams(row, count, units)
+        if target == "grams":
+            return grams
+        if target == "ml":
+            return grams / self.density[row] if self.density[row] else None
+        return grams / self.piece_grams[row] if self.piece_grams[row] else None
+
+    def grams(self, row, count, units):
+        units = normalize_unit(units)
+        if units in UNIT_GRAMS:
+            return count * UNIT_GRAMS[units]
+        if units in UNIT_ML:
+            return count * UNIT_ML[units] * self.density[row]
+        # piece, clove, slice, head, ... or no unit at all
+        return count * self.piece_grams[row]
+
+    def score(self, recipes, diseases=()):
+        """
+        Scores every recipe at once.
+
+        Args:
+            recipes (list): Recipes with 'ingredients' as [{'name', 'count', 'units'}].
+            diseases (list): The user's diseases, matched against DISEASE_RULES.
+
+        Returns:
+            list: Per recipe, nutritional_values, carbon_footprint (kg CO2e), points_response (0-10),
+            the nutrient totals, the fraction of ingredients found in the table and the unmatched names.
+        """
+        rows, grams, owner = [], [], []
+        unmatched = [[] for _ in recipes]
+        counts = np.zeros(len(recipes))
+        for i, recipe in enumerate(recipes):
+            for ingredient in recipe.get("ingredients") or []:
+                counts[i] += 1
+                row = self.lookup(ingredient.get("name", ""))
+                if row is None:
+                    unmatched[i].append(ingredient.get("name", ""))
+                    continue
+                count = ingredient.get("count")
+                try:
+                    # A missing count is one piece, but 0 is nothing
+                    count = 1.0 if count is None or count == "" else float(count)
+                except (TypeError, ValueError):
+                    count = 1.0
+                rows.append(row)
+                grams.append(self.grams(row, count, ingredient.get("units")))
+                owner.append(i)
+
+        size = len(recipes)
+        rows = np.array(rows, dtype=np.intp)
+        grams = np.array(grams, dtype=np.float64)
+        owner = np.array(owner, dtype=np.intp)
+
+        totals = np.zeros((size, len(NUTRIENTS)))
+        np.add.at(totals, owner, self.values[rows] * (grams / 100)[:, None])
+        co2 = np.bincount(owner, weights=grams / 1000 * self.co2e[rows], minlength=size)
+        matched = np.bincount(owner, minlength=size)
+        present = {tag: np.bincount(owner, weights=mask[rows], minlength=size) > 0
+                   for tag, mask in self.tags.items()}
+
+        energy = np.maximum(totals[:, 0], 1.0)
+        fat_share = totals[:, 1] * 9 / energy
+        protein_share = totals[:, 2] * 4 / energy
+        carb_share = totals[:, 3] * 4 / energy
+        present["high_fat"] = fat_share > 0.35
+        present["high_carbs"] = carb_share > 0.55
+        present["high_protein"] = protein_share > 0.3
+
+        # Up to 5 points for a balanced plate, up to 5 for low emissions per 1000 kcal
+        health = np.clip(5 - np.clip((fat_share - 0.35) * 10, 0, None)
+                         - np.clip((0.15 - protein_share) * 20, 0, None), 0, 5)
+        co2_per_1000_kcal = co2 / energy * 1000
+        carbon = np.clip(5 * (8 - co2_per_1000_kcal) / 7, 0, 5)
+        points = health + carbon
+        deductions = [[] for _ in recipes]
+        for keywords, penalty, condition in DISEASE_RULES:
+            if condition not in present:
+                continue
+            for disease in diseases or ():
+                words = {singular(word) for word in re.findall(r"[a-z]+", disease.lower())}
+                if any(keyword in words for keyword in keywords):
+                    hits = present[condition]
+                    points = points - penalty * hits
+                    for i in np.flatnonzero(hits):
+                        deductions[i].append("%s (-%d)" % (disease, penalty))
+                    break
+        points = np.clip(np.rint(points), 0, 10).astype(int)
+        coverage = np.divide(matched, counts, out=np.zeros(size), where=counts > 0)
+
+        return [{
+            "nutritional_values": "Calories: %d kcal, Fat: %.0f g, Proteins: %.0f g, Carbohydrates: %.0f g" % (
+                round(totals[i, 0]), totals[i, 1], totals[i, 2], totals[i, 3]),
+            "carbon_footprint": round(float(co2[i]), 2),
+            "points_response": int(points[i]),
+            "nutrients": dict(zip(NUTRIENTS, (round(float(value), 1) for value in totals[i]))),
+            "deductions": deductions[i],
+            "coverage": float(coverage[i]),
+            "unmatched": unmatched[i],
+        } for i in range(size)]
+
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def get_table():
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None:
+                _table = NutritionTable()
+    return _table
+
+
+def score_recipes(recipes, diseases=()):
+    return get_table().score(recipes, diseases)
+
+
+def number(value, default=None):
+    """
+    value as a number, or the first number in a string like "7 days", else default
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    match = re.search(r"\d+(?:\.\d+)?", str(value or ""))
+    return float(match.group()) if match else default
+
+
+def canonical_amount(count, units):
+    """
+    (count, units) with weights in grams, volumes in ml and other units normalized, e.g. "Pieces" -> "piece"
+    """
+    units = normalize_unit(units) or "piece"
+    if units in UNIT_GRAMS:
+        return count * UNIT_GRAMS[units], "grams"
+    if units in UNIT_ML:
+        return count * UNIT_ML[units], "ml"
+    return count, units
+
+
+def merge_ingredients(scans):
+    """
+    Merges the ingredient lists of several scans into one.
+
+    Names are normalized, so "Tomatoes" and "tomato" are one item. Weights are added up in grams,
+    volumes in ml and other units (piece, clove, ...) as they are. An item seen in more than one
+    unit is converted to the unit it was first seen in when the table knows its piece weight and
+    density, and otherwise kept as a separate entry. Each item keeps its earliest expiry and its
+    highest carbon footprint.
+
+    Args:
+        scans (list): Ingredient lists, each [{'name', 'count', 'units', 'expiry', 'carbon_footprint'}, ...].
+
+    Returns:
+        list: Merged ingredients in the order they were first seen.
+    """
+    table = get_table()
+    merged = {}
+    for ingredients in scans:
+        for ingredient in ingredients:
+            raw_name = str(ingredient.get("name") or "").strip()
+            name = normalize_name(raw_name) or raw_name.lower()
+            if not name:
+                continue
+            count, units = canonical_amount(number(ingredient.get("count"), 1), ingredient.get("units"))
+            expiry = number(ingredient.get("expiry"))
+            carbon_footprint = number(ingredient.get("carbon_footprint"))
+            entries = merged.setdefault(name, [])
+            for entry in entries:
+                amount = count if units == entry["units"] else None
+                if amount is None:
+                    row = table.lookup(name)
+                    amount = table.convert(row, count, units, entry["units"]) if row is not None else None
+                if amount is not None:
+                    entry["count"] += float(amount)
+                    entry["expiry"] = min(filter(lambda days: days is not None, (entry["expiry"], expiry)), default=None)
+                    entry["carbon_footprint"] = max(filter(lambda footprint: footprint is not None,
+                                                           (entry["carbon_footprint"], carbon_footprint)), default=None)
+                    break
+            else:
+                entries.append({"name": name, "count": count, "units": units, "expiry": expiry,
+                                "carbon_footprint": carbon_footprint})
+    items = [entry for entries in merged.values() for entry in entries]
+    for item in items:
+        count = round(item["count"], 2)
+        item["count"] = int(count) if count == int(count) else count
+    return items
@@ -0,0 +1,101 @@
+import argparse
+import contextlib
+import io
+import json
+import random
+import re
+import timeit
+
+from fake_model import fake_ingredients, fake_points, fake_recipe
+from jsonstream import FieldStream, parse_object
+from schemas import IngredientList, Points, Recipe, RecipeBatch
+
+"""
+Micro-benchmark of model output parsing.
+
+Compares the previous parse_json_response (a greedy {.*} DOTALL regex over the
+whole response, then json.loads) with jsonstream.parse_object, with parse_object
+plus schema validation into records (schemas.py), and with feeding the response
+to a FieldStream in chunks as stream_recipe does. Responses are fake_model.py's
+ingredient lists, recipes, points and a batch of recipes, as returned, wrapped in
+a ```json fence followed by prose, and cut off before the end. Reports
+microseconds per parse, or why a path failed.
+
+    python parse_benchmark.py
+    python parse_benchmark.py --number 2000 --batch 10
+"""
+
+
+def legacy_parse(response_text):
+    json_match = re.search(r"\{.*\}", response_text, re.DOTALL)
+    if json_match:
+        try:
+            return json.loads(json_match.group(0))
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON format: {e}")
+    raise ValueError("No JSON content found in the response.")
+
+
+def streamed_parse(response_text, chunks=8):
+    stream = FieldStream(item_fields=("instructions",))
+    size = -(-len(response_text) // chunks)
+    for i in range(0, len(response_text), size):
+        stream.feed(response_text[i:i + size])
+    stream.finish()
+    return stream.fields
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=500, help="parses timed per case and path")
+    parser.add_argument("--batch", type=int, default=5, help="recipes in the batch response")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def responses(rng, batch):
+    """
+    (name, text, validate) for every response shape, where validate turns the parsed dict into records
+    """
+    recipe = fake_recipe(rng, ["tomato", "egg", "spinach", "cheddar cheese"])
+    shapes = [
+        ("ingredients", fake_ingredients(rng), IngredientList.validate),
+        ("recipe", recipe, Recipe.validate),
+        ("points", fake_points(rng), Points.validate),
+        ("recipe batch", {"recipes": [fake_recipe(rng, ["rice", "onion"]) for _ in range(batch)]}, RecipeBatch.validate),
+    ]
+    cases = []
+    for name, value, validate in shapes:
+        text = json.dumps(value, indent=2)
+        cases.append((name, text, validate))
+        cases.append((name + " fenced", "```json\n%s\n```\nThe {recipe} above uses what you have." % text, validate))
+        cases.append((name + " cut off", text[:int(len(text) * 0.9)], validate))
+    return cases
+
+
+def measure(fn, text, number):
+    # Dropped elements are printed, which would dominate the timing
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            fn(text)
+        except Exception as e:
+            return None, type(e).__name__
+        return timeit.timeit(lambda: fn(text), number=number) / number * 1e6, None
+
+
+def main():
+    args = parse_args()
+    paths = [("regex+loads", legacy_parse), ("parse_object", parse_object)]
+    cases = responses(random.Random(args.seed), args.batch)
+    print("%-22s %7s  %14s %14s %14s %14s" % ("response", "bytes", *[name for name, _ in paths],
+                                               "+validate", "FieldStream"))
+    for name, text, validate in cases:
+        cells = [measure(fn, text, args.number) for _, fn in paths]
+        cells.append(measure(lambda response: validate(parse_object(response)), text, args.number))
+        cells.append(measure(streamed_parse, text, args.number) if "fenced" not in name else (None, "n/a"))
+        print("%-22s %7d  %s" % (name, len(text), " ".join(
+            "%11.1f us" % seconds if seconds is not None else "%14s" % failure for seconds, failure in cells)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+
+"""
+Read-through cache for the per-user documents database.py reads on every request.
+
+Profiles and inventories only change through our own writes, so database.py
+invalidates an entry whenever it writes the matching document and reads are
+otherwise served from memory. Each entry still expires after a TTL, which bounds
+how stale it can get when another process writes the same user. With a listener
+(Firestore snapshot listeners) remote writes invalidate entries as they happen;
+serve.py turns listeners on whenever it runs more than one worker. Writes that
+depend on the current value (points) never read it from here but are applied
+atomically by the backend.
+"""
+
+
+class ReadCache:
+    def __init__(self, ttl=30, max_entries=1024, listen=None):
+        """
+        Args:
+            ttl (float): Seconds an entry is served before it is read again, 0 disables the cache.
+            max_entries (int): (kind, user) entries kept before the least recently used is evicted.
+            listen (callable): Optional listen(kind, user_id, on_change) that calls on_change
+                whenever the document changes anywhere, returning a function that stops listening.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.listen = listen
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        # Bumped by every invalidation, so a read that started before a write never stores its result.
+        # Only kept for keys with reads in flight (counted in loading), so neither grows past the reads running.
+        self.versions = {}
+        self.loading = {}
+        self.listeners = {}
+        self.counters = {"hits": 0, "misses": 0, "invalidations": 0, "remote_invalidations": 0,
+                         "evictions": 0, "expired": 0}
+
+    def get(self, kind, user_id, load):
+        """
+        Returns a copy of the cached value for (kind, user_id), calling load() on a miss.
+        """
+        if self.ttl <= 0:
+            return load()
+        key = (kind, user_id)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self.entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return copy.deepcopy(value)
+                del self.entries[key]
+                self.counters["expired"] += 1
+            self.counters["misses"] += 1
+            self.loading[key] = self.loading.get(key, 0) + 1
+            version = self.versions.get(key, 0)
+
+        try:
+            value = load()
+            self._watch(key)
+        except BaseException:
+            with self.lock:
+                self._loaded(key)
+            raise
+        stops = []
+        with self.lock:
+            if self.versions.get(key, 0) == version:
+                self.entries[key] = (now + self.ttl, copy.deepcopy(value))
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    evicted, _ = self.entries.popitem(last=False)
+                    self.counters["evictions"] += 1
+                    stops.append(self.listeners.pop(evicted, None))
+            self._loaded(key)
+        for stop in stops:
+            if stop is not None:
+                stop()
+        return value
+
+    def invalidate(self, kind, user_id):
+        key = (kind, user_id)
+        with self.lock:
+            self._bump(key)
+            self.entries.pop(key, None)
+            self.counters["invalidations"] += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {**self.counters,
+                    "hit_ratio": self.counters["hits"] / lookups if lookups else 0.0,
+                    "entries": len(self.entries),
+                    "listeners": len(self.listeners)}
+
+    def _bump(self, key):
+        # With no read in flight there is nothing to stop storing, and no version to keep
+        if key in self.loading:
+            self.versions[key] = self.versions.get(key, 0) + 1
+
+    def _loaded(self, key):
+        remaining = self.loading[key] - 1
+        if remaining:
+            self.loading[key] = remaining
+        else:
+            del self.loading[key]
+            self.versions.pop(key, None)
+
+    def _watch(self, key):
+        if self.listen is None:
+            return
+        with self.lock:
+            if key in self.listeners:
+                return
+            self.listeners[key] = None
+
+        def changed():
+            with self.lock:
+                self._bump(key)
+                self.entries.pop(key, None)
+                self.counters["remote_invalidations"] += 1
+
+        try:
+            stop = self.listen(key[0], key[1], changed)
+        except Exception as e:
+            print("could not listen for %s changes of %s: %s" % (key[0], key[1], e))
+            stop = None
+        with self.lock:
+            self.listeners[key] = stop
+
+
+def create_read_cache(backend):
+    """
+    Builds the cache for backend from READ_CACHE_* environment variables.
+    READ_CACHE_LISTEN=1 also listens for changes made by other processes, when the backend supports it.
+    """
+    listen = None
+    if os.getenv("READ_CACHE_LISTEN", "0") == "1" and hasattr(backend, "watch"):
+        listen = backend.watch
+    return ReadCache(
+        ttl=float(os.getenv("READ_CACHE_TTL", "30")),
+        max_entries=int(os.getenv("READ_CACHE_SIZE", "1024")),
+        listen=listen,
+    )
@@ -0,0 +1,272 @@
+import json
+import os
+import threading
+import time
+
+from database import get_recipes
+from nutrition import get_table, normalize_name
+
+"""
+Local index of recipes that can be served without a model call.
+
+Each user's confirmed recipes (plus an optional shared corpus, RECIPE_CORPUS) are
+indexed by ingredient. Ingredient names are normalized to a vocabulary and every
+recipe becomes a bitset over it, held in a Python int, and each ingredient keeps
+a posting bitset of the recipes that use it. A query ORs the postings of the
+pantry's ingredients to find candidates, drops recipes that hit an allergy or
+restriction, and ranks the rest by the share of their ingredients in the pantry
+(popcount of recipe & pantry) and by how soon those pantry items expire.
+"""
+
+# Restrictions that exclude whole groups of ingredients, by nutrition.py table tags
+RESTRICTION_TAGS = {
+    "vegetarian": {"meat", "fish"},
+    "pescatarian": {"meat"},
+    "vegan": {"meat", "fish", "dairy", "egg"},
+    "dairy": {"dairy"},
+    "lactose": {"dairy"},
+    "gluten": {"gluten"},
+    "nut": {"nut"},
+    "egg": {"egg"},
+    "shellfish": {"fish"},
+    "fish": {"fish"},
+}
+
+# Assumed to be in every kitchen, like the generation prompt does
+STAPLES = ("salt", "black pepper", "pepper", "olive oil", "oil", "vegetable oil", "water", "sugar")
+
+
+class RecipeIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.vocabulary = {}
+        self.recipes = []
+        self.bits = []
+        self.postings = []
+        self.names = {}
+        self.exclusions = {}
+
+    def term(self, name):
+        key = normalize_name(name)
+        if key not in self.vocabulary:
+            self.vocabulary[key] = len(self.vocabulary)
+            self.postings.append(0)
+        return self.vocabulary[key]
+
+    def add(self, recipe):
+        """
+        Indexes a recipe. A recipe with the same name as an indexed one replaces it.
+        """
+        names = [ingredient["name"] for ingredient in recipe.get("ingredients") or [] if ingredient.get("name")]
+        if not names:
+            return
+        key = normalize_name(recipe.get("recipe_name", ""))
+        position = self.names.get(key)
+        if position is not None:
+            self._unpost(position)
+        else:
+            position = len(self.recipes)
+            self.recipes.append(None)
+            self.bits.append(0)
+            self.names[key] = position
+        bits = 0
+        for name in names:
+            bits |= 1 << self.term(name)
+        self.recipes[position] = recipe
+        self.bits[position] = bits
+        recipe_bit = 1 << position
+        for term in iter_bits(bits):
+            self.postings[term] |= recipe_bit
+
+    def _unpost(self, position):
+        mask = ~(1 << position)
+        for term in iter_bits(self.bits[position]):
+            self.postings[term] &= mask
+
+    def excluded_terms(self, avoid):
+        """
+        Bitset of the vocabulary terms that match any of the allergies/restrictions in avoid:
+        every word of the allergy is in the ingredient name ("peanut" excludes "peanut butter"),
+        or the ingredient has a nutrition.py tag the restriction rules out ("vegan" excludes "milk").
+        """
+        phrases = [set(normalize_name(item).split()) for item in avoid if item and item.strip()]
+        phrases = [words for words in phrases if words]
+        # The vocabulary only grows, so its size identifies it
+        cache_key = (tuple(sorted(" ".join(sorted(words)) for words in phrases)), len(self.vocabulary))
+        excluded = self.exclusions.get(cache_key)
+        if excluded is not None:
+            return excluded
+        tags = set()
+        for words in phrases:
+            for restriction, restricted_tags in RESTRICTION_TAGS.items():
+                if restriction in words:
+                    tags |= restricted_tags
+        table = get_table()
+        excluded = 0
+        for key, term in self.vocabulary.items():
+            key_words = set(key.split())
+            if any(words <= key_words for words in phrases):
+                excluded |= 1 << term
+                continue
+            row = table.lookup(key)
+            if row is not None and any(table.tags[tag][row] for tag in tags if tag in table.tags):
+                excluded |= 1 << term
+        self.exclusions[cache_key] = excluded
+        return excluded
+
+    def search(self, inventory, avoid=(), limit=5):
+        """
+        Ranks indexed recipes against a pantry.
+
+        Args:
+            inventory (list): Pantry items with 'name' and optionally 'expiry' (days left).
+            avoid (list): Allergies and restrictions; recipes using a matching ingredient are dropped.
+            limit (int): Recipes to return.
+
+        Returns:
+            list: (score, coverage, recipe) tuples, best first. coverage is the share of the
+            recipe's ingredients in the pantry; score adds up to 0.5 for using items that expire soon.
+        """
+        pantry = 0
+        for staple in STAPLES:
+            term = self.vocabulary.get(normalize_name(staple))
+            if term is not None:
+                pantry |= 1 << term
+        urgency = {}
+        for item in inventory:
+            key = normalize_name(item.get("name", ""))
+            term = self.vocabulary.get(key)
+            if term is None:
+                continue
+            pantry |= 1 << term
+            try:
+                days = max(float(item.get("expiry") or 30), 0.0)
+            except (TypeError, ValueError):
+                days = 30.0
+            urgency[term] = max(urgency.get(term, 0.0), 1 / (1 + days))
+
+        candidates = 0
+        for term in iter_bits(pantry):
+            candidates |= self.postings[term]
+        excluded = self.excluded_terms(avoid)
+        for term in iter_bits(excluded):
+            candidates &= ~self.postings[term]
+
+        ranked = []
+        for position in iter_bits(candidates):
+            bits = self.bits[position]
+            have = bits & pantry
+            coverage = have.bit_count() / bits.bit_count()
+            expiring = sum(urgency.get(term, 0.0) for term in iter_bits(have)) / bits.bit_count()
+            ranked.append((coverage + 0.5 * expiring, coverage, position))
+        ranked.sort(key=lambda entry: (-entry[0], -entry[1], -entry[2]))
+        return [(score, coverage, self.recipes[position]) for score, coverage, position in ranked[:limit]]
+
+
+def iter_bits(bits):
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def load_corpus(path):
+    """
+    Recipes from a JSON file holding a list of recipes or {"recipes": [...]}.
+    """
+    with open(path, encoding="utf-8") as corpus_file:
+        corpus = json.load(corpus_file)
+    return corpus["recipes"] if isinstance(corpus, dict) else corpus
+
+
+def recipe_key(recipe):
+    """
+    Identity of an indexed recipe: its history id, or its name for corpus recipes that have none
+    """
+    return recipe.get("id") or recipe.get("recipe_name")
+
+
+class RecipeIndexes:
+    """
+    One RecipeIndex per user, built from their recipe history on first use and rebuilt after ttl seconds,
+    so confirmations made by other server processes are picked up. The recipe last served to each
+    user is remembered, so asking again serves the next best match instead of the same one.
+    """
+
+    def __init__(self, corpus=(), ttl=600, max_users=1024):
+        self.corpus = list(corpus)
+        self.ttl = ttl
+        self.max_users = max_users
+        self.lock = threading.Lock()
+        self.indexes = {}
+        self.last_served = {}
+        self.counters = {"builds": 0, "searches": 0, "matches": 0}
+
+    def get(self, user_id):
+        now = time.time()
+        with self.lock:
+            entry = self.indexes.get(user_id)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+        index = RecipeIndex()
+        for recipe in self.corpus:
+            index.add(recipe)
+        # History is newest first; adding oldest first lets the newest copy of a recipe win
+        for recipe in reversed(get_recipes(user_id=user_id)["recipes"]):
+            index.add(recipe)
+        with self.lock:
+            if len(self.indexes) >= self.max_users and user_id not in self.indexes:
+                self.indexes.pop(min(self.indexes, key=lambda user: self.indexes[user][0]))
+            self.indexes[user_id] = (now + self.ttl, index)
+            self.counters["builds"] += 1
+        return index
+
+    def add(self, user_id, recipe):
+        """
+        Adds a newly confirmed recipe to the user's index, if it has been built.
+        """
+        with self.lock:
+            entry = self.indexes.get(user_id)
+        if entry is not None:
+            with entry[1].lock:
+                entry[1].add(recipe)
+
+    def best_match(self, user_id, inventory, avoid, min_coverage, skip_last=True):
+        """
+        The best ranked recipe whose coverage is at least min_coverage, with its coverage, or (None, 0).
+        With skip_last the recipe this returned last time for the user is passed over.
+        """
+        index = self.get(user_id)
+        with index.lock:
+            ranked = index.search(inventory, avoid, limit=2)
+        with self.lock:
+            self.counters["searches"] += 1
+            last = self.last_served.get(user_id) if skip_last else None
+        ranked = [entry for entry in ranked if last is None or recipe_key(entry[2]) != last][:1]
+        if not ranked or ranked[0][1] < min_coverage:
+            return None, 0.0
+        with self.lock:
+            self.counters["matches"] += 1
+            self.last_served.pop(user_id, None)
+            self.last_served[user_id] = recipe_key(ranked[0][2])
+            if len(self.last_served) > self.max_users:
+                self.last_served.pop(next(iter(self.last_served)))
+        return ranked[0][2], ranked[0][1]
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, "users": len(self.indexes), "corpus": len(self.corpus),
+                    "match_ratio": self.counters["matches"] / self.counters["searches"]
+                    if self.counters["searches"] else 0.0}
+
+
+def create_recipe_indexes():
+    """
+    Builds the process-wide indexes from RECIPE_INDEX_* and RECIPE_CORPUS environment variables.
+    """
+    corpus_path = os.getenv("RECIPE_CORPUS")
+    return RecipeIndexes(
+        corpus=load_corpus(corpus_path) if corpus_path else (),
+        ttl=float(os.getenv("RECIPE_INDEX_TTL", "600")),
+        max_users=int(os.getenv("RECIPE_INDEX_USERS", "1024")),
+    )
@@ -0,0 +1,242 @@
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+from algo import (assess_points_for_recipes, assess_points_from_recipe_header, generate_recipe_batch, local_assessments,
+                  stream_full_recipe_instructions)
+from database import DEFAULT_USER, get_expiring, get_inventory, get_profile
+from jsonstream import FieldStream, parse_object
+from metrics import stage
+from nutrition import score_recipes
+from recipe_index import create_recipe_indexes
+from resilience import ModelUnavailable
+from schemas import Points, Recipe, RecipeBatch, RecipeHeader, SchemaError
+
+"""
+Pipelined recipe generation for /recipes/generate.
+
+The profile, inventory and expiring-items reads run concurrently, the recipe is streamed from
+Gemini, and points scoring starts on a worker as soon as the streamed JSON holds
+the fields it needs, while the instructions are still being written. The request
+then takes about as long as its slowest stage instead of the sum of all of them.
+
+Before any of that, the user's recipe history is searched (recipe_index.py) and a
+stored recipe that the pantry covers well enough is served without a model call.
+When Gemini is unavailable (resilience.py), the best stored recipe is served with a
+lower bar, FALLBACK_COVERAGE.
+"""
+
+# Largest number of recipes one batched call may ask for
+MAX_BATCH = 5
+
+# Fields assess_points_from_recipe_header reads from the recipe
+SCORING_FIELDS = tuple(RecipeHeader.schema["properties"])
+
+# Points fields stored with a confirmed recipe
+POINTS_FIELDS = ("nutritional_values", "carbon_footprint", "points_response", "justification_response", "warnings")
+
+# Share of a stored recipe's ingredients the pantry must hold for it to be served instead of a new one
+MATCH_COVERAGE = float(os.getenv("RECIPE_MATCH_COVERAGE", "0.9"))
+
+# Share of a stored recipe's ingredients the pantry must hold for it to be served while Gemini is unavailable
+FALLBACK_COVERAGE = float(os.getenv("RECIPE_FALLBACK_COVERAGE", "0.5"))
+
+# The soonest-expiring items, up to this many and within this many days, are the ones the prompt asks to use up
+PRIORITY_INGREDIENTS = int(os.getenv("RECIPE_PRIORITY_INGREDIENTS", "5"))
+PRIORITY_DAYS = float(os.getenv("RECIPE_PRIORITY_DAYS", "7"))
+
+recipe_indexes = create_recipe_indexes()
+
+executor = ThreadPoolExecutor(max_workers=int(os.getenv("RECIPE_PIPELINE_WORKERS", "16")),
+                              thread_name_prefix="recipe")
+
+
+def submit(fn, *args):
+    """
+    Runs fn on the pipeline pool in a copy of the caller's context, so stage timings
+    recorded on the worker count towards the caller's request.
+    """
+    return executor.submit(copy_context().run, fn, *args)
+
+
+def stream_recipe(user_id=DEFAULT_USER, fresh=False):
+    """
+    Generates a recipe from the user's current inventory and profile and scores it, yielding
+    (event, data) pairs as the pieces become available:
+        field:  {"name": ..., "value": ...} for each recipe field except instructions
+        step:   {"index": ..., "text": ...} for each instruction step
+        points: the points analysis fields
+        done:   the recipe fields merged with the points analysis fields
+    fresh skips the search for a matching stored recipe, unless the model is unavailable, and
+    the cached model response for the same pantry, so every call asks the model for a new recipe.
+    """
+    profile_future = submit(get_profile, user_id)
+    inventory_future = submit(get_inventory, user_id)
+    expiring_future = submit(get_expiring, PRIORITY_INGREDIENTS, PRIORITY_DAYS, user_id)
+    profile = profile_future.result()
+    inventory = inventory_future.result()
+    expiring = expiring_future.result()
+
+    if not fresh:
+        with stage("match"):
+            match, coverage = recipe_indexes.best_match(user_id, inventory['ingredients'],
+                                                        profile['allergies'] + profile['restrictions'], MATCH_COVERAGE)
+        if match is not None:
+            print("serving stored recipe %s (%d%% of its ingredients in the pantry)" % (match['recipe_name'], coverage * 100))
+            yield from stored_recipe_events(match, coverage)
+            return
+
+    recipe = FieldStream(item_fields=("instructions",))
+    points_future = None
+    header_checked = False
+    steps = 0
+    chunks = stream_full_recipe_instructions(inventory['ingredients'], profile['allergies'], profile['restrictions'],
+                                             expiring['ingredients'], fresh)
+    try:
+        # The model call is retried until its first chunk, so that is when it turns out to be unavailable
+        first = next(chunks, "")
+    except ModelUnavailable as e:
+        # Any stored recipe beats none while the model is down, even the one served last
+        match, coverage = recipe_indexes.best_match(user_id, inventory['ingredients'],
+                                                    profile['allergies'] + profile['restrictions'], FALLBACK_COVERAGE,
+                                                    skip_last=False)
+        if match is None:
+            raise
+        print("model unavailable (%s), serving stored recipe %s" % (e, match['recipe_name']))
+        yield from stored_recipe_events(match, coverage)
+        return
+    for chunk in itertools.chain([first], chunks):
+        if recipe.done:
+            # Whatever follows the object, e.g. a closing ``` fence, is not parsed
+            continue
+        with stage("parse"):
+            completed = recipe.feed(chunk)
+        for name, value in completed.items():
+            if name != "instructions":
+                yield "field", {"name": name, "value": value}
+        for _, step in recipe.new_items:
+            yield "step", {"index": steps, "text": step}
+            steps += 1
+        if not header_checked and all(field in recipe.fields for field in SCORING_FIELDS):
+            header_checked = True
+            try:
+                with stage("parse"):
+                    header = RecipeHeader.validate(recipe.fields).to_dict()
+            except SchemaError as e:
+                print("recipe header is malformed (%s), scoring once the whole recipe is validated" % e)
+            else:
+                print("recipe header ready, scoring while instructions stream")
+                points_future = submit(assess_points_from_recipe_header, header, profile['diseases'])
+
+    if not recipe.done:
+        # Cut off, e.g. by max_output_tokens: keep what can be recovered, validation below decides if it's enough
+        with stage("parse"):
+            recovered = recipe.finish()
+        print("recipe JSON was cut off, recovered %s" % (", ".join(recovered) or "nothing more"))
+        for name, value in recovered.items():
+            if name != "instructions":
+                yield "field", {"name": name, "value": value}
+        for step in (recipe.fields.get("instructions") or [])[steps:]:
+            yield "step", {"index": steps, "text": step}
+            steps += 1
+    with stage("parse"):
+        recipe_fields = Recipe.validate(recipe.fields).to_dict()
+    if points_future is None:
+        points_future = submit(assess_points_from_recipe_header, recipe_fields, profile['diseases'])
+
+    points_text = points_future.result()
+    with stage("parse"):
+        points_parsed = Points.validate(parse_object(points_text)).to_dict()
+    print("recipe info", points_parsed)
+    yield "points", points_parsed
+    yield "done", {**recipe_fields, **points_parsed}
+
+
+def stored_recipe_events(recipe, coverage):
+    """
+    The stream_recipe events for a recipe that is already complete. Its done event carries
+    the stored recipe's id as matched_recipe_id and the share of its ingredients in the pantry.
+    """
+    fields = {name: value for name, value in recipe.items()
+              if name not in POINTS_FIELDS and name not in ("id", "created_at")}
+    for name, value in fields.items():
+        if name != "instructions":
+            yield "field", {"name": name, "value": value}
+    for index, step in enumerate(fields.get("instructions") or []):
+        yield "step", {"index": index, "text": step}
+    points = {name: recipe[name] for name in POINTS_FIELDS if name in recipe}
+    yield "points", points
+    yield "done", {**fields, **points, "matched_recipe_id": recipe.get("id"), "coverage": coverage}
+
+
+def generate_recipe(user_id=DEFAULT_USER, fresh=False):
+    """
+    Generates a recipe from the user's current inventory and profile and scores it,
+    or serves a stored recipe the pantry covers (see stream_recipe).
+
+    Returns:
+        dict: The recipe fields merged with the points analysis fields.
+    """
+    for event, data in stream_recipe(user_id, fresh):
+        if event == "done":
+            return data
+
+
+def generate_recipes(count, user_id=DEFAULT_USER):
+    """
+    Generates count distinct recipes with one model call and scores them all with a second,
+    instead of the 2 * count calls that count separate generate_recipe calls would make.
+
+    Returns:
+        list: One dict per recipe, recipe fields merged with its points analysis fields.
+    """
+    profile_future = submit(get_profile, user_id)
+    inventory_future = submit(get_inventory, user_id)
+    expiring_future = submit(get_expiring, PRIORITY_INGREDIENTS, PRIORITY_DAYS, user_id)
+    profile = profile_future.result()
+    inventory = inventory_future.result()
+    expiring = expiring_future.result()
+
+    recipes_text = generate_recipe_batch(inventory['ingredients'], profile['allergies'], profile['restrictions'], count,
+                                         expiring['ingredients'])
+    with stage("parse"):
+        recipes = RecipeBatch.validate(parse_object(recipes_text)).to_dict()['recipes']
+    if not recipes:
+        raise ValueError("Model returned no usable recipes")
+    assessments_text = assess_points_for_recipes(recipes, profile['diseases'])
+    with stage("parse"):
+        assessments = batch_assessments(assessments_text, len(recipes))
+    missing = [i for i, points in enumerate(assessments) if points is None]
+    if missing:
+        # Scored locally, like every recipe is while the model is unavailable
+        print("No usable assessment for %d of %d recipes, scoring them locally" % (len(missing), len(recipes)))
+        missing_recipes = [recipes[i] for i in missing]
+        fallback = local_assessments(missing_recipes, score_recipes(missing_recipes, profile['diseases']), profile['diseases'])
+        for i, points in zip(missing, fallback):
+            assessments[i] = points
+
+    return [{**recipe, **points} for recipe, points in zip(recipes, assessments)]
+
+
+def batch_assessments(text, count):
+    """
+    The assessments of a batch response, one per recipe in recipe order, with None for a recipe
+    whose assessment is missing or malformed. Each one is validated where it is, so a malformed
+    assessment does not shift the ones after it onto the wrong recipes.
+    """
+    try:
+        assessments = parse_object(text).get('assessments')
+    except (AttributeError, ValueError) as e:
+        print("Unusable assessments batch: %s" % e)
+        assessments = None
+    if not isinstance(assessments, list):
+        assessments = []
+    result = []
+    for assessment in assessments[:count]:
+        try:
+            result.append(Points.validate(assessment).to_dict())
+        except SchemaError as e:
+            print("dropping malformed assessment, %s" % e)
+            result.append(None)
+    return result + [None] * (count - len(result))
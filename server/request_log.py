@@ -0,0 +1,167 @@
+import atexit
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime
+
+"""
+Background logging of model prompts and responses.
+
+Request threads only put a record on a bounded queue. A writer thread drains the
+queue in batches into append-only JSONL segments under logs/, starting a new
+segment once the current one reaches max_segment_bytes and optionally gzipping
+the closed one. When the queue is full a request waits up to put_timeout for room
+(backpressure) and the record is dropped and counted if there still is none.
+"""
+
+_request_id = ContextVar("request_id", default=None)
+
+
+def new_request_id(request_id=None):
+    """
+    Sets the id attached to every record logged by the current request.
+    """
+    request_id = request_id or uuid.uuid4().hex
+    _request_id.set(request_id)
+    return request_id
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+class RequestLogger:
+    _STOP = object()
+
+    def __init__(self, directory="logs", max_segment_bytes=16 * 1024 * 1024, compress=False,
+                 queue_size=10000, put_timeout=0.5, batch_size=256):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.compress = compress
+        self.put_timeout = put_timeout
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.counters = {"written": 0, "dropped": 0, "segments": 0, "blocked_puts": 0}
+        self.segment = None
+        self.segment_path = None
+        self.segment_bytes = 0
+        self.closed = False
+        os.makedirs(directory, exist_ok=True)
+        self.writer = threading.Thread(target=self._run, name="request-log", daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def log(self, kind, **fields):
+        """
+        Queues one record. Never touches the disk on the caller's thread.
+        """
+        record = {"ts": time.time(), "request_id": current_request_id(), "kind": kind, **fields}
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            with self.lock:
+                self.counters["blocked_puts"] += 1
+        try:
+            self.queue.put(record, timeout=self.put_timeout)
+        except queue.Full:
+            with self.lock:
+                self.counters["dropped"] += 1
+
+    def close(self):
+        """
+        Writes out everything still queued and closes the current segment.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(self._STOP)
+        self.writer.join(timeout=10)
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, "queued": self.queue.qsize()}
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(record is self._STOP for record in batch)
+            self._write([record for record in batch if record is not self._STOP])
+            if stop:
+                self._close_segment()
+                return
+
+    def _write(self, records):
+        if not records:
+            return
+        data = "".join(json.dumps(record, default=str) + "\n" for record in records).encode("utf-8")
+        if self.segment is None or self.segment_bytes >= self.max_segment_bytes:
+            self._close_segment()
+            self._open_segment()
+        try:
+            self.segment.write(data)
+            self.segment.flush()
+        except OSError as e:
+            print("could not write request log: %s" % e)
+            with self.lock:
+                self.counters["dropped"] += len(records)
+            return
+        self.segment_bytes += len(data)
+        with self.lock:
+            self.counters["written"] += len(records)
+
+    def _open_segment(self):
+        # Microsecond timestamp plus a random suffix, so segments from concurrent processes never collide
+        name = "requests_%s_%s.jsonl" % (datetime.now().strftime("%Y%m%d_%H%M%S_%f"), uuid.uuid4().hex[:6])
+        self.segment_path = os.path.join(self.directory, name)
+        self.segment = open(self.segment_path, "ab")
+        self.segment_bytes = 0
+        with self.lock:
+            self.counters["segments"] += 1
+
+    def _close_segment(self):
+        if self.segment is None:
+            return
+        self.segment.close()
+        self.segment = None
+        if self.compress:
+            with open(self.segment_path, "rb") as source, gzip.open(self.segment_path + ".gz", "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.remove(self.segment_path)
+
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def get_logger():
+    """
+    The process-wide logger, configured from REQUEST_LOG_* environment variables on first use.
+    """
+    global _logger
+    if _logger is None:
+        with _logger_lock:
+            if _logger is None:
+                _logger = RequestLogger(
+                    directory=os.getenv("REQUEST_LOG_DIR", "logs"),
+                    max_segment_bytes=int(os.getenv("REQUEST_LOG_SEGMENT_BYTES", str(16 * 1024 * 1024))),
+                    compress=os.getenv("REQUEST_LOG_COMPRESS", "0") == "1",
+                    queue_size=int(os.getenv("REQUEST_LOG_QUEUE", "10000")),
+                )
+    return _logger
+
+
+def log(kind, **fields):
+    get_logger().log(kind, **fields)
@@ -0,0 +1,441 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextlib import ExitStack, nullcontext
+from contextvars import copy_context
+
+from metrics import counter
+
+"""
+Resilience layer for Gemini calls.
+
+Every model call goes through a ResilientCaller, which:
+  - takes a token from a token bucket sized to our Gemini quota, waiting for one
+    if the bucket is empty, so bursts are smoothed instead of answered with 429s
+  - runs each attempt on a worker thread with a deadline, so a stalled call frees
+    the request and its concurrency slot instead of holding them (the attempt itself
+    finishes in the background, on a worker thread it keeps until then)
+  - retries quota errors, 5xx and timeouts with jittered exponential backoff
+  - optionally sends a hedged duplicate when an attempt is slower than hedge_after
+    seconds and uses whichever answers first
+  - counts consecutive failures in a circuit breaker, which opens after too many and
+    rejects calls straight away for reset_timeout seconds, then lets one trial through
+
+Calls that still fail raise ModelUnavailable, which the server answers with a 503
+and Retry-After, and which recipe_pipeline.py answers with a stored recipe when it
+has one.
+"""
+
+# HTTP status codes of Gemini errors worth retrying: quota, server errors and deadlines
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+gemini_retries = counter("gemini_retries_total", "Model call attempts retried after a transient failure", ("call",))
+gemini_failures = counter("gemini_failures_total", "Failed model call attempts", ("call", "reason"))
+gemini_hedges = counter("gemini_hedges_total", "Hedged duplicate model calls sent, by whether the hedge answered first",
+                        ("call", "won"))
+gemini_rejections = counter("gemini_rejections_total", "Model calls rejected without being sent", ("call", "reason"))
+
+
+class ModelUnavailable(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpen(ModelUnavailable):
+    pass
+
+
+class RateLimited(ModelUnavailable):
+    pass
+
+
+class ModelTimeout(Exception):
+    code = 504
+
+
+def failure_reason(error):
+    """
+    'timeout', 'quota' or 'unavailable' for errors worth retrying, or None for ones that would fail again
+    (bad request, permission denied, unparseable response, ...)
+    """
+    if isinstance(error, ModelTimeout):
+        return "timeout"
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return "unavailable"
+    # google.api_core exceptions, and the fake model's, carry their HTTP status as code
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and code in RETRYABLE_CODES:
+        return "quota" if code == 429 else "timeout" if code in (408, 504) else "unavailable"
+    return None
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        """
+        Args:
+            rate (float): Tokens added per second, 0 for no limit.
+            burst (int): Tokens the bucket holds, i.e. calls that can start at once after a quiet period.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, timeout):
+        """
+        Takes a token, waiting up to timeout seconds for one. Returns False if none came in time.
+        """
+        if self.rate <= 0:
+            return True
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait_for = (1 - self.tokens) / self.rate
+            if now + wait_for > deadline:
+                return False
+            time.sleep(wait_for)
+
+    def try_acquire(self):
+        return self.acquire(0)
+
+    def available(self):
+        """
+        Tokens in the bucket, or None when there is no limit
+        """
+        if self.rate <= 0:
+            return None
+        with self.lock:
+            self._refill(time.monotonic())
+            return self.tokens
+
+
+class CircuitBreaker:
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        """
+        Args:
+            failure_threshold (int): Consecutive failed calls that open the circuit, 0 to never open it.
+            reset_timeout (float): Seconds the circuit stays open before a trial call is let through.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial = False
+        self.counters = {"opened": 0, "rejected": 0}
+
+    def allow(self):
+        """
+        Raises CircuitOpen while the circuit is open; once reset_timeout has passed lets one trial call through.
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining <= 0 and not self.trial:
+                self.state = self.HALF_OPEN
+                self.trial = True
+                return
+            self.counters["rejected"] += 1
+        raise CircuitOpen("Gemini circuit is open after %d failed calls" % self.failure_threshold,
+                          retry_after=max(remaining, 1.0))
+
+    def release(self):
+        """
+        Gives back a trial that allow() handed out for a call that was never made, e.g. one then rate limited.
+        """
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.trial = False
+
+    def success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.failure_threshold and self.failures >= self.failure_threshold):
+                if self.state != self.OPEN:
+                    self.counters["opened"] += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.trial = False
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, "state": self.state, "consecutive_failures": self.failures,
+                    "trial_in_flight": self.trial}
+
+
+class GateHold:
+    def __init__(self, gate):
+        """
+        One attempt's hold on the gate, taken on the attempt's worker thread and given back when the
+        attempt finishes or when the caller stops waiting for it, whichever comes first.
+
+        Args:
+            gate (callable): Context manager factory, e.g. model_registry.slot.
+        """
+        self.context = gate()
+        self.lock = threading.Lock()
+        self.entered = False
+        self.released = False
+
+    def enter(self):
+        """
+        Waits for the gate. Returns False, holding nothing, if the attempt was abandoned meanwhile.
+        """
+        self.context.__enter__()
+        with self.lock:
+            self.entered = True
+            if not self.released:
+                return True
+        self.context.__exit__(None, None, None)
+        return False
+
+    def release(self):
+        with self.lock:
+            if self.released:
+                return
+            self.released = True
+            if not self.entered:
+                return
+        self.context.__exit__(None, None, None)
+
+
+class ResilientCaller:
+    def __init__(self, limiter, breaker, timeout=60, retries=2, backoff=0.5, max_backoff=8, hedge_after=0,
+                 gate=None, workers=32):
+        """
+        Args:
+            limiter (TokenBucket): Rate limit shared by every call, hedges and retries included.
+            breaker (CircuitBreaker): Opened by consecutive failed attempts, retries included.
+            timeout (float): Deadline of each attempt in seconds, and of each chunk of a stream.
+            retries (int): Retries after the first attempt for errors failure_reason() calls transient.
+            backoff (float): Base of the exponential backoff, retry n waits up to backoff * 2**n seconds.
+            max_backoff (float): Longest wait between attempts.
+            hedge_after (float): Seconds after which a duplicate of a slow non-streamed attempt is sent, 0 for never.
+            gate (callable): Context manager factory held around every attempt, e.g. model_registry.slot.
+            workers (int): Threads running attempts, including ones that outlived their deadline.
+        """
+        self.limiter = limiter
+        self.breaker = breaker
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_after = hedge_after
+        self.gate = gate or nullcontext
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gemini")
+        self.lock = threading.Lock()
+        self.counters = {"calls": 0, "attempts": 0, "retries": 0, "failures": 0, "timeouts": 0,
+                         "hedges": 0, "hedges_won": 0, "rate_limited": 0}
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def _submit(self, fn, *args, gated=True):
+        """
+        Runs fn(*args) on a worker. A gated future carries its GateHold as future.hold.
+        """
+        hold = GateHold(self.gate) if gated else None
+
+        def attempt():
+            if hold is None:
+                return fn(*args)
+            if not hold.enter():
+                raise ModelTimeout("Gemini call was abandoned before it started")
+            try:
+                return fn(*args)
+            finally:
+                hold.release()
+        future = self.executor.submit(copy_context().run, attempt)
+        future.hold = hold
+        return future
+
+    def _admit(self, kind):
+        try:
+            self.breaker.allow()
+        except CircuitOpen:
+            gemini_rejections.inc(call=kind, reason="circuit_open")
+            raise
+        if not self.limiter.acquire(self.timeout):
+            self.breaker.release()
+            self._count("rate_limited")
+            gemini_rejections.inc(call=kind, reason="rate_limited")
+            raise RateLimited("No Gemini quota left for %.0f seconds" % self.timeout, retry_after=self.timeout)
+
+    def _attempt(self, kind, fn, args):
+        """
+        One attempt, plus its hedge when hedging is on. Raises ModelTimeout past the deadline.
+        """
+        self._count("attempts")
+        futures = [self._submit(fn, *args)]
+        try:
+            return self._race(kind, fn, args, futures)
+        finally:
+            # An attempt still running now timed out or lost to its hedge, and nobody waits for it any more
+            for future in futures:
+                future.hold.release()
+
+    def _race(self, kind, fn, args, futures):
+        deadline = time.monotonic() + self.timeout
+        if self.hedge_after and self.hedge_after < self.timeout:
+            done, _ = wait(futures, timeout=self.hedge_after)
+            if not done and self.limiter.try_acquire():
+                self._count("hedges")
+                futures.append(self._submit(fn, *args))
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=max(deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if len(futures) > 1:
+                        hedge_won = future is futures[1]
+                        if hedge_won:
+                            self._count("hedges_won")
+                        gemini_hedges.inc(call=kind, won=str(hedge_won).lower())
+                    return future.result()
+                error = future.exception()
+        if error is not None and not pending:
+            raise error
+        self._count("timeouts")
+        raise ModelTimeout("Gemini call took longer than %.0f seconds" % self.timeout)
+
+    def _retry(self, kind, attempt, error):
+        """
+        Records a failed attempt and sleeps before the next one, or raises when it shouldn't be retried.
+        """
+        reason = failure_reason(error)
+        gemini_failures.inc(call=kind, reason=reason or "error")
+        self._count("failures")
+        if reason is None:
+            # Gemini answered, so it is up, even if the call can't succeed
+            self.breaker.success()
+            raise error
+        self.breaker.failure()
+        if attempt >= self.retries:
+            raise ModelUnavailable("Gemini call failed after %d attempts: %s" % (attempt + 1, error),
+                                   retry_after=self.backoff * 2 ** attempt) from error
+        self._count("retries")
+        gemini_retries.inc(call=kind)
+        # Full jitter: concurrent callers that failed together don't retry together
+        time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+        self._admit(kind)
+
+    def call(self, kind, fn, *args):
+        """
+        Returns fn(*args) under the rate limit, deadline, retries, hedging and circuit breaker.
+        kind labels the call in the gemini_* metrics.
+        """
+        self._count("calls")
+        self._admit(kind)
+        attempt = 0
+        while True:
+            try:
+                result = self._attempt(kind, fn, args)
+            except Exception as e:
+                self._retry(kind, attempt, e)
+                attempt += 1
+                continue
+            self.breaker.success()
+            return result
+
+    def stream(self, kind, fn, *args):
+        """
+        Yields the chunks of the iterable fn(*args) under the same policy as call(). The call is retried
+        until its first chunk arrives; after that a failure or a chunk slower than the deadline ends the stream.
+        Streams are never hedged. Each attempt holds the gate, and the one that succeeds holds it for as long
+        as the stream runs.
+        """
+        self._count("calls")
+        self._admit(kind)
+        end = object()
+        attempt = 0
+        while True:
+            self._count("attempts")
+            gate = ExitStack()
+            gate.enter_context(self.gate())
+            try:
+                chunks = self._deadline(lambda: iter(fn(*args)))
+                chunk = self._deadline(next, chunks, end)
+            except BaseException as e:
+                # Given back before the backoff, so a call waiting to retry doesn't hold a slot
+                gate.close()
+                if not isinstance(e, Exception):
+                    raise
+                self._retry(kind, attempt, e)
+                attempt += 1
+                continue
+            break
+        with gate:
+            self.breaker.success()
+            while chunk is not end:
+                yield chunk
+                try:
+                    chunk = self._deadline(next, chunks, end)
+                except Exception as e:
+                    gemini_failures.inc(call=kind, reason=failure_reason(e) or "error")
+                    self._count("failures")
+                    if failure_reason(e) is not None:
+                        self.breaker.failure()
+                    raise
+
+    def _deadline(self, fn, *args):
+        future = self._submit(fn, *args, gated=False)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # Before Python 3.11 this is not the builtin TimeoutError, and fn may raise either
+            if not future.done():
+                self._count("timeouts")
+                raise ModelTimeout("Gemini call took longer than %.0f seconds" % self.timeout)
+            raise
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+        return {**counters, "circuit": self.breaker.stats(), "tokens_available": self.limiter.available()}
+
+
+def create_resilient_caller(gate=None):
+    """
+    Builds the process-wide caller from GEMINI_* environment variables.
+    GEMINI_RPM is our per-minute request quota, 0 for no client-side limit.
+    """
+    rpm = float(os.getenv("GEMINI_RPM", "0"))
+    return ResilientCaller(
+        TokenBucket(rpm / 60, int(os.getenv("GEMINI_BURST", "10"))),
+        CircuitBreaker(int(os.getenv("GEMINI_BREAKER_FAILURES", "5")), float(os.getenv("GEMINI_BREAKER_RESET", "30"))),
+        timeout=float(os.getenv("GEMINI_TIMEOUT", "60")),
+        retries=int(os.getenv("GEMINI_RETRIES", "2")),
+        backoff=float(os.getenv("GEMINI_BACKOFF", "0.5")),
+        max_backoff=float(os.getenv("GEMINI_MAX_BACKOFF", "8")),
+        hedge_after=float(os.getenv("GEMINI_HEDGE_AFTER", "0")),
+        gate=gate,
+        workers=int(os.getenv("GEMINI_CALL_WORKERS", "32")),
+    )
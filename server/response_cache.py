@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+"""
+Content-addressed cache for model responses.
+
+Responses are keyed on a SHA-256 of the model name, prompt and generation_config,
+so two requests with the same pantry, allergies, restrictions and diseases share
+one Gemini call. Entries live in an in-memory LRU tier backed by a disk tier of
+small JSON files; both tiers honour the same TTL and have their own size bound.
+"""
+
+
+def cache_key(model_name, prompt, generation_config=None):
+    """
+    Canonical hash of a model call. Dict key order and whitespace don't matter.
+    generation_config may also be given as its model_registry.config_fingerprint.
+    """
+    canonical = json.dumps([model_name, prompt, generation_config or {}],
+                           sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries=256, ttl=24 * 60 * 60, disk_dir="cache/responses",
+                 max_disk_bytes=64 * 1024 * 1024):
+        """
+        Args:
+            max_entries (int): Entries kept in memory before the least recently used is evicted.
+            ttl (float): Seconds an entry stays valid in either tier.
+            disk_dir (str): Folder for the disk tier, or None to keep everything in memory.
+            max_disk_bytes (int): Disk tier size before the oldest files are evicted.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.counters = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0,
+                         "evictions": 0, "expired": 0}
+        self.disk_bytes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self.disk_bytes = sum(entry.stat().st_size for entry in os.scandir(disk_dir)
+                                  if entry.name.endswith(".json"))
+
+    def get(self, key):
+        """
+        Returns the cached text for key, or None on a miss.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                expires_at, text = entry
+                if expires_at > now:
+                    self.memory.move_to_end(key)
+                    self.counters["hits"] += 1
+                    self.counters["memory_hits"] += 1
+                    return text
+                del self.memory[key]
+                self.counters["expired"] += 1
+
+        entry = self._read_disk(key)
+        with self.lock:
+            if entry is not None and entry["expires_at"] > now:
+                self._remember(key, entry["expires_at"], entry["text"])
+                self.counters["hits"] += 1
+                self.counters["disk_hits"] += 1
+                return entry["text"]
+            if entry is not None:
+                self.counters["expired"] += 1
+            self.counters["misses"] += 1
+        if entry is not None:
+            self._delete_disk(key)
+        return None
+
+    def put(self, key, text):
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            self._remember(key, expires_at, text)
+        self._write_disk(key, expires_at, text)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {**self.counters,
+                    "hit_ratio": self.counters["hits"] / lookups if lookups else 0.0,
+                    "memory_entries": len(self.memory),
+                    "disk_bytes": self.disk_bytes}
+
+    def _remember(self, key, expires_at, text):
+        self.memory[key] = (expires_at, text)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key + ".json")
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, expires_at, text):
+        if not self.disk_dir:
+            return
+        data = json.dumps({"expires_at": expires_at, "text": text}).encode("utf-8")
+        path = self._path(key)
+        tmp_path = "%s.%d.tmp" % (path, threading.get_ident())
+        try:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(tmp_path, "wb") as cache_file:
+                cache_file.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        with self.lock:
+            self.disk_bytes += len(data) - old_size
+            over = self.disk_bytes > self.max_disk_bytes
+        if over:
+            self._evict_disk()
+
+    def _delete_disk(self, key):
+        try:
+            size = os.path.getsize(self._path(key))
+            os.remove(self._path(key))
+        except OSError:
+            return
+        with self.lock:
+            self.disk_bytes -= size
+
+    def _evict_disk(self):
+        """
+        Drops the oldest files until the disk tier is back under 90% of its bound.
+        """
+        entries = sorted((entry for entry in os.scandir(self.disk_dir) if entry.name.endswith(".json")),
+                         key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in entries)
+        target = self.max_disk_bytes * 0.9
+        for entry in entries:
+            if total <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            total -= size
+            with self.lock:
+                self.counters["evictions"] += 1
+        with self.lock:
+            self.disk_bytes = total
+
+
+def create_cache():
+    """
+    Builds the process-wide cache from RESPONSE_CACHE_* environment variables.
+    RESPONSE_CACHE_DIR="" keeps the cache in memory only.
+    """
+    return ResponseCache(
+        max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "256")),
+        ttl=float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 60 * 60))),
+        disk_dir=os.getenv("RESPONSE_CACHE_DIR", "cache/responses") or None,
+        max_disk_bytes=int(os.getenv("RESPONSE_CACHE_DISK_BYTES", str(64 * 1024 * 1024))),
+    )
@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+
+from PIL import Image
+
+"""
+Perceptual-hash dedup cache for ingredient scans.
+
+Re-scanning the same fridge shelf gives a slightly different photo each time, so
+scans are matched on a 64-bit difference hash (dHash) of the image instead of on
+its bytes. A recent scan by the same user whose hash is within max_distance bits
+is reused and the vision call is skipped. Scans are never shared between users,
+and dark or flat photos are never cached at all: with no edges their hash is close
+to all zeros (or all ones), so any two of them would match whatever they show.
+"""
+
+
+def dhash(image, hash_size=8):
+    """
+    Difference hash: shrink to (hash_size + 1) x hash_size greyscale and record
+    whether each pixel is brighter than its right-hand neighbour.
+    """
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class ScanCache:
+    def __init__(self, max_distance=6, max_entries=128, ttl=60 * 60, min_bits=12, hash_bits=64):
+        """
+        Args:
+            max_distance (int): Largest Hamming distance between hashes still treated as the same scan.
+            max_entries (int): Number of recent scans kept, oldest dropped first.
+            ttl (float): Seconds a scan stays reusable.
+            min_bits (int): Fewest bits a hash needs set, and unset, to be cached; flatter images aren't.
+            hash_bits (int): Bits in a hash, 64 for dhash's default size.
+        """
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.min_bits = min_bits
+        self.hash_bits = hash_bits
+        self.lock = threading.Lock()
+        self.entries = []  # [user_id, image_hash, ingredients, model_seconds, created_at], oldest first
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self.seconds_saved = 0.0
+
+    def cacheable(self, image_hash):
+        """
+        Whether the hash has enough edges in it to tell one image from another
+        """
+        bits = bin(image_hash).count("1")
+        return self.min_bits <= bits <= self.hash_bits - self.min_bits
+
+    def lookup(self, user_id, image_hash):
+        """
+        Returns the ingredients of the user's closest recent scan within max_distance, or None.
+        """
+        now = time.time()
+        with self.lock:
+            if not self.cacheable(image_hash):
+                self.uncacheable += 1
+                return None
+            self.entries = [entry for entry in self.entries if now - entry[4] < self.ttl]
+            best = None
+            best_distance = self.max_distance + 1
+            for entry in self.entries:
+                if entry[0] != user_id:
+                    continue
+                distance = hamming_distance(image_hash, entry[1])
+                if distance < best_distance:
+                    best, best_distance = entry, distance
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.seconds_saved += best[3]
+            return best[2]
+
+    def store(self, user_id, image_hash, ingredients, model_seconds):
+        if not self.cacheable(image_hash):
+            return
+        with self.lock:
+            self.entries.append([user_id, image_hash, ingredients, model_seconds, time.time()])
+            del self.entries[:-self.max_entries]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "hit_ratio": self.hits / lookups if lookups else 0.0,
+                    "uncacheable": self.uncacheable,
+                    "seconds_saved": self.seconds_saved,
+                    "entries": len(self.entries)}
+
+
+def create_scan_cache():
+    """
+    Builds the process-wide scan cache from SCAN_CACHE_* environment variables.
+    """
+    return ScanCache(
+        max_distance=int(os.getenv("SCAN_CACHE_DISTANCE", "6")),
+        max_entries=int(os.getenv("SCAN_CACHE_SIZE", "128")),
+        ttl=float(os.getenv("SCAN_CACHE_TTL", str(60 * 60))),
+        min_bits=int(os.getenv("SCAN_CACHE_MIN_BITS", "12")),
+    )
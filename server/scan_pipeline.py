@@ -0,0 +1,122 @@
+import base64
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+from algo import get_ingredients_from_image, get_ingredients_from_images
+from imaging import create_image_pipeline
+from lazy import Lazy
+from nutrition import merge_ingredients
+from scan_cache import create_scan_cache, dhash
+
+"""
+Ingredient scans for /ingredients/scan and /ingredients/scan/batch.
+
+Every image is normalized (imaging.py) and hashed, and an image close to a recent
+scan by the same user reuses its ingredients (scan_cache.py). A batch of photos of one fridge is
+normalized on the image pool all at once; the images no recent scan covers are
+packed into multimodal calls of up to IMAGES_PER_CALL images that run
+concurrently, and the ingredients of all the images are merged into one list
+(nutrition.merge_ingredients), so the whole fridge is one request.
+"""
+
+# Most images one batch request may send, and most images packed into one model call
+MAX_IMAGES = int(os.getenv("SCAN_MAX_IMAGES", "16"))
+IMAGES_PER_CALL = int(os.getenv("SCAN_IMAGES_PER_CALL", "4"))
+
+# Built by the first scan, in the worker process that serves it
+scan_cache = Lazy(create_scan_cache)
+image_pipeline = Lazy(create_image_pipeline)
+
+executor = ThreadPoolExecutor(max_workers=int(os.getenv("SCAN_PIPELINE_WORKERS", "8")),
+                              thread_name_prefix="scan")
+
+
+def submit(fn, *args):
+    """
+    Runs fn on the scan pool in a copy of the caller's context, like recipe_pipeline.submit.
+    """
+    return executor.submit(copy_context().run, fn, *args)
+
+
+def scan_ingredients(image, user_id):
+    """
+    Normalizes a base64 image and asks the vision model for its ingredients, unless it matches a recent scan of the user's.
+    Returns {"ingredients": [...]}, e.g. [{'name': 'tomato', 'count': 4, 'units': 'piece', 'expiry': 7, 'carbon_footprint': 1}].
+    """
+    mime_type = 'image/png'
+    try:
+        normalized = image_pipeline.normalize(image)
+        print("normalized %s image: %d -> %d bytes" % (normalized.source_format, normalized.bytes_in, normalized.bytes_out))
+        image, mime_type = normalized.data, normalized.mime_type
+        image_hash = dhash(normalized.image)
+    except Exception as e:
+        print("could not decode image, sending it to the model as is: %s" % e)
+        image_hash = None
+
+    if image_hash is not None:
+        cached = scan_cache.lookup(user_id, image_hash)
+        if cached is not None:
+            print("scan matches a recent scan, reusing its ingredients")
+            return cached
+
+    start = time.perf_counter()
+    ingredients = get_ingredients_from_image(image, mime_type)
+    if image_hash is not None:
+        scan_cache.store(user_id, image_hash, ingredients, time.perf_counter() - start)
+    print(ingredients)
+    return ingredients
+
+
+def scan_ingredient_batch(uploads, user_id):
+    """
+    Scans several photos of one pantry and merges what they show.
+
+    Args:
+        uploads (list): (image bytes, mime type the client sent) per photo.
+        user_id (str): Whose recent scans may be reused.
+
+    Returns:
+        dict: ingredients, merged across the photos, and images, per photo how many
+        ingredients it showed and whether a recent scan was reused for it.
+    """
+    scans = [None] * len(uploads)
+    pending = []
+    for position, ((data, mime_type), normalized) in enumerate(
+            zip(uploads, image_pipeline.normalize_all([data for data, _ in uploads]))):
+        if isinstance(normalized, Exception):
+            print("could not decode image %d, sending it to the model as is: %s" % (position, normalized))
+            pending.append((position, base64.b64encode(data).decode("ascii"), mime_type or "image/jpeg", None))
+            continue
+        image_hash = dhash(normalized.image)
+        cached = scan_cache.lookup(user_id, image_hash)
+        if cached is not None:
+            scans[position] = cached
+            continue
+        pending.append((position, normalized.data, normalized.mime_type, image_hash))
+    reused = [scan is not None for scan in scans]
+
+    groups = [pending[i:i + IMAGES_PER_CALL] for i in range(0, len(pending), IMAGES_PER_CALL)]
+    print("scanning %d images in %d calls, %d matched recent scans" % (len(uploads), len(groups), sum(reused)))
+    for group, future in [(group, submit(scan_group, group, user_id)) for group in groups]:
+        for (position, _, _, _), ingredients in zip(group, future.result()):
+            scans[position] = ingredients
+
+    found = [scan.get("ingredients") or [] for scan in scans]
+    return {"ingredients": merge_ingredients(found),
+            "images": [{"ingredients": len(ingredients), "cached": cached}
+                       for ingredients, cached in zip(found, reused)]}
+
+
+def scan_group(group, user_id):
+    """
+    One model call for a group of (position, base64, mime type, hash) images, storing each result in the user's scan cache
+    """
+    start = time.perf_counter()
+    scans = get_ingredients_from_images([(data, mime_type) for _, data, mime_type, _ in group])
+    seconds = (time.perf_counter() - start) / len(group)
+    for (_, _, _, image_hash), ingredients in zip(group, scans):
+        if image_hash is not None:
+            scan_cache.store(user_id, image_hash, ingredients, seconds)
+    return scans
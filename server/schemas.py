@@ -0,0 +1,344 @@
+import re
+
+from metrics import counter
+
+"""
+Response schemas of the model calls, compiled into validators and typed records.
+
+The schemas are what generation configs send to Gemini as response_schema. Each
+one is also compiled once, at import, into a tree of small validator functions
+that check a parsed response and coerce what the model commonly gets almost
+right ("4" or "7 days" for a number, "easy" for "Easy"). A required field that is
+missing or can't be coerced raises SchemaError with its path, unless it is
+nullable: the model is asked for it but it becomes null when missing or unusable
+(an ingredient with no known expiry). A malformed element of an array of objects
+(one bad ingredient) is dropped instead of failing the whole response, and counted
+in schema_items_dropped_total.
+
+Objects become instances of record classes generated from the schema, with
+__slots__ and annotations for their properties, so a batch of recipes doesn't
+carry a dict per recipe and per ingredient. to_dict() turns a record back into
+the JSON shape the endpoints return.
+"""
+
+schema_items_dropped = counter("schema_items_dropped_total",
+                               "Malformed array elements dropped while validating model output", ("record",))
+
+# Response schemas, shared by the single and batched calls
+RECIPE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "recipe_name": {
+            "type": "string",
+            "description": "The name of the recipe."
+        },
+        "short_description": {
+            "type": "string",
+            "description": "A short description of the recipe."
+        },
+        "cooking_time": {
+            "type": "number",
+            "description": "The time required to cook the recipe in minutes."
+        },
+        "difficulty": {
+            "type": "string",
+            "enum": ["Easy", "Medium", "Hard"],
+            "description": "The difficulty level of the recipe."
+        },
+        "ingredients": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string", "description": "The name of the ingredient, exactly same as given"},
+                    "count": {"type": "number", "description": "The quantity of the ingredient."},
+                    "units": {"type": "string", "description": "The measurement units for the ingredient."},
+                },
+                "required": ["name", "count", "units"]
+            },
+            "description": "A list of ingredients required for the recipe."
+        },
+        "instructions": {
+            "type": "array",
+            "items": {
+                "type": "string"
+            },
+            "description": "Step-by-step instructions for preparing the recipe."
+        },
+        "url": {
+            "type": "string",
+            "description": "A URL to the full recipe or source."
+        }
+    },
+    "required": [
+        "recipe_name",
+        "short_description",
+        "cooking_time",
+        "difficulty",
+        "ingredients",
+        "instructions"
+    ]
+}
+
+POINTS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "nutritional_values": {
+            "type": "string",
+            "description": "The nutritional information as a string: calories, fats, proteins, carbs. Do not include anything else and do not format your text in anyway such as bolding."
+        },
+        "carbon_footprint": {
+            "type": "number",
+            "description": "The carbon footprint of the recipe, in ppm"
+        },
+        "points_response": {
+            "type": "number",
+            "description": "The response in numerical format, representing points, from 0-10"
+        },
+        "justification_response": {
+            "type": "string",
+            "description": "A textual breakdown or reasoning, using the given categories. Keep to around 150 words."
+        },
+        "warnings": {
+            "type": "string",
+            "description": "Warnings or alerts as a string, keep it emtpty if there are none"
+        }
+    },
+    "required": ["nutritional_values", "points_response", "justification_response"]
+}
+
+# Only the text parts of a points assessment, used when the numbers come from nutrition.py
+JUSTIFICATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "justification_response": POINTS_SCHEMA["properties"]["justification_response"],
+        "warnings": POINTS_SCHEMA["properties"]["warnings"]
+    },
+    "required": ["justification_response"]
+}
+
+# What a scan finds in one image, used by the batched scan that sends several images in one call
+INGREDIENT_LIST_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "ingredients": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string", "description": "The name of the ingredient."},
+                    "count": {"type": "number", "description": "The number of items or the measured amount detected."},
+                    "units": {"type": "string", "description": "The measurement units if applicable, else piece."},
+                    "expiry": {"type": "number", "nullable": True,
+                               "description": "Expiration in days assuming a recent purchase."},
+                    "carbon_footprint": {"type": "number", "nullable": True,
+                                         "description": "1, 2 or 3 where 3 represents the highest footprint."}
+                },
+                "required": ["name", "count", "units", "expiry", "carbon_footprint"]
+            }
+        }
+    },
+    "required": ["ingredients"]
+}
+
+
+
+class SchemaError(ValueError):
+    """
+    Model output that doesn't match its schema. path locates the bad value, e.g. $.ingredients[2].count.
+    """
+
+    def __init__(self, path, message):
+        super().__init__("%s: %s" % (path, message))
+        self.path = path
+
+
+class Record:
+    __slots__ = ()
+    schema = None
+    validator = None
+    nullable = ()
+
+    @classmethod
+    def validate(cls, value):
+        """
+        The record for an already parsed value, raising SchemaError if it doesn't match the schema.
+        """
+        return cls.validator(value, "$")
+
+    def to_dict(self):
+        """
+        Plain dict of the record, nested records included, without the optional fields it doesn't have.
+        Nullable fields are always there, as None when they have no value.
+        """
+        result = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if value is not None or name in self.nullable:
+                result[name] = plain(value)
+        return result
+
+    def __eq__(self, other):
+        return type(other) is type(self) and all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join("%s=%r" % (name, getattr(self, name))
+                                                          for name in self.__slots__))
+
+
+def plain(value):
+    if isinstance(value, Record):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [plain(item) for item in value]
+    return value
+
+
+NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+TYPES = {"string": str, "number": float, "integer": int, "boolean": bool, "array": list, "object": dict}
+
+
+def compile_schema(schema, name):
+    """
+    Validator function (value, path) -> coerced value for a response schema. Objects are
+    built as instances of a record class named name, nested ones as name + property name.
+    """
+    kind = schema.get("type", "string")
+    if kind == "object":
+        return compile_object(schema, name)
+    if kind == "array":
+        return compile_array(schema, name)
+    if kind in ("number", "integer"):
+        return compile_number(kind == "integer")
+    if kind == "boolean":
+        return compile_boolean()
+    return compile_string(schema.get("enum"))
+
+
+def compile_object(schema, name):
+    properties = schema.get("properties", {})
+    validators = [(key, compile_schema(prop, name + key.title().replace("_", "")), key in schema.get("required", ()),
+                   prop.get("nullable", False))
+                  for key, prop in properties.items()]
+    record = type(name, (Record,), {
+        "__slots__": tuple(properties),
+        "__annotations__": {key: TYPES.get(prop.get("type", "string"), object) for key, prop in properties.items()},
+        "schema": schema,
+        "nullable": tuple(key for key, prop in properties.items() if prop.get("nullable")),
+    })
+
+    def validate(value, path):
+        if isinstance(value, Record):
+            value = value.to_dict()
+        if not isinstance(value, dict):
+            raise SchemaError(path, "expected an object, got %s" % type(value).__name__)
+        instance = record.__new__(record)
+        for key, validator, required, nullable in validators:
+            field = value.get(key)
+            if field is None:
+                if required and not nullable:
+                    raise SchemaError(path, "missing required field '%s'" % key)
+                setattr(instance, key, None)
+            elif nullable:
+                try:
+                    setattr(instance, key, validator(field, "%s.%s" % (path, key)))
+                except SchemaError:
+                    setattr(instance, key, None)
+            else:
+                setattr(instance, key, validator(field, "%s.%s" % (path, key)))
+        return instance
+
+    record.validator = staticmethod(validate)
+    validate.record = record
+    return validate
+
+
+def compile_array(schema, name):
+    items = schema.get("items", {})
+    item_validator = compile_schema(items, name + "Item" if items.get("type") == "object" else name)
+    drop_invalid = items.get("type") == "object"
+
+    def validate(value, path):
+        if not isinstance(value, list):
+            raise SchemaError(path, "expected an array, got %s" % type(value).__name__)
+        result = []
+        for i, item in enumerate(value):
+            try:
+                result.append(item_validator(item, "%s[%d]" % (path, i)))
+            except SchemaError as e:
+                if not drop_invalid:
+                    raise
+                print("dropping malformed element of model output, %s" % e)
+                schema_items_dropped.inc(record=name)
+        return result
+
+    return validate
+
+
+def compile_number(integer):
+    def validate(value, path):
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise SchemaError(path, "expected a number, got %s" % type(value).__name__)
+        if isinstance(value, str):
+            match = NUMBER.search(value)
+            if match is None:
+                raise SchemaError(path, "expected a number, got %r" % value)
+            value = float(match.group())
+            if value == int(value):
+                value = int(value)
+        return int(round(value)) if integer else value
+
+    return validate
+
+
+def compile_boolean():
+    def validate(value, path):
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+            return value.strip().lower() == "true"
+        raise SchemaError(path, "expected a boolean, got %r" % (value,))
+
+    return validate
+
+
+def compile_string(enum):
+    choices = {choice.lower(): choice for choice in enum or ()}
+
+    def validate(value, path):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = str(value)
+        if not isinstance(value, str):
+            raise SchemaError(path, "expected a string, got %s" % type(value).__name__)
+        if choices:
+            choice = choices.get(value.strip().lower())
+            if choice is None:
+                raise SchemaError(path, "expected one of %s, got %r" % (", ".join(enum), value))
+            return choice
+        return value
+
+    return validate
+
+
+def record_type(name, schema):
+    """
+    Compiles an object schema and returns its record class
+    """
+    return compile_object(schema, name).record
+
+
+Recipe = record_type("Recipe", RECIPE_SCHEMA)
+# The fields points are assessed from, validated on their own so scoring can start while the rest of a recipe streams in
+RecipeHeader = record_type("RecipeHeader", {
+    "type": "object",
+    "properties": {name: RECIPE_SCHEMA["properties"][name] for name in ("recipe_name", "short_description", "ingredients")},
+    "required": ["recipe_name", "short_description", "ingredients"]})
+Points = record_type("Points", POINTS_SCHEMA)
+IngredientList = record_type("IngredientList", INGREDIENT_LIST_SCHEMA)
+
+# Batched responses; a recipe or assessment cut off at the end of the batch is dropped like any malformed element
+RecipeBatch = record_type("RecipeBatch", {"type": "object", "properties": {"recipes": {"type": "array", "items": RECIPE_SCHEMA}},
+                                          "required": ["recipes"]})
+PointsBatch = record_type("PointsBatch", {"type": "object", "properties": {"assessments": {"type": "array", "items": POINTS_SCHEMA}},
+                                          "required": ["assessments"]})
@@ -0,0 +1,97 @@
+import argparse
+import os
+
+"""
+Production entry point: runs app.py under gunicorn with several worker processes.
+
+Requests spend most of their time waiting on Gemini and the storage backend, so
+each worker serves many requests at once. The default gthread workers handle
+SERVE_THREADS requests each on OS threads; the app is imported once in the master
+(preload) and forked, so workers start without paying the import again and share
+its memory pages. --worker-class gevent serves SERVE_CONNECTIONS requests per
+worker on greenlets instead; gevent has to patch the standard library before the
+app is imported, so it loads the app in each worker and needs `pip install gevent`.
+Every worker has its own caches, metrics, job queue and in-memory storage backend,
+which is why production runs should use STORAGE_BACKEND=firestore or sqlite: jobs
+are saved through it, so a job submitted to one worker can be polled on another.
+
+    python serve.py
+    python serve.py --workers 4 --threads 32 --bind 0.0.0.0:8000
+    python serve.py --worker-class gevent --connections 500
+
+Workers become ready faster when the orchestrator probes /readyz, which builds the
+storage backend and configures Gemini; /healthz only tells that the process is up.
+"""
+
+WORKER_CLASSES = ("gthread", "gevent")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bind", default=os.getenv("SERVE_BIND", "0.0.0.0:5000"), help="address to listen on")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVE_WORKERS", str(os.cpu_count() or 1))),
+                        help="worker processes, default is one per core")
+    parser.add_argument("--worker-class", choices=WORKER_CLASSES, default=os.getenv("SERVE_WORKER_CLASS", "gthread"))
+    parser.add_argument("--threads", type=int, default=int(os.getenv("SERVE_THREADS", "16")),
+                        help="requests in flight per gthread worker")
+    parser.add_argument("--connections", type=int, default=int(os.getenv("SERVE_CONNECTIONS", "256")),
+                        help="requests in flight per gevent worker")
+    parser.add_argument("--timeout", type=int, default=int(os.getenv("SERVE_TIMEOUT", "120")),
+                        help="seconds a silent worker is given before it is restarted")
+    parser.add_argument("--max-requests", type=int, default=int(os.getenv("SERVE_MAX_REQUESTS", "0")),
+                        help="restart each worker after this many requests, 0 never does")
+    return parser.parse_args()
+
+
+def gunicorn_options(args):
+    gevent = args.worker_class == "gevent"
+    return {
+        "bind": args.bind,
+        "workers": args.workers,
+        "worker_class": args.worker_class,
+        "threads": args.threads,
+        "worker_connections": args.connections,
+        "preload_app": not gevent,
+        "timeout": args.timeout,
+        # Streamed recipes keep connections open between chunks
+        "keepalive": 5,
+        "max_requests": args.max_requests,
+        "max_requests_jitter": args.max_requests // 10,
+        "accesslog": "-",
+        "post_worker_init": init_grpc_gevent if gevent else None,
+    }
+
+
+def init_grpc_gevent(worker):
+    """
+    The Gemini SDK and Firestore talk gRPC, whose threads would block a gevent worker's hub.
+    """
+    try:
+        from grpc.experimental import gevent as grpc_gevent
+    except ImportError:
+        return
+    grpc_gevent.init_gevent()
+
+
+def main():
+    args = parse_args()
+    if args.workers > 1:
+        # Each worker caches reads, so let writes made by the others invalidate them
+        os.environ.setdefault("READ_CACHE_LISTEN", "1")
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in gunicorn_options(args).items():
+                if value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            from app import create_app
+            return create_app()
+
+    Server().run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import copy
+import functools
+import hashlib
+import json
+import threading
+from contextvars import copy_context
+
+from metrics import counter
+
+"""
+Request coalescing for identical concurrent calls.
+
+When several requests need the same model answer or the same user's document at
+once, only the first (the leader) makes the call; the others wait for it and get
+a copy of its result, or its exception. Nothing is kept once the call finishes,
+which is what response_cache.py and read_cache.py are for: this only removes the
+duplicates that overlap in time. Streamed calls are shared chunk by chunk.
+
+The waiters are always released, however the leader's call ends. When it is cut
+short by a BaseException that only concerns the leader (a gevent Timeout on its
+request, KeyboardInterrupt) the waiters make the call again themselves.
+"""
+
+single_flight_calls = counter("single_flight_calls_total",
+                              "Calls through a single-flight group, by whether they made the call or joined one",
+                              ("group", "role"))
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+def call_key(*parts):
+    """
+    Canonical hash of a call's inputs. Dict key order doesn't matter.
+    """
+    canonical = json.dumps(parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class Interrupted(Exception):
+    """
+    The leader's call ended with a BaseException rather than a result or an ordinary error.
+    """
+
+
+class Call:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.done = False
+        self.result = None
+        self.error = None
+        self.chunks = []
+
+
+class SingleFlight:
+    def __init__(self, name):
+        """
+        Args:
+            name (str): Group name in stats() and the single_flight_calls_total metric.
+        """
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.counters = {"calls": 0, "leaders": 0, "coalesced": 0, "errors": 0}
+        with _groups_lock:
+            _groups[name] = self
+
+    def _join(self, key):
+        """
+        (call, True) for a new call the caller has to make, or (call, False) for one already in flight
+        """
+        with self.lock:
+            self.counters["calls"] += 1
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+                self.counters["leaders"] += 1
+            else:
+                self.counters["coalesced"] += 1
+        single_flight_calls.inc(group=self.name, role="leader" if leader else "coalesced")
+        return call, leader
+
+    def _finish(self, key, call, result=None, error=None):
+        with self.lock:
+            if self.calls.get(key) is call:
+                del self.calls[key]
+            if error is not None:
+                self.counters["errors"] += 1
+        with call.condition:
+            call.result = result
+            call.error = error
+            call.done = True
+            call.condition.notify_all()
+
+    def do(self, key, fn, *args):
+        """
+        Returns fn(*args), sharing the call with any other caller that passes the same key while it runs.
+        """
+        call, leader = self._join(key)
+        if leader:
+            result, error = None, None
+            try:
+                result = fn(*args)
+                return result
+            except Exception as e:
+                error = e
+                raise
+            except BaseException as e:
+                error = Interrupted("%s call interrupted by %s" % (self.name, type(e).__name__))
+                raise
+            finally:
+                self._finish(key, call, result=result, error=error)
+        with call.condition:
+            while not call.done:
+                call.condition.wait()
+        if isinstance(call.error, Interrupted):
+            return self.do(key, fn, *args)
+        if call.error is not None:
+            raise call.error
+        return copy.deepcopy(call.result)
+
+    def stream(self, key, fn, *args):
+        """
+        Yields the chunks of the generator fn(*args), sharing it with any other caller that passes
+        the same key while it runs. The generator is drained on its own thread, in a copy of the
+        leader's context, so a caller that stops reading early doesn't cut the others off.
+        """
+        call, leader = self._join(key)
+        if leader:
+            threading.Thread(target=copy_context().run, args=(self._produce, key, call, fn, args),
+                             name="single-flight-%s" % self.name, daemon=True).start()
+        read = 0
+        while True:
+            with call.condition:
+                while read == len(call.chunks) and not call.done:
+                    call.condition.wait()
+                chunks = call.chunks[read:]
+                done = call.done
+            yield from chunks
+            read += len(chunks)
+            if done:
+                if call.error is not None:
+                    raise call.error
+                return
+
+    def _produce(self, key, call, fn, args):
+        # Readers may already have chunks, so an interrupted stream is an error for them rather than a retry
+        error = None
+        try:
+            for chunk in fn(*args):
+                with call.condition:
+                    call.chunks.append(chunk)
+                    call.condition.notify_all()
+        except Exception as e:
+            error = e
+        except BaseException as e:
+            error = Interrupted("%s stream interrupted by %s" % (self.name, type(e).__name__))
+            raise
+        finally:
+            self._finish(key, call, error=error)
+
+    def forget(self, key):
+        """
+        Stops new callers from joining the call in flight for key, e.g. after a write made its result stale.
+        """
+        with self.lock:
+            self.calls.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, "in_flight": len(self.calls),
+                    "coalesced_ratio": self.counters["coalesced"] / self.counters["calls"]
+                    if self.counters["calls"] else 0.0}
+
+
+def coalesced(group):
+    """
+    Decorator sharing concurrent calls of the function with equal arguments through the group.
+    """
+    def wrap(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return group.do(call_key(fn.__name__, args, kwargs), functools.partial(fn, *args, **kwargs))
+        return wrapper
+    return wrap
+
+
+def stats():
+    """
+    stats() of every group, by name
+    """
+    with _groups_lock:
+        groups = dict(_groups)
+    return {name: group.stats() for name, group in groups.items()}
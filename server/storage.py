@@ -0,0 +1,843 @@
+import base64
+import bisect
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+'''
+    Storage backends used by database.py
+    All data is partitioned by user id. Each user has:
+      - inventory: one document per ingredient name (count, units, expiry, carbon_footprint,
+        purchased_at and expires_at as absolute timestamps), indexed by expires_at
+      - recipes: confirmed recipe history, one document per confirmation, indexed by creation time
+      - profile: the user's profile
+    and a score in each leaderboard window ('all', or one per week), one counter per
+    user and window so confirmations by different users never write the same document
+    Adding to an item already in the inventory keeps its earlier purchased_at and expires_at
+    in every backend, since the older stock goes off first
+'''
+
+DAY_SECONDS = 86400
+
+
+'''
+    Opaque page cursors: the sort key of the last document returned,
+    (created_at, id) for recipe history and (name,) for inventory
+'''
+def encode_cursor(*values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, size):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor '%s'" % cursor)
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor '%s'" % cursor)
+    return values
+
+'''
+    Keeps only the requested fields of a document, plus the keys that identify it
+'''
+def project(doc, fields, keys):
+    if fields is None:
+        return doc
+    return {field: doc[field] for field in (*keys, *fields) if field in doc}
+
+
+class StorageBackend:
+    '''
+        Interface implemented by every storage engine.
+        Documents go in and out as plain dicts, the same shape Firestore returns.
+    '''
+
+    def add_many_to_inventory(self, user_id, items):
+        '''
+            Adds every item in one atomic write: counts of existing items are incremented,
+            new items are created
+            @params: items, {name: {'count', 'units', 'expiry', 'carbon_footprint', 'purchased_at', 'expires_at'}}
+        '''
+        raise NotImplementedError
+
+    def remove_many_from_inventory(self, user_id, amounts):
+        '''
+            Subtracts each amount in one transaction, deleting items whose count reaches 0
+            @params: amounts, {name: amount}
+            @return: names of the deleted items
+        '''
+        raise NotImplementedError
+
+    def get_inventory(self, user_id):
+        '''
+            @return: list of inventory dicts, each with its 'name'
+        '''
+        raise NotImplementedError
+
+    def get_inventory_page(self, user_id, limit, cursor=None, fields=None):
+        '''
+            One page of the user's inventory ordered by name
+            @params: limit, cursor (from a previous page, None for the first page),
+                     fields (names of the fields to return, None for all)
+            @return: (items, cursor for the next page or None if this was the last)
+        '''
+        raise NotImplementedError
+
+    def get_expiring(self, user_id, limit, before=None):
+        '''
+            The user's items that expire soonest, read from an index on expires_at
+            rather than by sorting the whole inventory. Items without an expires_at are left out.
+            @params: limit, before (only items expiring at or before this timestamp, None for all)
+            @return: list of inventory dicts, each with its 'name', soonest first
+        '''
+        raise NotImplementedError
+
+    def add_to_recipes(self, user_id, recipe):
+        '''
+            Appends a recipe, which must have a 'recipe_name', to the user's history
+            @return: id of the new history entry
+        '''
+        raise NotImplementedError
+
+    def get_recipe_history(self, user_id, limit, cursor=None, fields=None, since=None):
+        '''
+            One page of the user's recipes, newest first, each with its 'id' and 'created_at'
+            @params: limit, cursor (from a previous page, None for the first page),
+                     fields (names of the fields to return, None for all),
+                     since (only recipes created after this timestamp, None for all)
+            @return: (recipes, cursor for the next page or None if this was the last)
+        '''
+        raise NotImplementedError
+
+    def get_recipes(self, user_id, fields=None, since=None):
+        '''
+            @params: fields, since (as in get_recipe_history)
+            @return: list of all the user's recipes, newest first
+        '''
+        recipes = []
+        cursor = None
+        while True:
+            page, cursor = self.get_recipe_history(user_id, 500, cursor, fields, since)
+            recipes.extend(page)
+            if cursor is None:
+                return recipes
+
+    def add_points(self, user_id, windows, points, name):
+        '''
+            Adds points to the user's score in each of the leaderboard windows, creating missing scores,
+            and stamps each score's updated_at with the current time
+            @params: windows, list of window keys; name, shown on the leaderboard
+        '''
+        raise NotImplementedError
+
+    def get_scores(self, window, since=None):
+        '''
+            @params: since, only return the scores updated after this timestamp
+            @return: list of {'user_id', 'name', 'points'} for every user with a score in the window
+        '''
+        raise NotImplementedError
+
+    def set_profile(self, user_id, profile):
+        raise NotImplementedError
+
+    def add_exp(self, user_id, points):
+        '''
+            Adds points to the profile's exp in one atomic write, creating {'exp': points} when
+            there is no profile, so concurrent confirmations never lose each other's points
+        '''
+        raise NotImplementedError
+
+    def get_profile(self, user_id):
+        '''
+            @return: profile dict, or None if no profile has been saved
+        '''
+        raise NotImplementedError
+
+    def set_job(self, job):
+        '''
+            Saves the state of a background job (jobs.py) under job['id'], replacing the previous one
+            @params: job, JSON-serializable dict whose expires_at is None until the job has finished
+        '''
+        raise NotImplementedError
+
+    def get_job(self, job_id):
+        '''
+            @return: job dict, or None if there is none or its expires_at has passed
+        '''
+        raise NotImplementedError
+
+
+class FirestoreBackend(StorageBackend):
+    '''
+        Cloud Firestore, the production backend.
+        The client is only created when the backend is, not when this module is imported.
+        Layout: users/{user_id} holds the profile, with inventory/{name} and
+        recipes/{auto id} subcollections, so users never share a document and
+        every query stays inside one user's subcollection.
+    '''
+
+    # Firestore allows at most 500 writes per batch
+    MAX_BATCH_WRITES = 500
+    # Stored in meta/schema once the legacy single user data has been copied into users/user1
+    SCHEMA_VERSION = 2
+    # Set once this process has checked meta/schema, so backends built later skip the read
+    migrated = False
+    migrate_lock = threading.Lock()
+
+    def __init__(self, credentials_path='keys/service-account-key.json'):
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+
+        try:
+            firebase_admin.get_app()
+        except ValueError:
+            firebase_admin.initialize_app(credentials.Certificate(credentials_path))
+        self.firestore = firestore
+        self.db = firestore.client()
+        with FirestoreBackend.migrate_lock:
+            if not FirestoreBackend.migrated:
+                self.migrate()
+                FirestoreBackend.migrated = True
+
+    def user(self, user_id):
+        return self.db.collection('users').document(user_id)
+
+    def migrate(self):
+        '''
+            Copies the single user layout (top-level inventory/{name} and recipes/{recipe_name}
+            collections, profile in user1/profile) into users/user1, like SQLiteBackend.migrate.
+            Inventory gets timestamps as if it had been bought now. Copies keep their document ids
+            and never overwrite what users/user1 already has, so a migration cut short or run by
+            two workers at once is simply finished by the next one. The legacy documents are left
+            in place; delete them by hand once the copy has been checked. Runs once per process.
+        '''
+        schema_ref = self.db.collection('meta').document('schema')
+        schema = schema_ref.get()
+        if schema.exists and schema.get('version') >= self.SCHEMA_VERSION:
+            return
+        user_ref = self.user('user1')
+        now = time.time()
+        writes = []
+
+        legacy_profile = self.db.collection('user1').document('profile').get()
+        if legacy_profile.exists and not user_ref.get().exists:
+            writes.append((user_ref, legacy_profile.to_dict()))
+
+        inventory_ref = user_ref.collection('inventory')
+        migrated = {doc.id for doc in inventory_ref.select([]).stream()}
+        for doc in self.db.collection('inventory').stream():
+            if doc.id in migrated:
+                continue
+            item = doc.to_dict()
+            expiry = item.get('expiry')
+            numeric = isinstance(expiry, (int, float)) and not isinstance(expiry, bool)
+            writes.append((inventory_ref.document(doc.id), {
+                **item, 'purchased_at': now, 'expires_at': now + expiry * DAY_SECONDS if numeric else None}))
+
+        recipes_ref = user_ref.collection('recipes')
+        migrated = {doc.id for doc in recipes_ref.select([]).stream()}
+        for doc in self.db.collection('recipes').stream():
+            if doc.id not in migrated:
+                writes.append((recipes_ref.document(doc.id), {**doc.to_dict(), 'recipe_name': doc.id, 'created_at': now}))
+
+        for start in range(0, len(writes), self.MAX_BATCH_WRITES):
+            batch = self.db.batch()
+            for ref, data in writes[start:start + self.MAX_BATCH_WRITES]:
+                batch.set(ref, data)
+            batch.commit()
+        if writes:
+            print('migrated %d legacy documents into users/user1' % len(writes))
+        schema_ref.set({'version': self.SCHEMA_VERSION, 'migrated_at': now})
+
+    def add_many_to_inventory(self, user_id, items):
+        '''
+            Reads the items with one get_all and writes them in the same transaction: missing items
+            are created, existing ones get the count added and keep the earlier expires_at, like the
+            other backends. Items are done 500 at a time, the most writes one transaction may make.
+        '''
+        inventory_ref = self.user(user_id).collection('inventory')
+        names = list(items)
+
+        @self.firestore.transactional
+        def apply(transaction, chunk):
+            refs = {name: inventory_ref.document(name) for name in chunk}
+            for doc in self.db.get_all(list(refs.values()), transaction=transaction):
+                item = items[doc.id]
+                if not doc.exists:
+                    transaction.set(refs[doc.id], {
+                        'count': item['count'],
+                        'units': item['units'],
+                        'expiry': item['expiry'],
+                        'carbon_footprint': item['carbon_footprint'],
+                        'purchased_at': item['purchased_at'],
+                        'expires_at': item['expires_at']
+                    })
+                    continue
+                update = {'count': doc.get('count') + item['count']}
+                current = doc.to_dict().get('expires_at')
+                if item['expires_at'] is not None and (current is None or item['expires_at'] < current):
+                    update['expires_at'] = item['expires_at']
+                    update['purchased_at'] = item['purchased_at']
+                transaction.update(refs[doc.id], update)
+
+        for start in range(0, len(names), self.MAX_BATCH_WRITES):
+            apply(self.db.transaction(), names[start:start + self.MAX_BATCH_WRITES])
+
+    def remove_many_from_inventory(self, user_id, amounts):
+        '''
+            Reads every item with one get_all and writes them all in the same transaction,
+            which Firestore retries on contention instead of losing updates
+        '''
+        inventory_ref = self.user(user_id).collection('inventory')
+        refs = {name: inventory_ref.document(name) for name in amounts}
+
+        @self.firestore.transactional
+        def apply(transaction):
+            removed = []
+            for doc in self.db.get_all(list(refs.values()), transaction=transaction):
+                if not doc.exists:
+                    continue
+                count = doc.get('count') - amounts[doc.id]
+                if count <= 0:
+                    transaction.delete(refs[doc.id])
+                    removed.append(doc.id)
+                else:
+                    transaction.update(refs[doc.id], {'count': count})
+            return removed
+
+        return apply(self.db.transaction())
+
+    def get_inventory(self, user_id):
+        ret = []
+        for doc in self.user(user_id).collection('inventory').stream():
+            cur = doc.to_dict()
+            cur['name'] = doc.id
+            ret.append(cur)
+        return ret
+
+    def watch(self, kind, user_id, on_change):
+        '''
+            Calls on_change whenever the user's 'profile' or 'inventory' changes, from any process
+            @return: function that stops the snapshot listener
+        '''
+        ref = self.user(user_id) if kind == 'profile' else self.user(user_id).collection('inventory')
+        first = [True]
+
+        def on_snapshot(*_):
+            # The listener fires once with the current state straight away, which is not a change
+            if first[0]:
+                first[0] = False
+                return
+            on_change()
+
+        return ref.on_snapshot(on_snapshot).unsubscribe
+
+    def get_inventory_page(self, user_id, limit, cursor=None, fields=None):
+        from google.cloud.firestore_v1.field_path import FieldPath
+
+        query = self.user(user_id).collection('inventory').order_by(FieldPath.document_id())
+        if fields is not None:
+            query = query.select([field for field in fields if field != 'name'])
+        if cursor is not None:
+            name, = decode_cursor(cursor, 1)
+            query = query.start_after({FieldPath.document_id(): name})
+        docs = list(query.limit(limit + 1).stream())
+        items = []
+        for doc in docs[:limit]:
+            cur = doc.to_dict()
+            cur['name'] = doc.id
+            items.append(cur)
+        next_cursor = encode_cursor(items[-1]['name']) if len(docs) > limit else None
+        return items, next_cursor
+
+    def get_expiring(self, user_id, limit, before=None):
+        # Served by the automatic single-field index on expires_at; the range filter
+        # also leaves out items whose expires_at is null
+        query = self.user(user_id).collection('inventory').where('expires_at', '>', 0)
+        if before is not None:
+            query = query.where('expires_at', '<=', before)
+        items = []
+        for doc in query.order_by('expires_at').limit(limit).stream():
+            cur = doc.to_dict()
+            cur['name'] = doc.id
+            items.append(cur)
+        return items
+
+    def add_to_recipes(self, user_id, recipe):
+        recipe_ref = self.user(user_id).collection('recipes').document()
+        recipe_ref.set({**recipe, 'created_at': time.time()})
+        return recipe_ref.id
+
+    def get_recipe_history(self, user_id, limit, cursor=None, fields=None, since=None):
+        from google.cloud.firestore_v1.field_path import FieldPath
+
+        # Served by the automatic single-field index on created_at, no composite index needed
+        query = self.user(user_id).collection('recipes')
+        if since is not None:
+            query = query.where('created_at', '>', since)
+        query = (query.order_by('created_at', direction=self.firestore.Query.DESCENDING)
+                 .order_by(FieldPath.document_id(), direction=self.firestore.Query.DESCENDING))
+        if fields is not None:
+            query = query.select(['created_at', *[field for field in fields if field not in ('id', 'created_at')]])
+        if cursor is not None:
+            created_at, recipe_id = decode_cursor(cursor, 2)
+            query = query.start_after({'created_at': created_at, FieldPath.document_id(): recipe_id})
+        # One extra document tells us whether there is a next page
+        docs = list(query.limit(limit + 1).stream())
+        recipes = []
+        for doc in docs[:limit]:
+            cur = doc.to_dict()
+            cur['id'] = doc.id
+            recipes.append(cur)
+        next_cursor = encode_cursor(recipes[-1]['created_at'], recipes[-1]['id']) if len(docs) > limit else None
+        return recipes, next_cursor
+
+    def add_points(self, user_id, windows, points, name):
+        '''
+            Blind merge-set with an atomic Increment on leaderboards/{window}/scores/{user_id}
+        '''
+        batch = self.db.batch()
+        for window in windows:
+            batch.set(self.db.collection('leaderboards').document(window).collection('scores').document(user_id),
+                      {'name': name, 'points': self.firestore.Increment(points), 'updated_at': time.time()}, merge=True)
+        batch.commit()
+
+    def get_scores(self, window, since=None):
+        scores = []
+        query = self.db.collection('leaderboards').document(window).collection('scores')
+        if since is not None:
+            # Served by the automatic single-field index on updated_at
+            query = query.where('updated_at', '>', since)
+        for doc in query.select(['name', 'points']).stream():
+            cur = doc.to_dict()
+            scores.append({'user_id': doc.id, 'name': cur.get('name'), 'points': cur.get('points', 0)})
+        return scores
+
+    def set_profile(self, user_id, profile):
+        self.user(user_id).set(profile)
+
+    def add_exp(self, user_id, points):
+        self.user(user_id).set({'exp': self.firestore.Increment(points)}, merge=True)
+
+    def get_profile(self, user_id):
+        return self.user(user_id).get().to_dict()
+
+    def set_job(self, job):
+        self.db.collection('jobs').document(job['id']).set(job)
+
+    def get_job(self, job_id):
+        '''
+            Expired jobs are deleted when they are read
+        '''
+        doc_ref = self.db.collection('jobs').document(job_id)
+        job = doc_ref.get().to_dict()
+        if job is not None and job.get('expires_at') is not None and job['expires_at'] < time.time():
+            doc_ref.delete()
+            return None
+        return job
+
+
+class MemoryBackend(StorageBackend):
+    '''
+        Plain dicts guarded by a lock. Nothing survives a restart, which is what
+        load tests and local development want.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inventory = {}  # user_id -> {name: item}
+        self.expiring = {}  # user_id -> [(expires_at, name)], sorted
+        self.recipes = {}  # user_id -> [recipe], oldest first
+        self.profiles = {}
+        self.scores = {}  # window -> {user_id: {'name', 'points'}}
+        self.jobs = {}
+        self.job_expiry = []  # heap of (expires_at, job_id)
+
+    def add_many_to_inventory(self, user_id, items):
+        '''
+            Existing items keep the earlier purchased_at and expires_at, since the older stock goes off first
+        '''
+        with self.lock:
+            inventory = self.inventory.setdefault(user_id, {})
+            for name, item in items.items():
+                if name in inventory:
+                    current = inventory[name]
+                    current['count'] += item['count']
+                    if item['expires_at'] is not None and (current['expires_at'] is None
+                                                           or item['expires_at'] < current['expires_at']):
+                        self._unindex(user_id, name, current['expires_at'])
+                        current['expires_at'] = item['expires_at']
+                        current['purchased_at'] = item['purchased_at']
+                        self._index(user_id, name, current['expires_at'])
+                else:
+                    inventory[name] = {
+                        'count': item['count'],
+                        'units': item['units'],
+                        'expiry': item['expiry'],
+                        'carbon_footprint': item['carbon_footprint'],
+                        'purchased_at': item['purchased_at'],
+                        'expires_at': item['expires_at']
+                    }
+                    self._index(user_id, name, item['expires_at'])
+
+    def _index(self, user_id, name, expires_at):
+        if expires_at is not None:
+            bisect.insort(self.expiring.setdefault(user_id, []), (expires_at, name))
+
+    def _unindex(self, user_id, name, expires_at):
+        if expires_at is None:
+            return
+        index = self.expiring.get(user_id, [])
+        position = bisect.bisect_left(index, (expires_at, name))
+        if position < len(index) and index[position] == (expires_at, name):
+            del index[position]
+
+    def remove_many_from_inventory(self, user_id, amounts):
+        removed = []
+        with self.lock:
+            inventory = self.inventory.get(user_id, {})
+            for name, amount in amounts.items():
+                item = inventory.get(name)
+                if item is None:
+                    continue
+                if item['count'] - amount <= 0:
+                    del inventory[name]
+                    self._unindex(user_id, name, item['expires_at'])
+                    removed.append(name)
+                else:
+                    item['count'] -= amount
+        return removed
+
+    def get_inventory(self, user_id):
+        with self.lock:
+            return [{**item, 'name': name} for name, item in self.inventory.get(user_id, {}).items()]
+
+    def get_inventory_page(self, user_id, limit, cursor=None, fields=None):
+        after, = decode_cursor(cursor, 1) if cursor is not None else (None,)
+        with self.lock:
+            inventory = self.inventory.get(user_id, {})
+            names = sorted(name for name in inventory if after is None or name > after)
+            items = [project({**inventory[name], 'name': name}, fields, ('name',)) for name in names[:limit]]
+        next_cursor = encode_cursor(items[-1]['name']) if len(names) > limit else None
+        return items, next_cursor
+
+    def get_expiring(self, user_id, limit, before=None):
+        with self.lock:
+            inventory = self.inventory.get(user_id, {})
+            items = []
+            for expires_at, name in self.expiring.get(user_id, [])[:limit]:
+                if before is not None and expires_at > before:
+                    break
+                items.append({**inventory[name], 'name': name})
+        return items
+
+    def add_to_recipes(self, user_id, recipe):
+        recipe_id = uuid.uuid4().hex
+        with self.lock:
+            self.recipes.setdefault(user_id, []).append(
+                {**json.loads(json.dumps(recipe)), 'id': recipe_id, 'created_at': time.time()})
+        return recipe_id
+
+    def get_recipe_history(self, user_id, limit, cursor=None, fields=None, since=None):
+        with self.lock:
+            # History is appended in creation order, so a page is a slice walked backwards
+            history = self.recipes.get(user_id, [])
+            end = len(history)
+            if cursor is not None:
+                created_at, recipe_id = decode_cursor(cursor, 2)
+                while end > 0 and (history[end - 1]['created_at'], history[end - 1]['id']) >= (created_at, recipe_id):
+                    end -= 1
+            start = max(0, end - limit)
+            if since is not None:
+                while start < end and history[start]['created_at'] <= since:
+                    start += 1
+            page = [project(json.loads(json.dumps(recipe)), fields, ('id', 'created_at'))
+                    for recipe in reversed(history[start:end])]
+            more = start > 0 and (since is None or history[start - 1]['created_at'] > since)
+        next_cursor = encode_cursor(page[-1]['created_at'], page[-1]['id']) if more else None
+        return page, next_cursor
+
+    def add_points(self, user_id, windows, points, name):
+        with self.lock:
+            for window in windows:
+                score = self.scores.setdefault(window, {}).setdefault(user_id, {'name': name, 'points': 0})
+                score['name'] = name
+                score['points'] += points
+                score['updated_at'] = time.time()
+
+    def get_scores(self, window, since=None):
+        with self.lock:
+            return [{'user_id': user_id, 'name': score['name'], 'points': score['points']}
+                    for user_id, score in self.scores.get(window, {}).items()
+                    if since is None or score['updated_at'] > since]
+
+    def set_profile(self, user_id, profile):
+        with self.lock:
+            self.profiles[user_id] = json.loads(json.dumps(profile))
+
+    def add_exp(self, user_id, points):
+        with self.lock:
+            profile = self.profiles.setdefault(user_id, {})
+            profile['exp'] = (profile.get('exp') or 0) + points
+
+    def get_profile(self, user_id):
+        with self.lock:
+            profile = self.profiles.get(user_id)
+            return json.loads(json.dumps(profile)) if profile is not None else None
+
+    def set_job(self, job):
+        '''
+            Also deletes the jobs that have expired, found from the top of a heap of expiry times
+        '''
+        now = time.time()
+        with self.lock:
+            while self.job_expiry and self.job_expiry[0][0] < now:
+                expires_at, job_id = heapq.heappop(self.job_expiry)
+                saved = self.jobs.get(job_id)
+                # A job saved again since has a newer entry of its own
+                if saved is not None and saved['expires_at'] == expires_at:
+                    del self.jobs[job_id]
+            self.jobs[job['id']] = json.loads(json.dumps(job))
+            if job['expires_at'] is not None:
+                heapq.heappush(self.job_expiry, (job['expires_at'], job['id']))
+
+    def get_job(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or (job['expires_at'] is not None and job['expires_at'] < time.time()):
+                return None
+            return json.loads(json.dumps(job))
+
+
+class SQLiteBackend(StorageBackend):
+    '''
+        Embedded SQLite database in WAL mode, so readers never block the writer.
+        Inventory is a WITHOUT ROWID table clustered on (user_id, name) and indexed on
+        (user_id, expires_at), and recipe history is indexed on (user_id, created_at, id),
+        so every lookup, every history page and the expiring items are an index range
+        scan within one user.
+    '''
+
+    # Kept in PRAGMA user_version; bump it, with a step in migrate(), whenever SCHEMA changes
+    SCHEMA_VERSION = 1
+
+    INVENTORY_COLUMNS = 'name, count, units, expiry, carbon_footprint, purchased_at, expires_at'
+
+    SCHEMA = [
+        '''CREATE TABLE IF NOT EXISTS inventory (
+            user_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            count NUMERIC NOT NULL,
+            units TEXT,
+            expiry,
+            carbon_footprint,
+            purchased_at REAL,
+            expires_at REAL,
+            PRIMARY KEY (user_id, name)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS inventory_by_user_expiry ON inventory (user_id, expires_at)',
+        '''CREATE TABLE IF NOT EXISTS recipes (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            recipe_name TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            data TEXT NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS recipes_by_user_time ON recipes (user_id, created_at, id)',
+        'CREATE INDEX IF NOT EXISTS recipes_by_user_name ON recipes (user_id, recipe_name)',
+        '''CREATE TABLE IF NOT EXISTS profiles (
+            user_id TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS scores (
+            window TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            name TEXT,
+            points NUMERIC NOT NULL,
+            updated_at REAL,
+            PRIMARY KEY (window, user_id)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS scores_by_window_update ON scores (window, updated_at)',
+        '''CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            expires_at REAL,
+            data TEXT NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS jobs_by_expiry ON jobs (expires_at)',
+    ]
+
+    def __init__(self, path='local.db'):
+        self.path = path
+        self.local = threading.local()
+        self.migrate()
+
+    def connection(self):
+        '''
+            One connection per thread, since sqlite3 connections can't be shared across threads
+        '''
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def migrate(self):
+        '''
+            Creates the schema in a new database. There is no earlier schema to upgrade from yet.
+        '''
+        conn = self.connection()
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version >= self.SCHEMA_VERSION:
+            return
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            conn.execute('PRAGMA user_version = %d' % self.SCHEMA_VERSION)
+
+    def add_many_to_inventory(self, user_id, items):
+        '''
+            Existing items keep the earlier purchased_at and expires_at, since the older stock goes off first
+        '''
+        with self.connection() as conn:
+            conn.executemany(
+                'INSERT INTO inventory (user_id, %s) VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(user_id, name) DO UPDATE SET count = count + excluded.count, '
+                'purchased_at = CASE WHEN expires_at IS NULL OR excluded.expires_at < expires_at '
+                'THEN excluded.purchased_at ELSE purchased_at END, '
+                'expires_at = coalesce(min(expires_at, excluded.expires_at), expires_at, excluded.expires_at)'
+                % self.INVENTORY_COLUMNS,
+                [(user_id, name, item['count'], item['units'], item['expiry'], item['carbon_footprint'],
+                  item['purchased_at'], item['expires_at'])
+                 for name, item in items.items()])
+
+    def remove_many_from_inventory(self, user_id, amounts):
+        with self.connection() as conn:
+            conn.executemany('UPDATE inventory SET count = count - ? WHERE user_id = ? AND name = ?',
+                             [(amount, user_id, name) for name, amount in amounts.items()])
+            placeholders = ', '.join('?' * len(amounts))
+            removed = [row[0] for row in conn.execute(
+                'DELETE FROM inventory WHERE user_id = ? AND count <= 0 AND name IN (%s) RETURNING name' % placeholders,
+                [user_id, *amounts])]
+        return removed
+
+    def inventory_item(self, row):
+        return dict(zip(('name', 'count', 'units', 'expiry', 'carbon_footprint', 'purchased_at', 'expires_at'), row))
+
+    def get_inventory(self, user_id):
+        rows = self.connection().execute(
+            'SELECT %s FROM inventory WHERE user_id = ?' % self.INVENTORY_COLUMNS, (user_id,)).fetchall()
+        return [self.inventory_item(row) for row in rows]
+
+    def get_inventory_page(self, user_id, limit, cursor=None, fields=None):
+        if cursor is None:
+            rows = self.connection().execute(
+                'SELECT %s FROM inventory WHERE user_id = ? '
+                'ORDER BY name LIMIT ?' % self.INVENTORY_COLUMNS, (user_id, limit + 1)).fetchall()
+        else:
+            name, = decode_cursor(cursor, 1)
+            rows = self.connection().execute(
+                'SELECT %s FROM inventory WHERE user_id = ? AND name > ? '
+                'ORDER BY name LIMIT ?' % self.INVENTORY_COLUMNS, (user_id, name, limit + 1)).fetchall()
+        items = [project(self.inventory_item(row), fields, ('name',)) for row in rows[:limit]]
+        next_cursor = encode_cursor(items[-1]['name']) if len(rows) > limit else None
+        return items, next_cursor
+
+    def get_expiring(self, user_id, limit, before=None):
+        sql = 'SELECT %s FROM inventory WHERE user_id = ? AND expires_at IS NOT NULL' % self.INVENTORY_COLUMNS
+        params = [user_id]
+        if before is not None:
+            sql += ' AND expires_at <= ?'
+            params.append(before)
+        rows = self.connection().execute(sql + ' ORDER BY expires_at LIMIT ?', (*params, limit)).fetchall()
+        return [self.inventory_item(row) for row in rows]
+
+    def add_to_recipes(self, user_id, recipe):
+        recipe_id = uuid.uuid4().hex
+        with self.connection() as conn:
+            conn.execute('INSERT INTO recipes (id, user_id, recipe_name, created_at, data) VALUES (?, ?, ?, ?, ?)',
+                         (recipe_id, user_id, recipe['recipe_name'], time.time(), json.dumps(recipe)))
+        return recipe_id
+
+    def get_recipe_history(self, user_id, limit, cursor=None, fields=None, since=None):
+        sql = 'SELECT id, created_at, data FROM recipes WHERE user_id = ?'
+        params = [user_id]
+        if cursor is not None:
+            sql += ' AND (created_at, id) < (?, ?)'
+            params.extend(decode_cursor(cursor, 2))
+        if since is not None:
+            sql += ' AND created_at > ?'
+            params.append(since)
+        rows = self.connection().execute(sql + ' ORDER BY created_at DESC, id DESC LIMIT ?',
+                                         (*params, limit + 1)).fetchall()
+        recipes = [project({**json.loads(data), 'id': recipe_id, 'created_at': created_at}, fields, ('id', 'created_at'))
+                   for recipe_id, created_at, data in rows[:limit]]
+        next_cursor = encode_cursor(recipes[-1]['created_at'], recipes[-1]['id']) if len(rows) > limit else None
+        return recipes, next_cursor
+
+    def add_points(self, user_id, windows, points, name):
+        with self.connection() as conn:
+            conn.executemany(
+                'INSERT INTO scores (window, user_id, name, points, updated_at) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(window, user_id) DO UPDATE SET name = excluded.name, points = points + excluded.points, '
+                'updated_at = excluded.updated_at',
+                [(window, user_id, name, points, time.time()) for window in windows])
+
+    def get_scores(self, window, since=None):
+        if since is None:
+            rows = self.connection().execute('SELECT user_id, name, points FROM scores WHERE window = ?',
+                                             (window,)).fetchall()
+        else:
+            rows = self.connection().execute('SELECT user_id, name, points FROM scores WHERE window = ? AND updated_at > ?',
+                                             (window, since)).fetchall()
+        return [{'user_id': user_id, 'name': name, 'points': points} for user_id, name, points in rows]
+
+    def set_profile(self, user_id, profile):
+        with self.connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO profiles (user_id, data) VALUES (?, ?)',
+                         (user_id, json.dumps(profile)))
+
+    def add_exp(self, user_id, points):
+        with self.connection() as conn:
+            conn.execute("INSERT INTO profiles (user_id, data) VALUES (?, json_object('exp', ?)) "
+                         "ON CONFLICT(user_id) DO UPDATE SET "
+                         "data = json_set(data, '$.exp', coalesce(json_extract(data, '$.exp'), 0) + json_extract(excluded.data, '$.exp'))",
+                         (user_id, points))
+
+    def get_profile(self, user_id):
+        row = self.connection().execute('SELECT data FROM profiles WHERE user_id = ?', (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_job(self, job):
+        '''
+            Also deletes the jobs that have expired
+        '''
+        with self.connection() as conn:
+            conn.execute('DELETE FROM jobs WHERE expires_at < ?', (time.time(),))
+            conn.execute('INSERT OR REPLACE INTO jobs (id, expires_at, data) VALUES (?, ?, ?)',
+                         (job['id'], job['expires_at'], json.dumps(job)))
+
+    def get_job(self, job_id):
+        row = self.connection().execute(
+            'SELECT data FROM jobs WHERE id = ? AND (expires_at IS NULL OR expires_at >= ?)',
+            (job_id, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+'''
+    Builds the backend named by STORAGE_BACKEND: firestore (default), sqlite or memory
+'''
+def create_backend(kind=None):
+    kind = (kind or os.getenv('STORAGE_BACKEND', 'firestore')).lower()
+    if kind == 'firestore':
+        return FirestoreBackend(os.getenv('FIREBASE_CREDENTIALS', 'keys/service-account-key.json'))
+    if kind == 'sqlite':
+        return SQLiteBackend(os.getenv('SQLITE_PATH', 'local.db'))
+    if kind == 'memory':
+        return MemoryBackend()
+    raise ValueError("Unknown STORAGE_BACKEND '%s', expected firestore, sqlite or memory" % kind)
@@ -0,0 +1,23 @@
+import os
+
+# The server modules read their configuration when imported: run them offline, in memory
+os.environ.setdefault("GEMINI_BACKEND", "fake")
+os.environ.setdefault("FAKE_MODEL_LATENCY", "0.01")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("RESPONSE_CACHE_DIR", "")
+os.environ.setdefault("REQUEST_LOG_DIR", "")
+
+import pytest
+
+
+@pytest.fixture
+def memory_backend():
+    """
+    A fresh MemoryBackend behind database.py for the test
+    """
+    import database
+    from storage import MemoryBackend
+
+    backend = MemoryBackend()
+    database.set_backend(backend)
+    return backend
@@ -0,0 +1,116 @@
+import bisect
+import random
+
+import pytest
+
+from leaderboard import Leaderboards, Ranking, SortedList, window_key
+
+
+@pytest.mark.parametrize("load", [1, 2, 8])
+def test_sorted_list_matches_a_sorted_python_list(load):
+    rng = random.Random(load)
+    items = SortedList([(rng.randrange(-20, 0), "seed%d" % i) for i in range(10)], load=load)
+    expected = sorted(items.slice(0, len(items)))
+    for _ in range(2000):
+        if expected and rng.random() < 0.45:
+            item = rng.choice(expected)
+            expected.remove(item)
+            items.remove(item)
+        else:
+            item = (rng.randrange(-20, 0), "user%d" % rng.randrange(200))
+            if item in expected:
+                continue
+            bisect.insort(expected, item)
+            items.add(item)
+        probe = (rng.randrange(-20, 0), "user%d" % rng.randrange(200))
+        assert len(items) == len(expected)
+        assert items.bisect_left(probe) == bisect.bisect_left(expected, probe)
+        assert items.bisect_right(probe) == bisect.bisect_right(expected, probe)
+        start = rng.randrange(len(expected) + 2)
+        stop = start + rng.randrange(10)
+        assert items.slice(start, stop) == expected[start:stop]
+    assert items.slice(0, len(items)) == expected
+
+
+def test_sorted_list_slices_like_a_list():
+    items = SortedList(range(0, 100, 3), load=2)
+    expected = list(range(0, 100, 3))
+    for start, stop in [(0, 5), (3, 4), (10, 40), (33, 40), (40, 50), (5, 5), (7, 3)]:
+        assert items.slice(start, stop) == expected[start:stop]
+
+
+def test_removing_a_missing_item_raises_and_changes_nothing():
+    items = SortedList([(-5, "a"), (-3, "b"), (-1, "c")], load=1)
+    with pytest.raises(ValueError):
+        items.remove((-3, "z"))
+    with pytest.raises(ValueError):
+        items.remove((0, "z"))
+    assert items.slice(0, 3) == [(-5, "a"), (-3, "b"), (-1, "c")]
+
+
+def test_ranking_shares_ranks_between_ties():
+    ranking = Ranking([{"user_id": "a", "name": "A", "points": 10}, {"user_id": "b", "name": "B", "points": 30},
+                       {"user_id": "c", "name": "C", "points": 10}, {"user_id": "d", "name": "D", "points": 5}])
+    assert [ranking.rank(user) for user in "abcd"] == [2, 1, 2, 4]
+    assert ranking.rank("nobody") is None
+    ranking.add("d", 30, "D")
+    assert [ranking.rank(user) for user in "abcd"] == [3, 2, 3, 1]
+
+
+def test_ranking_pages_continue_after_the_last_entry():
+    ranking = Ranking([{"user_id": "u%d" % i, "name": None, "points": i // 2} for i in range(7)])
+    first, more = ranking.page(3)
+    assert more
+    assert [(entry["user_id"], entry["points"], entry["rank"]) for entry in first] == [
+        ("u6", 3, 1), ("u4", 2, 2), ("u5", 2, 2)]
+    last = first[-1]
+    second, more = ranking.page(3, (last["points"], last["user_id"]))
+    assert [(entry["user_id"], entry["rank"]) for entry in second] == [("u2", 4), ("u3", 4), ("u0", 6)]
+    third, more = ranking.page(3, (second[-1]["points"], second[-1]["user_id"]))
+    assert [entry["user_id"] for entry in third] == ["u1"] and not more
+
+
+def test_week_windows_follow_the_iso_week():
+    assert window_key("all") == "all"
+    assert window_key("week", 1767225600) == "week-2026-W01"
+    with pytest.raises(ValueError):
+        window_key("month")
+
+
+def test_recorded_points_show_up_in_every_window(memory_backend):
+    leaderboards = Leaderboards(ttl=60)
+    leaderboards.record("ann", "Ann", 5)
+    leaderboards.record("bob", "Bob", 8)
+    leaderboards.record("ann", "Ann", 4)
+    top = leaderboards.top("all", 10)
+    assert [(entry["user_id"], entry["points"], entry["weekly_points"]) for entry in top["entries"]] == [
+        ("ann", 9, 9), ("bob", 8, 8)]
+    assert top["users"] == 2 and top["next_cursor"] is None
+    assert leaderboards.rank("week", "bob")["rank"] == 2
+    assert leaderboards.rank("all", "carl")["rank"] is None
+
+
+def test_points_written_by_other_processes_are_read_back(memory_backend):
+    leaderboards = Leaderboards(ttl=0)
+    leaderboards.record("ann", "Ann", 5)
+    assert leaderboards.rank("all", "ann")["rank"] == 1
+    # Another server process confirming a recipe
+    memory_backend.add_points("bob", ["all"], 7, "Bob")
+    assert leaderboards.rank("all", "bob")["rank"] == 1
+    assert leaderboards.stats()["refreshes"] >= 1
+
+
+def test_cursor_pages_through_the_whole_leaderboard(memory_backend):
+    leaderboards = Leaderboards()
+    for i in range(7):
+        leaderboards.record("user%d" % i, "User %d" % i, i % 3)
+    seen, cursor = [], None
+    while True:
+        page = leaderboards.top("all", 3, cursor)
+        seen.extend(entry["user_id"] for entry in page["entries"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert sorted(seen) == ["user%d" % i for i in range(7)]
+    with pytest.raises(ValueError):
+        leaderboards.top("all", 3, "not a cursor")
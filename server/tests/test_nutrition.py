@@ -0,0 +1,83 @@
+import pytest
+
+from nutrition import get_table, merge_ingredients, normalize_name, score_recipes
+
+
+def looked_up(name):
+    table = get_table()
+    row = table.lookup(name)
+    return None if row is None else table.names[row]
+
+
+def test_names_are_normalized():
+    assert normalize_name("Finely Chopped Tomatoes (ripe)") == "tomato"
+    assert normalize_name("Cherries") == "cherry"
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("milk", "milk"),
+    ("Tomatoes", "tomato"),
+    ("cheddar", "cheese"),
+    ("freshly ground black pepper", "black pepper"),
+    ("extra virgin olive oil", "olive oil"),
+    ("chicken breast fillet", "chicken"),
+    ("smoked paprika", "spices"),
+    ("brocoli", "broccoli"),
+])
+def test_lookup_matches_names_aliases_and_typos(name, expected):
+    assert looked_up(name) == expected
+
+
+@pytest.mark.parametrize("name", [
+    "almond milk", "oat milk", "soy milk", "almond butter", "vegan cheese", "rice noodles",
+    "gluten-free pasta", "ice cream", "cream of tartar", "peanut oil", "dragon fruit",
+])
+def test_lookup_keeps_qualifiers(name):
+    assert looked_up(name) is None
+
+
+def recipe(*ingredients):
+    return {"ingredients": [{"name": name, "count": count, "units": units} for name, count, units in ingredients]}
+
+
+def test_amounts_are_converted_to_grams():
+    by_weight, by_volume = score_recipes([recipe(("milk", 100, "g")), recipe(("milk", 100, "ml"))])
+    assert by_volume["nutrients"]["kcal"] == pytest.approx(by_weight["nutrients"]["kcal"] * 1.03, abs=0.1)
+
+
+def test_count_of_zero_adds_nothing_and_missing_count_is_one_piece():
+    nothing, one, two = score_recipes([recipe(("egg", 0, "")), recipe(("egg", None, "")), recipe(("egg", 2, ""))])
+    assert nothing["nutrients"]["kcal"] == 0
+    assert two["nutrients"]["kcal"] == pytest.approx(2 * one["nutrients"]["kcal"])
+
+
+def test_coverage_and_unmatched_names():
+    score, = score_recipes([recipe(("egg", 2, ""), ("dragon fruit", 1, ""))])
+    assert score["coverage"] == 0.5
+    assert score["unmatched"] == ["dragon fruit"]
+
+
+def test_diseases_deduct_points():
+    cheese_toast = recipe(("cheese", 50, "g"), ("bread", 2, ""))
+    plain, = score_recipes([cheese_toast])
+    lactose, = score_recipes([cheese_toast], ["Lactose intolerance"])
+    assert lactose["points_response"] == max(plain["points_response"] - 3, 0)
+    assert lactose["deductions"] == ["Lactose intolerance (-3)"]
+
+
+def test_points_are_between_0_and_10():
+    scores = score_recipes([recipe(("beef", 1, "kg")), recipe(("lentils", 200, "g"), ("rice", 100, "g")), recipe()])
+    assert all(0 <= score["points_response"] <= 10 for score in scores)
+
+
+def test_merge_adds_up_the_same_item_across_scans():
+    merged = merge_ingredients([
+        [{"name": "Tomatoes", "count": 2, "units": "pieces", "expiry": 5, "carbon_footprint": 1}],
+        [{"name": "tomato", "count": 1, "units": "piece", "expiry": 3, "carbon_footprint": 2},
+         {"name": "milk", "count": 1, "units": "l", "expiry": "7 days", "carbon_footprint": None}],
+        [{"name": "milk", "count": 500, "units": "ml", "expiry": None, "carbon_footprint": 2}],
+    ])
+    assert merged == [
+        {"name": "tomato", "count": 3, "units": "piece", "expiry": 3, "carbon_footprint": 2},
+        {"name": "milk", "count": 1500, "units": "ml", "expiry": 7, "carbon_footprint": 2},
+    ]
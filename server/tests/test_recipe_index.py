@@ -0,0 +1,74 @@
+from recipe_index import RecipeIndex, RecipeIndexes
+
+
+def recipe(name, *ingredients, **fields):
+    return {"recipe_name": name, "ingredients": [{"name": ingredient} for ingredient in ingredients], **fields}
+
+
+def pantry(*names, expiry=30):
+    return [{"name": name, "expiry": expiry} for name in names]
+
+
+def index_of(*recipes):
+    index = RecipeIndex()
+    for entry in recipes:
+        index.add(entry)
+    return index
+
+
+def test_recipes_are_ranked_by_coverage():
+    index = index_of(recipe("Omelette", "egg", "milk", "cheese"), recipe("Pancakes", "egg", "milk", "flour", "butter"),
+                     recipe("Steak", "beef"))
+    ranked = index.search(pantry("Eggs", "milk", "cheddar cheese"))
+    assert [(entry[2]["recipe_name"], round(entry[1], 2)) for entry in ranked] == [("Omelette", 0.67), ("Pancakes", 0.5)]
+
+
+def test_names_are_normalized_and_staples_are_assumed():
+    index = index_of(recipe("Fried Eggs", "eggs", "salt", "olive oil"))
+    (_, coverage, match), = index.search(pantry("egg"))
+    assert coverage == 1.0
+    assert match["recipe_name"] == "Fried Eggs"
+
+
+def test_items_expiring_soon_rank_higher():
+    index = index_of(recipe("Tomato Salad", "tomato", "onion"), recipe("Egg Salad", "egg", "onion"))
+    ranked = index.search([{"name": "tomato", "expiry": 1}, {"name": "egg", "expiry": 20}, {"name": "onion", "expiry": 20}])
+    assert ranked[0][2]["recipe_name"] == "Tomato Salad"
+    assert ranked[0][1] == ranked[1][1] == 1.0
+
+
+def test_allergies_exclude_by_words_and_restrictions_by_tags():
+    index = index_of(recipe("Satay", "peanut butter", "chicken"), recipe("Latte", "milk", "coffee"),
+                     recipe("Toast", "bread"))
+    available = pantry("peanut butter", "chicken", "milk", "coffee", "bread")
+    assert {entry[2]["recipe_name"] for entry in index.search(available, ["peanut"])} == {"Latte", "Toast"}
+    assert {entry[2]["recipe_name"] for entry in index.search(available, ["vegan"])} == {"Toast"}
+
+
+def test_a_recipe_with_the_same_name_replaces_the_old_one():
+    index = index_of(recipe("Soup", "tomato"), recipe("soup", "carrot"))
+    assert index.search(pantry("tomato")) == []
+    assert [entry[2]["ingredients"] for entry in index.search(pantry("carrot"))] == [[{"name": "carrot"}]]
+
+
+def test_best_match_needs_the_coverage_and_skips_the_recipe_served_last(memory_backend):
+    indexes = RecipeIndexes(corpus=[recipe("Omelette", "egg", "milk"), recipe("Scrambled Eggs", "egg", "butter"),
+                                    recipe("Steak", "beef")])
+    available = pantry("egg", "milk", "butter")
+    first, coverage = indexes.best_match("user", available, [], 0.9)
+    assert coverage == 1.0
+    second, _ = indexes.best_match("user", available, [], 0.9)
+    assert {first["recipe_name"], second["recipe_name"]} == {"Omelette", "Scrambled Eggs"}
+    # The model-down fallback takes the best match, even the one served last
+    assert indexes.best_match("user", available, [], 0.9, skip_last=False)[0] == first
+    assert indexes.best_match("user", pantry("beef"), [], 0.9)[0]["recipe_name"] == "Steak"
+    assert indexes.best_match("user", pantry("milk"), [], 0.9) == (None, 0.0)
+
+
+def test_confirmed_recipes_are_indexed_per_user(memory_backend):
+    memory_backend.add_to_recipes("ann", recipe("Pesto Pasta", "pasta", "basil"))
+    indexes = RecipeIndexes()
+    assert indexes.best_match("ann", pantry("pasta", "basil"), [], 0.9)[0]["recipe_name"] == "Pesto Pasta"
+    assert indexes.best_match("bob", pantry("pasta", "basil"), [], 0.9) == (None, 0.0)
+    indexes.add("bob", recipe("Basil Pasta", "pasta", "basil", id="r1"))
+    assert indexes.best_match("bob", pantry("pasta", "basil"), [], 0.9)[0]["id"] == "r1"
@@ -0,0 +1,186 @@
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+import resilience
+from fake_model import FakeGenerativeModel
+from resilience import CircuitBreaker, CircuitOpen, ModelUnavailable, ResilientCaller, TokenBucket
+
+
+class CountingGate:
+    """
+    A gate like model_registry.slot that counts the attempts holding it
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.held = 0
+
+    @contextmanager
+    def __call__(self):
+        with self.lock:
+            self.held += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.held -= 1
+
+
+def make_caller(timeout=1.0, retries=0, failure_threshold=0, reset_timeout=30, hedge_after=0, gate=None):
+    return ResilientCaller(TokenBucket(0, 1), CircuitBreaker(failure_threshold, reset_timeout), timeout=timeout,
+                           retries=retries, backoff=0.01, max_backoff=0.01, hedge_after=hedge_after, gate=gate,
+                           workers=4)
+
+
+def fake(**options):
+    model = FakeGenerativeModel("fake", latency=options.pop("latency", 0.01), jitter=0, **options)
+    return lambda prompt: model.generate_content(prompt).text
+
+
+def sequence(*fns):
+    """
+    A function that calls the first of fns the first time, the second the second time, and so on
+    """
+    calls = itertools.count()
+    return lambda *args: fns[min(next(calls), len(fns) - 1)](*args)
+
+
+def test_call_returns_the_answer():
+    caller = make_caller()
+    assert caller.call("test", fake(), "prompt") == fake()("prompt")
+    assert caller.stats()["attempts"] == 1
+
+
+def test_transient_errors_are_retried():
+    caller = make_caller(retries=2)
+    result = caller.call("test", sequence(fake(error_rate=1), fake(error_rate=1), fake()), "prompt")
+    assert result == fake()("prompt")
+    assert caller.stats()["retries"] == 2
+
+
+def test_persistent_errors_raise_model_unavailable():
+    caller = make_caller(retries=2)
+    with pytest.raises(ModelUnavailable):
+        caller.call("test", fake(error_rate=1), "prompt")
+    assert caller.stats()["attempts"] == 3
+
+
+def test_permanent_errors_are_not_retried():
+    caller = make_caller(retries=2)
+    with pytest.raises(Exception) as raised:
+        caller.call("test", fake(error_rate=1, error_code=400), "prompt")
+    assert raised.value.code == 400
+    assert caller.stats()["attempts"] == 1
+    assert caller.breaker.stats()["state"] == CircuitBreaker.CLOSED
+
+
+def test_breaker_opens_after_consecutive_failures_and_rejects_calls():
+    caller = make_caller(failure_threshold=2)
+    for _ in range(2):
+        with pytest.raises(ModelUnavailable):
+            caller.call("test", fake(error_rate=1), "prompt")
+    with pytest.raises(CircuitOpen) as raised:
+        caller.call("test", fake(), "prompt")
+    assert raised.value.retry_after >= 1
+    assert caller.breaker.stats()["state"] == CircuitBreaker.OPEN
+    assert caller.stats()["attempts"] == 2
+
+
+def test_breaker_closes_after_a_successful_trial():
+    caller = make_caller(failure_threshold=1, reset_timeout=0.05)
+    with pytest.raises(ModelUnavailable):
+        caller.call("test", fake(error_rate=1), "prompt")
+    time.sleep(0.06)
+    assert caller.call("test", fake(), "prompt") == fake()("prompt")
+    assert caller.breaker.stats()["state"] == CircuitBreaker.CLOSED
+
+
+def test_failed_trial_reopens_the_breaker():
+    breaker = CircuitBreaker(1, reset_timeout=0.05)
+    breaker.failure()
+    time.sleep(0.06)
+    breaker.allow()
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+    breaker.failure()
+    assert breaker.stats()["state"] == CircuitBreaker.OPEN
+    assert breaker.stats()["opened"] == 2
+
+
+def test_slow_attempt_times_out_and_gives_back_its_slot():
+    gate = CountingGate()
+    caller = make_caller(timeout=0.05, gate=gate)
+    with pytest.raises(ModelUnavailable):
+        caller.call("test", fake(latency=0.5), "prompt")
+    assert caller.stats()["timeouts"] == 1
+    # The attempt is still running on its worker, but no longer holds the gate
+    assert gate.held == 0
+
+
+def test_timed_out_attempt_is_retried():
+    caller = make_caller(timeout=0.1, retries=1)
+    assert caller.call("test", sequence(fake(latency=0.5), fake()), "prompt") == fake()("prompt")
+    assert caller.stats()["timeouts"] == 1
+
+
+def test_hedge_answers_a_slow_attempt():
+    gate = CountingGate()
+    caller = make_caller(timeout=1.0, hedge_after=0.05, gate=gate)
+    start = time.monotonic()
+    assert caller.call("test", sequence(fake(latency=0.5), fake()), "prompt") == fake()("prompt")
+    assert time.monotonic() - start < 0.4
+    stats = caller.stats()
+    assert (stats["hedges"], stats["hedges_won"]) == (1, 1)
+    # The slow original lost, and gave its slot back
+    assert gate.held == 0
+
+
+def test_fast_attempt_is_not_hedged():
+    caller = make_caller(hedge_after=0.2)
+    caller.call("test", fake(), "prompt")
+    assert caller.stats()["hedges"] == 0
+
+
+def test_stream_yields_every_chunk():
+    model = FakeGenerativeModel("fake", latency=0.01, jitter=0, chunks=4)
+    caller = make_caller()
+    chunks = list(caller.stream("test", lambda prompt: model.generate_content(prompt, stream=True), "prompt"))
+    assert "".join(chunk.text for chunk in chunks) == model.generate_content("prompt").text
+
+
+def test_stream_does_not_hold_the_gate_during_backoff(monkeypatch):
+    gate = CountingGate()
+    held_while_sleeping = []
+    monkeypatch.setattr(resilience, "time", SimpleNamespace(
+        monotonic=time.monotonic, sleep=lambda seconds: held_while_sleeping.append(gate.held)))
+    model = FakeGenerativeModel("fake", latency=0.01, jitter=0, chunks=4)
+    failing = FakeGenerativeModel("fake", latency=0.01, jitter=0, error_rate=1)
+    caller = make_caller(retries=1, gate=gate)
+    chunks = list(caller.stream("test", sequence(lambda prompt: failing.generate_content(prompt, stream=True),
+                                                 lambda prompt: model.generate_content(prompt, stream=True)),
+                                "prompt"))
+    assert chunks
+    assert held_while_sleeping == [0]
+    assert gate.held == 0
+
+
+def test_stream_times_out_waiting_for_the_first_chunk():
+    gate = CountingGate()
+    model = FakeGenerativeModel("fake", latency=0.5, jitter=0, chunks=1)
+    caller = make_caller(timeout=0.05, gate=gate)
+    with pytest.raises(ModelUnavailable):
+        list(caller.stream("test", lambda prompt: model.generate_content(prompt, stream=True), "prompt"))
+    assert caller.stats()["timeouts"] == 1
+    assert gate.held == 0
+
+
+def test_token_bucket_limits_bursts():
+    bucket = TokenBucket(rate=1, burst=2)
+    assert bucket.try_acquire() and bucket.try_acquire()
+    assert not bucket.try_acquire()
+    assert not bucket.acquire(0.01)
@@ -0,0 +1,73 @@
+import pytest
+
+from schemas import IngredientList, Points, Recipe, RecipeBatch, RecipeHeader, SchemaError
+
+RECIPE = {
+    "recipe_name": "Tomato Soup",
+    "short_description": "A warm soup.",
+    "cooking_time": "25 minutes",
+    "difficulty": "easy",
+    "ingredients": [{"name": "tomato", "count": "4", "units": "piece"}],
+    "instructions": ["Chop the tomatoes.", "Simmer them."],
+}
+
+
+def test_recipe_values_are_coerced():
+    recipe = Recipe.validate(RECIPE)
+    assert recipe.cooking_time == 25
+    assert recipe.difficulty == "Easy"
+    assert recipe.ingredients[0].count == 4
+    assert recipe.to_dict()["ingredients"] == [{"name": "tomato", "count": 4, "units": "piece"}]
+
+
+def test_optional_fields_are_left_out_of_to_dict():
+    assert "url" not in Recipe.validate(RECIPE).to_dict()
+
+
+def test_missing_required_field_raises_with_its_path():
+    with pytest.raises(SchemaError) as raised:
+        Recipe.validate({key: value for key, value in RECIPE.items() if key != "instructions"})
+    assert raised.value.path == "$"
+    assert "instructions" in str(raised.value)
+
+
+def test_bad_value_raises_with_its_path():
+    with pytest.raises(SchemaError) as raised:
+        Recipe.validate({**RECIPE, "difficulty": "impossible"})
+    assert raised.value.path == "$.difficulty"
+
+
+def test_malformed_array_elements_are_dropped():
+    recipe = Recipe.validate({**RECIPE, "ingredients": [{"name": "tomato", "count": 4, "units": "piece"},
+                                                        {"name": "onion", "count": "some"}]})
+    assert [ingredient.name for ingredient in recipe.ingredients] == ["tomato"]
+
+
+def test_malformed_recipe_is_dropped_from_a_batch():
+    batch = RecipeBatch.validate({"recipes": [RECIPE, {"recipe_name": "cut off"}]})
+    assert [recipe.recipe_name for recipe in batch.recipes] == ["Tomato Soup"]
+
+
+def test_nullable_fields_become_none():
+    ingredients = IngredientList.validate({"ingredients": [
+        {"name": "milk", "count": 1, "units": "l", "expiry": "unknown", "carbon_footprint": None}]})
+    assert ingredients.to_dict()["ingredients"] == [
+        {"name": "milk", "count": 1, "units": "l", "expiry": None, "carbon_footprint": None}]
+
+
+def test_points_accept_numbers_in_text():
+    points = Points.validate({"nutritional_values": "Calories: 300", "points_response": "7/10",
+                              "justification_response": "Balanced."})
+    assert points.points_response == 7
+
+
+def test_recipe_header_only_needs_the_scoring_fields():
+    header = RecipeHeader.validate({key: RECIPE[key] for key in ("recipe_name", "short_description", "ingredients")})
+    assert header.to_dict() == {"recipe_name": "Tomato Soup", "short_description": "A warm soup.",
+                                "ingredients": [{"name": "tomato", "count": 4, "units": "piece"}]}
+    with pytest.raises(SchemaError):
+        RecipeHeader.validate({"recipe_name": "Tomato Soup", "ingredients": []})
+
+
+def test_records_compare_by_value():
+    assert Recipe.validate(RECIPE) == Recipe.validate(dict(RECIPE))
@@ -0,0 +1,149 @@
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight, call_key
+
+
+def run_together(count, fn):
+    """
+    Runs fn() on count threads and returns their results, or the exceptions they raised
+    """
+    results = [None] * count
+
+    def run(i):
+        try:
+            results[i] = fn()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_call_key_ignores_dict_order():
+    assert call_key("f", {"a": 1, "b": 2}) == call_key("f", {"b": 2, "a": 1})
+    assert call_key("f", {"a": 1}) != call_key("f", {"a": 2})
+
+
+def test_concurrent_calls_share_one_result():
+    group = SingleFlight("test-share")
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.1)
+        return {"value": 1}
+
+    results = run_together(5, lambda: group.do("key", slow))
+    assert len(calls) == 1
+    assert results == [{"value": 1}] * 5
+    # Every caller gets its own copy
+    assert len({id(result) for result in results}) == 5
+    assert group.stats()["coalesced"] == 4
+    assert group.stats()["in_flight"] == 0
+
+
+def test_errors_are_shared():
+    group = SingleFlight("test-errors")
+
+    def failing():
+        time.sleep(0.1)
+        raise ValueError("bad answer")
+
+    results = run_together(3, lambda: group.do("key", failing))
+    assert all(isinstance(result, ValueError) for result in results)
+    assert group.stats()["leaders"] == 1
+
+
+def test_calls_after_the_first_finishes_are_not_shared():
+    group = SingleFlight("test-sequential")
+    calls = []
+    for _ in range(3):
+        group.do("key", lambda: calls.append(1))
+    assert len(calls) == 3
+
+
+def test_waiters_call_again_when_the_leader_is_interrupted():
+    group = SingleFlight("test-interrupted")
+    started = threading.Event()
+    calls = []
+
+    class Stop(BaseException):
+        pass
+
+    def leader():
+        calls.append("leader")
+        started.set()
+        time.sleep(0.1)
+        raise Stop()
+
+    def run_leader():
+        with pytest.raises(Stop):
+            group.do("key", leader)
+
+    thread = threading.Thread(target=run_leader)
+    thread.start()
+    started.wait()
+    result = group.do("key", lambda: calls.append("waiter") or "answer")
+    thread.join()
+    assert result == "answer"
+    assert calls == ["leader", "waiter"]
+
+
+def test_stream_is_shared_chunk_by_chunk():
+    group = SingleFlight("test-stream")
+    calls = []
+
+    def chunks():
+        calls.append(1)
+        for i in range(3):
+            time.sleep(0.03)
+            yield i
+
+    results = run_together(3, lambda: list(group.stream("key", chunks)))
+    assert results == [[0, 1, 2]] * 3
+    assert len(calls) == 1
+
+
+def test_stream_error_reaches_every_reader():
+    group = SingleFlight("test-stream-error")
+
+    def chunks():
+        yield 0
+        time.sleep(0.05)
+        raise ConnectionError("stream cut off")
+
+    def read():
+        received = []
+        try:
+            for chunk in group.stream("key", chunks):
+                received.append(chunk)
+        except ConnectionError:
+            return received
+        return None
+
+    assert run_together(3, read) == [[0]] * 3
+
+
+def test_forget_stops_new_callers_joining():
+    group = SingleFlight("test-forget")
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait()
+        return "old"
+
+    thread = threading.Thread(target=lambda: group.do("key", slow))
+    thread.start()
+    started.wait()
+    group.forget("key")
+    assert group.do("key", lambda: "new") == "new"
+    release.set()
+    thread.join()
@@ -0,0 +1,145 @@
+import os
+import time
+import uuid
+
+import pytest
+
+from storage import MemoryBackend, SQLiteBackend
+
+
+def firestore_backend():
+    """
+    FirestoreBackend on the emulator at FIRESTORE_EMULATOR_HOST, with anonymous credentials
+    """
+    if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        pytest.skip("set FIRESTORE_EMULATOR_HOST to test the Firestore backend against the emulator")
+    firebase_admin = pytest.importorskip("firebase_admin")
+    from google.auth.credentials import AnonymousCredentials
+
+    from storage import FirestoreBackend
+
+    class Anonymous(firebase_admin.credentials.Base):
+        def get_credential(self):
+            return AnonymousCredentials()
+
+    try:
+        firebase_admin.get_app()
+    except ValueError:
+        firebase_admin.initialize_app(Anonymous(), {"projectId": os.getenv("GCLOUD_PROJECT", "test")})
+    return FirestoreBackend()
+
+
+@pytest.fixture(params=["memory", "sqlite", "firestore"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryBackend()
+    if request.param == "sqlite":
+        return SQLiteBackend(str(tmp_path / "test.db"))
+    return firestore_backend()
+
+
+@pytest.fixture
+def user():
+    # The emulator keeps data between tests, so every test writes under its own user
+    return "user-" + uuid.uuid4().hex
+
+
+def item(count, expires_at, purchased_at=0.0, expiry=7):
+    return {"count": count, "units": "piece", "expiry": expiry, "carbon_footprint": 1,
+            "purchased_at": purchased_at, "expires_at": expires_at}
+
+
+def test_adding_an_item_again_adds_the_count_and_keeps_the_earliest_expiry(backend, user):
+    backend.add_many_to_inventory(user, {"egg": item(2, 500.0, purchased_at=1.0)})
+    backend.add_many_to_inventory(user, {"egg": item(3, 900.0, purchased_at=2.0)})
+    backend.add_many_to_inventory(user, {"milk": item(1, None)})
+    backend.add_many_to_inventory(user, {"milk": item(1, 50.0, purchased_at=3.0)})
+    inventory = {entry["name"]: entry for entry in backend.get_inventory(user)}
+    assert (inventory["egg"]["count"], inventory["egg"]["expires_at"], inventory["egg"]["purchased_at"]) == (5, 500, 1)
+    assert (inventory["milk"]["count"], inventory["milk"]["expires_at"], inventory["milk"]["purchased_at"]) == (2, 50, 3)
+
+
+def test_removing_returns_the_items_used_up(backend, user):
+    backend.add_many_to_inventory(user, {"egg": item(2, 500.0), "milk": item(1, 600.0)})
+    assert backend.remove_many_from_inventory(user, {"egg": 1, "milk": 1, "flour": 1}) == ["milk"]
+    assert [(entry["name"], entry["count"]) for entry in backend.get_inventory(user)] == [("egg", 1)]
+
+
+def test_inventory_is_partitioned_by_user(backend, user):
+    backend.add_many_to_inventory(user, {"egg": item(2, 500.0)})
+    assert backend.get_inventory(user + "-other") == []
+
+
+def test_inventory_pages_follow_the_cursor(backend, user):
+    backend.add_many_to_inventory(user, {name: item(1, None) for name in ("a", "b", "c", "d", "e")})
+    names, cursor = [], None
+    while True:
+        page, cursor = backend.get_inventory_page(user, 2, cursor, fields=["count"])
+        assert all(set(entry) == {"name", "count"} for entry in page)
+        names.extend(entry["name"] for entry in page)
+        if cursor is None:
+            break
+    assert names == ["a", "b", "c", "d", "e"]
+
+
+def test_expiring_items_come_soonest_first(backend, user):
+    backend.add_many_to_inventory(user, {"egg": item(1, 300.0), "milk": item(1, 100.0), "rice": item(1, None),
+                                         "ham": item(1, 200.0)})
+    assert [entry["name"] for entry in backend.get_expiring(user, 10)] == ["milk", "ham", "egg"]
+    assert [entry["name"] for entry in backend.get_expiring(user, 10, before=250.0)] == ["milk", "ham"]
+    assert [entry["name"] for entry in backend.get_expiring(user, 1)] == ["milk"]
+
+
+def test_recipe_history_is_paged_newest_first(backend, user):
+    ids = []
+    for i in range(5):
+        ids.append(backend.add_to_recipes(user, {"recipe_name": "recipe %d" % i, "points_response": i}))
+        time.sleep(0.002)
+    page, cursor = backend.get_recipe_history(user, 2)
+    assert [recipe["id"] for recipe in page] == ids[:2:-1]
+    rest = backend.get_recipes(user)
+    assert [recipe["id"] for recipe in rest] == ids[::-1]
+    names = backend.get_recipes(user, fields=["recipe_name"])
+    assert set(names[0]) == {"id", "created_at", "recipe_name"}
+    newer = backend.get_recipes(user, since=rest[2]["created_at"])
+    assert [recipe["id"] for recipe in newer] == ids[:2:-1]
+
+
+def test_points_add_up_per_window(backend, user):
+    window = "test-" + uuid.uuid4().hex
+    backend.add_points(user, [window, window + "-week"], 5, "Ann")
+    backend.add_points(user, [window], 3, "Ann B")
+    assert backend.get_scores(window) == [{"user_id": user, "name": "Ann B", "points": 8}]
+    assert backend.get_scores(window + "-week") == [{"user_id": user, "name": "Ann", "points": 5}]
+    assert backend.get_scores(window, since=time.time() + 60) == []
+
+
+def test_profile_exp_is_added_atomically(backend, user):
+    assert backend.get_profile(user) is None
+    backend.add_exp(user, 4)
+    assert backend.get_profile(user) == {"exp": 4}
+    backend.set_profile(user, {"name": "Ann", "exp": 10, "allergies": []})
+    backend.add_exp(user, 5)
+    assert backend.get_profile(user) == {"name": "Ann", "exp": 15, "allergies": []}
+
+
+def test_jobs_are_kept_until_they_expire(backend):
+    running = {"id": uuid.uuid4().hex, "status": "running", "expires_at": None}
+    done = {"id": uuid.uuid4().hex, "status": "done", "expires_at": time.time() + 60}
+    expired = {"id": uuid.uuid4().hex, "status": "done", "expires_at": time.time() - 1}
+    for job in (running, done, expired):
+        backend.set_job(job)
+    assert backend.get_job(running["id"]) == running
+    assert backend.get_job(done["id"]) == done
+    assert backend.get_job(expired["id"]) is None
+    assert backend.get_job("missing") is None
+    backend.set_job({**running, "status": "done", "expires_at": time.time() + 60})
+    assert backend.get_job(running["id"])["status"] == "done"
+
+
+def test_sqlite_schema_is_created_once(tmp_path):
+    path = str(tmp_path / "test.db")
+    SQLiteBackend(path).add_many_to_inventory("u", {"egg": item(1, None)})
+    backend = SQLiteBackend(path)
+    assert backend.connection().execute("PRAGMA user_version").fetchone()[0] == SQLiteBackend.SCHEMA_VERSION
+    assert [entry["name"] for entry in backend.get_inventory("u")] == ["egg"]
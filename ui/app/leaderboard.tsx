@@ -1,51 +1,31 @@
-import { View, Text, StyleSheet, ScrollView, Image } from 'react-native';
-import { Ionicons } from '@expo/vector-icons';
+import { View, Text, StyleSheet, ScrollView, ActivityIndicator } from 'react-native';
+import { useState, useEffect } from 'react';
+import { API_URL } from '@/constants/api';
 
-// Mock data for users
-const USERS = [
-  {
-    id: 1,
-    name: 'Sarah Chen',
-    points: 1200,
-    avatar: '🦊',
-    weeklyChange: +120,
-  },
-  {
-    id: 2,
-    name: 'Mike Johnson',
-    points: 850,
-    avatar: '🐨',
-    weeklyChange: +85,
-  },
-  {
-    id: 3,
-    name: 'Emma Davis',
-    points: 720,
-    avatar: '🐼',
-    weeklyChange: -20,
-  },
-  {
-    id: 4,
-    name: 'Alex Kim',
-    points: 500,
-    avatar: '🦁',
-    weeklyChange: +50,
-  },
-  {
-    id: 5,
-    name: 'Lisa Wang',
-    points: 350,
-    avatar: '🐸',
-    weeklyChange: +30,
-  },
-  {
-    id: 6,
-    name: 'John Smith',
-    points: 200,
-    avatar: '🐧',
-    weeklyChange: +15,
-  },
-];
+interface LeaderboardEntry {
+  rank: number;
+  user_id: string;
+  name: string | null;
+  points: number;
+  weekly_points: number;
+}
+
+interface LeaderboardResponse {
+  entries: LeaderboardEntry[];
+  users: number;
+  next_cursor: string | null;
+}
+
+const AVATARS = ['🦊', '🐨', '🐼', '🦁', '🐸', '🐧', '🐯', '🐰'];
+
+// Same avatar for a user on every load
+const getAvatar = (userId: string) => {
+  let hash = 0;
+  for (let i = 0; i < userId.length; i++) {
+    hash = (hash * 31 + userId.charCodeAt(i)) | 0;
+  }
+  return AVATARS[Math.abs(hash) % AVATARS.length];
+};
 
 const getLevelInfo = (points: number) => {
   if (points >= 1000) return { title: 'Gordon Ramsay', icon: '👑' };
@@ -56,6 +36,51 @@ const getLevelInfo = (points: number) => {
 };
 
 export default function LeaderboardScreen() {
+  const [users, setUsers] = useState<LeaderboardEntry[]>([]);
+  const [loading, setLoading] = useState(true);
+
+  const fetchLeaderboard = async () => {
+    try {
+      const response = await fetch(`${API_URL}/leaderboard?window=all&limit=50`);
+      if (!response.ok) {
+        throw new Error('Failed to fetch leaderboard');
+      }
+      const data: LeaderboardResponse = await response.json();
+      setUsers(data.entries);
+    } catch (error) {
+      console.error('Error fetching leaderboard:', error);
+    }
+  };
+
+  useEffect(() => {
+    fetchLeaderboard().finally(() => setLoading(false));
+  }, []);
+
+  const renderPodiumItem = (user: LeaderboardEntry | undefined, placeStyle: object) => {
+    if (!user) {
+      return null;
+    }
+    return (
+      <View style={[styles.podiumItem, placeStyle]}>
+        <View style={styles.avatarContainer}>
+          <Text style={styles.avatarEmoji}>{getAvatar(user.user_id)}</Text>
+          <Text style={styles.levelIcon}>{getLevelInfo(user.points).icon}</Text>
+        </View>
+        <Text style={styles.podiumName}>{user.name ?? user.user_id}</Text>
+        <Text style={styles.podiumPoints}>{user.points} pts</Text>
+        <Text style={styles.podiumPosition}>#{user.rank}</Text>
+      </View>
+    );
+  };
+
+  if (loading) {
+    return (
+      <View style={[styles.container, styles.centered]}>
+        <ActivityIndicator size="large" color="#8B4513" />
+      </View>
+    );
+  }
+
   return (
     <View style={styles.container}>
       <Text style={styles.header}>Leaderboard</Text>
@@ -66,53 +91,28 @@ export default function LeaderboardScreen() {
         showsVerticalScrollIndicator={false}
         bounces={false}
       >
+        {users.length === 0 && (
+          <Text style={styles.emptyText}>Confirm a recipe to get on the leaderboard!</Text>
+        )}
+
         {/* Top 3 Podium */}
         <View style={styles.podium}>
-          {/* Second Place */}
-          <View style={[styles.podiumItem, styles.secondPlace]}>
-            <View style={styles.avatarContainer}>
-              <Text style={styles.avatarEmoji}>{USERS[1].avatar}</Text>
-              <Text style={styles.levelIcon}>{getLevelInfo(USERS[1].points).icon}</Text>
-            </View>
-            <Text style={styles.podiumName}>{USERS[1].name}</Text>
-            <Text style={styles.podiumPoints}>{USERS[1].points} pts</Text>
-            <Text style={styles.podiumPosition}>#2</Text>
-          </View>
-
-          {/* First Place */}
-          <View style={[styles.podiumItem, styles.firstPlace]}>
-            <View style={styles.avatarContainer}>
-              <Text style={styles.avatarEmoji}>{USERS[0].avatar}</Text>
-              <Text style={styles.levelIcon}>{getLevelInfo(USERS[0].points).icon}</Text>
-            </View>
-            <Text style={styles.podiumName}>{USERS[0].name}</Text>
-            <Text style={styles.podiumPoints}>{USERS[0].points} pts</Text>
-            <Text style={styles.podiumPosition}>#1</Text>
-          </View>
-
-          {/* Third Place */}
-          <View style={[styles.podiumItem, styles.thirdPlace]}>
-            <View style={styles.avatarContainer}>
-              <Text style={styles.avatarEmoji}>{USERS[2].avatar}</Text>
-              <Text style={styles.levelIcon}>{getLevelInfo(USERS[2].points).icon}</Text>
-            </View>
-            <Text style={styles.podiumName}>{USERS[2].name}</Text>
-            <Text style={styles.podiumPoints}>{USERS[2].points} pts</Text>
-            <Text style={styles.podiumPosition}>#3</Text>
-          </View>
+          {renderPodiumItem(users[1], styles.secondPlace)}
+          {renderPodiumItem(users[0], styles.firstPlace)}
+          {renderPodiumItem(users[2], styles.thirdPlace)}
         </View>
 
         {/* Rest of the Leaderboard */}
         <View style={styles.leaderboardList}>
-          {USERS.slice(3).map((user, index) => {
+          {users.slice(3).map((user) => {
             const levelInfo = getLevelInfo(user.points);
             
             return (
-              <View key={user.id} style={styles.leaderboardItem}>
-                <Text style={styles.rank}>#{index + 4}</Text>
-                <Text style={styles.smallAvatarEmoji}>{user.avatar}</Text>
+              <View key={user.user_id} style={styles.leaderboardItem}>
+                <Text style={styles.rank}>#{user.rank}</Text>
+                <Text style={styles.smallAvatarEmoji}>{getAvatar(user.user_id)}</Text>
                 <View style={styles.userInfo}>
-                  <Text style={styles.userName}>{user.name}</Text>
+                  <Text style={styles.userName}>{user.name ?? user.user_id}</Text>
                   <Text style={styles.userLevel}>{levelInfo.title}</Text>
                 </View>
                 <View style={styles.pointsContainer}>
@@ -120,10 +120,10 @@ export default function LeaderboardScreen() {
                   <Text 
                     style={[
                       styles.weeklyChange,
-                      { color: user.weeklyChange >= 0 ? '#4CAF50' : '#F44336' }
+                      { color: user.weekly_points > 0 ? '#4CAF50' : '#666' }
                     ]}
                   >
-                    {user.weeklyChange >= 0 ? '+' : ''}{user.weeklyChange}
+                    +{user.weekly_points}
                   </Text>
                 </View>
                 <Text style={styles.levelIcon}>{levelInfo.icon}</Text>
@@ -142,6 +142,16 @@ const styles = StyleSheet.create({
     backgroundColor: '#fff',
     paddingTop: 60,
   },
+  centered: {
+    justifyContent: 'center',
+    alignItems: 'center',
+  },
+  emptyText: {
+    fontSize: 16,
+    color: '#666',
+    textAlign: 'center',
+    marginTop: 40,
+  },
   header: {
     fontSize: 28,
     fontWeight: 'bold',
@@ -39,7 +39,8 @@ export default function RecipeDetailScreen() {
     try {
       setLoading(true);
       setLoadingMessage('Generating new recipe...');
-      const response = await fetch(`${API_URL}/recipes/generate`);
+      // fresh=1 asks the model for a new recipe instead of serving a stored match again
+      const response = await fetch(`${API_URL}/recipes/generate?fresh=1`);
       if (!response.ok) {
         throw new Error('Failed to generate recipe');
       }